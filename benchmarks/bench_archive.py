@@ -0,0 +1,116 @@
+"""Archival and export at scale.
+
+Seeds ``--chats`` chat rows in the throwaway ``icd_bench`` schema (sessions of
+20 turns, ``--idle`` of them untouched for 200 days) plus one active user, then:
+
+* times ``load_chat_turn`` and ``get_chats_page`` of the active user's session
+  and measures ``chats`` (table + indexes) before archiving, after
+  ``server.archive`` with plain VACUUM, and after VACUUM FULL;
+* reports the size of ``chats_archive`` against the hot rows it replaced;
+* exports a user with ``--export-sessions`` x 100 turns as NDJSON and Parquet
+  (``server.export``), and loads the same history with
+  ``get_user_sessions_with_messages`` (everything in memory at once), with
+  the peak Python memory of each.
+
+    python -m benchmarks.bench_archive --chats 1000000
+"""
+import argparse
+import time
+import tracemalloc
+
+from benchmarks.common import use_bench_schema, reset_schema, measure
+
+use_bench_schema()
+
+import server.db.db as dbx
+from server.archive import archive_idle
+from server.export import export_chunks
+from server.prompt import CHAT_HISTORY_MAX_TURNS
+from server.summary import MEMORY_LOAD_DIGESTS
+from server.facts import SESSION_FACTS_MAX
+from benchmarks.bench_queries import seed_user
+from benchmarks.bench_session_list import grow_to
+
+
+def mb(n: int) -> str:
+    return f"{n / 1_048_576:.1f} MB"
+
+
+def age_sessions(share: float):
+    """Make ``share`` of the background sessions 200 days idle."""
+    with dbx.get_connection() as conn:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE chat_sessions
+                       SET last_activity = last_activity - interval '170 days'
+                     WHERE session_name = 'bg' AND random() < %s
+                """, (share,))
+
+
+def report(label: str, cases: dict):
+    s = dbx.get_archive_stats()
+    timings = "  ".join(f"{name} {measure(fn, 200)['median_ms']:.3f} ms" for name, fn in cases.items())
+    print(f"{label:<16} chats {s['chats']:>9} rows {mb(s['chats_bytes']):>10} (indexes {mb(s['chats_index_bytes'])})  {timings}")
+    return s
+
+
+def timed_with_peak(fn) -> tuple[float, float, object]:
+    """``(seconds, peak MB of Python allocations, result)``; timed without
+    tracemalloc, which slows allocations down, then run again under it."""
+    t0 = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - t0
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak / 1_048_576, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=1_000_000, help="background chat rows")
+    parser.add_argument("--idle", type=float, default=0.8, help="share of background sessions to archive")
+    parser.add_argument("--users", type=int, default=1000, help="background users")
+    parser.add_argument("--export-sessions", type=int, default=200, help="sessions of 100 turns for the export user")
+    args = parser.parse_args()
+
+    reset_schema()
+    user_id, (session_id,) = seed_user("bench_active", 1, 200)
+    grow_to(args.chats, 20, args.users)
+    age_sessions(args.idle)
+    cases = {
+        "load_chat_turn": lambda: dbx.load_chat_turn(
+            session_id, user_id, CHAT_HISTORY_MAX_TURNS, MEMORY_LOAD_DIGESTS, SESSION_FACTS_MAX,
+        ),
+        "get_chats_page": lambda: dbx.get_chats_page(session_id, 51),
+    }
+    dbx.vacuum_chats()
+    before = report("before", cases)
+
+    t0 = time.perf_counter()
+    sessions, chats = archive_idle(90, 200)
+    print(f"archived {sessions} sessions / {chats} chats in {time.perf_counter() - t0:.1f}s")
+    dbx.vacuum_chats()
+    report("vacuum", cases)
+    dbx.vacuum_chats(full=True)
+    after = report("vacuum full", cases)
+    print(
+        f"chats_archive    {after['archived_chats']} chats in {mb(after['archive_bytes'])}; "
+        f"they took {mb(before['chats_bytes'] - after['chats_bytes'])} in chats"
+    )
+
+    export_user, _ = seed_user("bench_export", args.export_sessions, 100)
+    rows = args.export_sessions * 100
+    for fmt in ("ndjson", "parquet"):
+        elapsed, peak, size = timed_with_peak(
+            lambda f=fmt: sum(len(c) for c in export_chunks(dbx.iter_user_export(export_user), f))
+        )
+        print(f"export {fmt:<8} {rows} rows in {elapsed:.2f}s ({rows / elapsed:,.0f} rows/s), {mb(size)}, peak {peak:.1f} MB")
+    elapsed, peak, _ = timed_with_peak(lambda: dbx.get_user_sessions_with_messages(export_user))
+    print(f"in memory       {rows} rows in {elapsed:.2f}s, peak {peak:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
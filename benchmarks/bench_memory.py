@@ -0,0 +1,133 @@
+"""Answer-prompt and memory-upkeep tokens per turn as a session grows.
+
+Replays one ``--turns`` long session in the throwaway ``icd_bench`` schema and
+builds the answer prompt at each checkpoint, two ways:
+
+* ``timeline``: the previous behaviour. Every few turns the whole summary
+  plus the new turns were re-summarized into a numbered timeline that
+  gained a line per turn, and all of it went into every prompt.
+* ``rolling``: ``SummaryWorker`` with digests and a capped summary
+  (server/summary.py), loaded with ``dbx.load_chat_turn`` as ``/chat`` does.
+
+A stand-in model answers the summary prompts with replies of the length a
+model gives (one ~``--digest-words`` line per turn, summaries as long as
+they are asked to be), so no OpenAI calls are made. "upkeep" is the
+summary/digest tokens (prompt + completion) per turn since the previous
+checkpoint.
+
+    python -m benchmarks.bench_memory --turns 500
+"""
+import argparse
+import re
+import uuid
+from types import SimpleNamespace
+
+from benchmarks.common import use_bench_schema, reset_schema
+
+use_bench_schema()
+
+import server.db.db as dbx
+from server.context import SYSTEM_PROMPT
+from server.prompt import build_messages, CHAT_HISTORY_MAX_TURNS
+from server.summary import (
+    SummaryWorker, digest_turns, compact_summary, memory_text, summary_due, MEMORY_LOAD_DIGESTS,
+    SUMMARY_EVERY_N_TURNS, SUMMARY_MAX_TOKENS,
+)
+from server.facts import SESSION_FACTS_MAX
+from server.tokens import estimate_tokens
+
+CHECKPOINTS = (10, 25, 50, 100, 250, 500, 1000)
+
+
+def words(n: int, seed: str = "coding") -> str:
+    return " ".join([seed] + ["detail"] * max(n - 1, 0))
+
+
+class FakeModel:
+    """``client.chat.completions.create`` for the summary prompts; counts tokens."""
+
+    def __init__(self, digest_words: int):
+        self.digest_words = digest_words
+        self.tokens = 0
+        self.chat = self.completions = self
+
+    def create(self, model, messages, temperature=0.0, max_tokens=None):
+        prompt = messages[-1]["content"]
+        if m := re.search(r"Reply with exactly (\d+) lines", prompt):
+            text = "\n".join(f"{i}. {words(self.digest_words)}" for i in range(1, int(m.group(1)) + 1))
+        elif m := re.search(r"Write at most (\d+) words", prompt):
+            text = words(int(m.group(1)))
+        else:
+            # timeline: the previous steps, then one numbered step per new exchange
+            previous = prompt.split("Previous summary:", 1)[1].split("New conversation:", 1)[0].strip()
+            steps = [] if previous == "None" else previous.splitlines()
+            new = prompt.split("New conversation:", 1)[1].count("User:")
+            steps += [f"{len(steps) + i}. {words(self.digest_words)}" for i in range(1, new + 1)]
+            text = "\n".join(steps)
+        usage = SimpleNamespace(prompt_tokens=estimate_tokens(prompt), completion_tokens=estimate_tokens(text))
+        self.tokens += usage.prompt_tokens + usage.completion_tokens
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))], usage=usage)
+
+
+def timeline_summary(client, previous_summary: str, turns) -> str:
+    """The summary call /chat used before digests."""
+    conversation = "\n".join(f"User: {t['user_message']}\nAssistant: {t['ai_response']}" for t in turns)
+    prompt = f"""
+    Summarize the following conversation in a structured, chronological timeline for future reference.
+    Keep it concise but preserve the order of what the user asked and how the assistant responded.
+    Do not merge or rephrase the sequence into a single narrative—use numbered steps.
+
+    Previous summary:
+    {previous_summary or "None"}
+
+    New conversation:
+    {conversation}
+    """
+    resp = client.chat.completions.create(model="fake", messages=[{"role": "user", "content": prompt}])
+    return resp.choices[0].message.content
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=500)
+    parser.add_argument("--question-words", type=int, default=25)
+    parser.add_argument("--answer-words", type=int, default=180)
+    parser.add_argument("--digest-words", type=int, default=35, help="stand-in model words per digest or timeline step")
+    args = parser.parse_args()
+
+    reset_schema()
+    user_id = dbx.insert_user(f"bench_memory_{uuid.uuid4().hex[:6]}", "x")
+    session_id = dbx.create_session(user_id, "bench")
+    rolling_model, timeline_model = FakeModel(args.digest_words), FakeModel(args.digest_words)
+    worker = SummaryWorker(
+        lambda turns: digest_turns(rolling_model, "fake", turns),
+        lambda summary, digests: compact_summary(rolling_model, "fake", summary, digests),
+    )
+    timeline, pending = "", []
+    question = words(args.question_words, "question")
+    last = {"turn": 0, "timeline": 0, "rolling": 0}
+
+    print(f"{'turns':>6}  {'timeline prompt':>15} {'upkeep/turn':>11}  {'rolling prompt':>14} {'upkeep/turn':>11} {'memory':>7}")
+    for turn in range(1, args.turns + 1):
+        chat_id = dbx.insert_chat(session_id, question, words(args.answer_words, "answer"))
+        pending.append({"id": chat_id, "user_message": question, "ai_response": words(args.answer_words, "answer")})
+        if summary_due(pending, SUMMARY_EVERY_N_TURNS, SUMMARY_MAX_TOKENS):
+            timeline, pending = timeline_summary(timeline_model, timeline, pending), []
+        worker.process(session_id)
+
+        if turn not in CHECKPOINTS and turn != args.turns:
+            continue
+        loaded = dbx.load_chat_turn(session_id, user_id, CHAT_HISTORY_MAX_TURNS, MEMORY_LOAD_DIGESTS, SESSION_FACTS_MAX)
+        _, old = build_messages(SYSTEM_PROMPT, timeline, loaded["recent"], question)
+        _, new = build_messages(SYSTEM_PROMPT, memory_text(loaded["memory"], loaded["recent"]), loaded["recent"], question)
+        n = turn - last["turn"]
+        print(
+            f"{turn:>6}  {old['total']:>15} {(timeline_model.tokens - last['timeline']) / n:>11.0f}  "
+            f"{new['total']:>14} {(rolling_model.tokens - last['rolling']) / n:>11.0f} {new['summary']:>7}",
+            flush=True,
+        )
+        last = {"turn": turn, "timeline": timeline_model.tokens, "rolling": rolling_model.tokens}
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""Micro-benchmarks for the history/sidebar hot paths as the tables grow.
+
+Seeds target users and sessions of several sizes in the throwaway
+``icd_bench`` schema (see bench_session_list.py), then, at each total
+``chats`` row count, times:
+
+* ``list_sessions_with_preview`` for users with ``--user-sessions`` sessions
+* ``get_user_sessions_with_messages`` for the same users
+* ``get_history_pairs`` for sessions with ``--history-turns`` turns
+* ``load_chat_turn`` (ownership, summary and recent turns of a chat) for the same sessions
+* ``get_chats_page`` (the newest page of ``GET /sessions/<id>/messages``) for the same sessions
+
+and counts the SQL statements each call issues.
+
+    python -m benchmarks.bench_queries --sizes 10000 100000 1000000
+    python -m benchmarks.bench_queries --save baseline.json
+    python -m benchmarks.bench_queries --baseline baseline.json   # exits 1 on a regression
+"""
+import argparse
+import json
+import os
+import sys
+
+# count statements on every pooled connection of this process
+os.environ["DB_COUNT_QUERIES"] = "1"
+
+from benchmarks.common import use_bench_schema, reset_schema, measure
+
+use_bench_schema()
+
+import server.db.db as dbx
+from server.db import querycount
+from server.prompt import CHAT_HISTORY_MAX_TURNS
+from server.summary import MEMORY_LOAD_DIGESTS
+from server.facts import SESSION_FACTS_MAX
+from server.pagination import MESSAGES_PAGE_SIZE
+from benchmarks.bench_session_list import grow_to
+
+TURNS_PER_SESSION = 10
+
+
+def seed_user(name: str, sessions: int, turns: int) -> tuple[int, list[int]]:
+    """A user with ``sessions`` sessions of ``turns`` turns each."""
+    user_id = dbx.insert_user(name, "x")
+    with dbx.get_connection() as conn:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "INSERT INTO chat_sessions (user_id, session_name) SELECT %s, 'Chat ' || g "
+                    "FROM generate_series(1, %s) g RETURNING id",
+                    (user_id, sessions),
+                )
+                session_ids = [r[0] for r in cur.fetchall()]
+                cur.execute("""
+                    INSERT INTO chats (session_id, user_message, ai_response, created_at)
+                    SELECT s.sid, 'What is J18.' || g || '?', repeat('answer ', 40),
+                           now() - interval '1 day' + g * interval '1 second'
+                      FROM unnest(%s::int[]) AS s(sid)
+                     CROSS JOIN generate_series(1, %s) g
+                """, (session_ids, turns))
+                cur.execute("""
+                    UPDATE chat_sessions cs
+                       SET last_activity = agg.last_activity, first_user_message = agg.first_user_message
+                      FROM (SELECT session_id, MAX(created_at) AS last_activity, MIN(user_message) AS first_user_message
+                              FROM chats WHERE session_id = ANY(%s) GROUP BY session_id) agg
+                     WHERE cs.id = agg.session_id
+                """, (session_ids,))
+    return user_id, session_ids
+
+
+def run_case(fn, repeat: int) -> dict:
+    querycount.begin()
+    fn()
+    queries = querycount.count()
+    return {**measure(fn, repeat), "queries": queries}
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Cases slower than ``baseline`` by more than ``tolerance``, or issuing more queries."""
+    regressions = []
+    for label, r in results.items():
+        b = baseline.get(label)
+        if b is None:
+            continue
+        if r["queries"] > b["queries"]:
+            regressions.append(f"{label}: {b['queries']} -> {r['queries']} queries")
+        if r["median_ms"] > b["median_ms"] * (1 + tolerance):
+            regressions.append(f"{label}: {b['median_ms']:.3f} -> {r['median_ms']:.3f} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000], help="total chat rows")
+    parser.add_argument("--user-sessions", type=int, nargs="+", default=[10, 100])
+    parser.add_argument("--history-turns", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--users", type=int, default=1000, help="background users")
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument("--save", help="write results as JSON (e.g. a baseline)")
+    parser.add_argument("--baseline", help="JSON from --save to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed median slowdown vs the baseline")
+    args = parser.parse_args()
+
+    reset_schema()
+    users = {n: seed_user(f"bench_sessions_{n}", n, TURNS_PER_SESSION)[0] for n in args.user_sessions}
+    histories = {}
+    for n in args.history_turns:
+        user_id, session_ids = seed_user(f"bench_turns_{n}", 1, n)
+        histories[n] = (user_id, session_ids[0])
+
+    results = {}
+    print(f"{'chats':>9}  {'case':<48} {'median ms':>10} {'p95 ms':>9} {'queries':>8}")
+    for size in sorted(args.sizes):
+        grow_to(size, 20, args.users)
+        cases = []
+        for n, user_id in users.items():
+            cases.append((f"list_sessions_with_preview[sessions={n}]", lambda u=user_id: dbx.list_sessions_with_preview(u)))
+            cases.append((f"get_user_sessions_with_messages[sessions={n}]", lambda u=user_id: dbx.get_user_sessions_with_messages(u)))
+        for n, (user_id, session_id) in histories.items():
+            cases.append((f"get_history_pairs[turns={n}]", lambda s=session_id: dbx.get_history_pairs(s)))
+            cases.append((
+                f"load_chat_turn[turns={n}]",
+                lambda s=session_id, u=user_id: dbx.load_chat_turn(s, u, CHAT_HISTORY_MAX_TURNS, MEMORY_LOAD_DIGESTS, SESSION_FACTS_MAX),
+            ))
+            cases.append((f"get_chats_page[turns={n}]", lambda s=session_id: dbx.get_chats_page(s, MESSAGES_PAGE_SIZE + 1)))
+        for name, fn in cases:
+            r = results[f"{name}@{size}"] = run_case(fn, args.repeat)
+            print(f"{size:>9}  {name:<48} {r['median_ms']:>10.3f} {r['p95_ms']:>9.3f} {r['queries']:>8}", flush=True)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Sidebar query latency as the chats table grows.
+
+Seeds a throwaway ``icd_bench`` schema in the configured database (DB_* env
+vars) and times ``list_sessions_with_preview`` for one user with a fixed
+number of sessions while the total number of chat rows grows. The previous
+correlated-subquery version is timed alongside for comparison.
+
+    python -m benchmarks.bench_session_list --sizes 10000 100000 1000000 3000000
+"""
+import argparse
+
+from benchmarks.common import use_bench_schema, reset_schema, measure
+
+# every pooled connection in this process uses the bench schema
+use_bench_schema()
+
+import server.db.db as dbx
+
+LEGACY_SQL = """
+SELECT
+  cs.id,
+  cs.session_name,
+  cs.started_at,
+  (SELECT c.user_message
+     FROM chats c
+    WHERE c.session_id = cs.id
+      AND c.user_message IS NOT NULL
+    ORDER BY c.created_at ASC, c.id ASC
+    LIMIT 1) AS first_user_message,
+  (SELECT MAX(c.created_at)
+     FROM chats c
+    WHERE c.session_id = cs.id) AS last_activity
+FROM chat_sessions cs
+WHERE cs.user_id = %s
+ORDER BY COALESCE(
+           (SELECT MAX(c.created_at) FROM chats c WHERE c.session_id = cs.id),
+           cs.started_at
+         ) DESC, cs.id DESC;
+"""
+
+
+def grow_to(total_chats: int, chats_per_session: int, users: int):
+    """Add background users/sessions/chats until ``chats`` holds ``total_chats`` rows."""
+    with dbx.get_connection() as conn:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT COUNT(*) FROM chats")
+                have = cur.fetchone()[0]
+                missing = total_chats - have
+                if missing <= 0:
+                    return
+                cur.execute("""
+                    INSERT INTO users (username, password_hash)
+                    SELECT 'bench_' || g, 'x' FROM generate_series(1, %s) g
+                    ON CONFLICT (username) DO NOTHING
+                """, (users,))
+                sessions = -(-missing // chats_per_session)
+                cur.execute("""
+                    INSERT INTO chat_sessions (user_id, session_name, started_at, last_activity)
+                    SELECT u.id, 'bg', now() - interval '30 days', now() - interval '30 days'
+                      FROM generate_series(1, %s) g
+                      JOIN users u ON u.username = 'bench_' || (1 + g %% %s)
+                    RETURNING id
+                """, (sessions, users))
+                session_ids = [r[0] for r in cur.fetchall()]
+                cur.execute("""
+                    INSERT INTO chats (session_id, user_message, ai_response, created_at)
+                    SELECT s.sid, 'question ' || g, repeat('answer ', 40),
+                           now() - interval '30 days' + g * interval '1 second'
+                      FROM unnest(%s::int[]) AS s(sid)
+                     CROSS JOIN generate_series(1, %s) g
+                     LIMIT %s
+                """, (session_ids, chats_per_session, missing))
+                cur.execute("""
+                    UPDATE chat_sessions cs
+                       SET last_activity = agg.last_activity,
+                           first_user_message = agg.first_user_message
+                      FROM (SELECT session_id, MAX(created_at) AS last_activity,
+                                   MIN(user_message) AS first_user_message
+                              FROM chats WHERE session_id = ANY(%s) GROUP BY session_id) agg
+                     WHERE cs.id = agg.session_id
+                """, (session_ids,))
+    with dbx.get_connection() as conn:
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("ANALYZE")
+        conn.autocommit = False
+
+
+def seed_target_user(sessions: int, chats_per_session: int) -> int:
+    user_id = dbx.insert_user("bench_target", "x")
+    for i in range(sessions):
+        sid = dbx.create_session(user_id, f"Chat {i}")
+        for j in range(chats_per_session):
+            dbx.insert_chat(sid, f"What is J18.{j}?", "answer " * 40)
+    return user_id
+
+
+def legacy_list(user_id: int):
+    with dbx.get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(LEGACY_SQL, (user_id,))
+            return cur.fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--target-sessions", type=int, default=50)
+    parser.add_argument("--chats-per-session", type=int, default=20)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--skip-legacy", action="store_true", help="don't time the old query (slow at large sizes)")
+    args = parser.parse_args()
+
+    reset_schema()
+    user_id = seed_target_user(args.target_sessions, 2)
+
+    print(f"{'chats':>10} {'new (ms)':>10} {'legacy (ms)':>12}")
+    for size in sorted(args.sizes):
+        grow_to(size, args.chats_per_session, args.users)
+        new_ms = measure(lambda: dbx.list_sessions_with_preview(user_id), args.repeat)["median_ms"]
+        legacy = "-" if args.skip_legacy else f"{measure(lambda: legacy_list(user_id), args.repeat)['median_ms']:.3f}"
+        print(f"{size:>10} {new_ms:>10.3f} {legacy:>12}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Cold start of a backend worker: import time, time until it is live and
+ready, and its first requests.
+
+For each ``--server``, ``--runs`` times:
+
+* ``import``: ``python -c "import server.backend"`` (``server.asgi``), minus
+  the interpreter's own startup;
+* ``live``: process start until ``GET /health`` answers;
+* ``ready``: process start until ``GET /ready`` answers 200 (``/health`` on
+  servers without ``/ready``);
+* ``login`` / ``chat``: the first ``POST /login`` and ``POST /chat`` after that.
+
+The schema is migrated once up front, as a deploy would; chats are answered
+by the fake OpenAI server.
+
+    python -m benchmarks.bench_startup --runs 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+
+import httpx
+
+from benchmarks.common import SERVERS, use_bench_schema, reset_schema, start_fake_openai, stop_server
+
+MODULES = {"flask": "server.backend", "asgi": "server.asgi"}
+
+
+def run_ms(cmd, env) -> float:
+    t0 = time.perf_counter()
+    subprocess.run(cmd, env=env, check=True, stdout=subprocess.DEVNULL)
+    return (time.perf_counter() - t0) * 1000
+
+
+def wait_for(url: str, ok, proc: subprocess.Popen, timeout: float = 60.0) -> httpx.Response:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited with {proc.returncode}")
+        try:
+            r = httpx.get(url, timeout=5.0)
+            if ok(r):
+                return r
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.005)
+    raise RuntimeError(f"{url} not up after {timeout}s")
+
+
+def cold_start(name: str, port: int, env: dict) -> dict:
+    base = f"http://127.0.0.1:{port}"
+    cmd = [part.format(port=port) for part in SERVERS[name]]
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+    try:
+        wait_for(f"{base}/health", lambda r: r.status_code == 200, proc)
+        live = time.perf_counter() - t0
+        wait_for(f"{base}/ready", lambda r: r.status_code in (200, 404), proc)
+        ready = time.perf_counter() - t0
+        with httpx.Client(base_url=base, timeout=30.0) as client:
+            creds = {"username": f"startup_{uuid.uuid4().hex[:8]}", "password": "startup"}
+            client.post("/register", json=creds).raise_for_status()
+            t1 = time.perf_counter()
+            client.post("/login", json=creds).raise_for_status()
+            login = time.perf_counter() - t1
+            t1 = time.perf_counter()
+            client.post("/chat", json={"message": "coding question about chest pain workup"}).raise_for_status()
+            chat = time.perf_counter() - t1
+    finally:
+        stop_server(proc)
+    return {"live": live * 1000, "ready": ready * 1000, "login": login * 1000, "chat": chat * 1000}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", nargs="+", default=["flask", "asgi"], choices=sorted(MODULES))
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=5140)
+    parser.add_argument("--openai-port", type=int, default=8118)
+    args = parser.parse_args()
+
+    use_bench_schema()
+    reset_schema()
+    env = {
+        **os.environ,
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{args.openai_port}/v1",
+        "OPENAI_API_KEY": os.getenv("OPENAI_API_KEY", "bench"),
+    }
+    fake = start_fake_openai(args.openai_port, "--latency", "0.05")
+    try:
+        python_ms = statistics.median(run_ms([sys.executable, "-c", "pass"], env) for _ in range(args.runs))
+        print(f"{'server':<8} {'import ms':>10} {'live ms':>9} {'ready ms':>9} {'login ms':>9} {'chat ms':>8}")
+        for name in args.server:
+            imports = [run_ms([sys.executable, "-c", f"import {MODULES[name]}"], env) - python_ms for _ in range(args.runs)]
+            runs = [cold_start(name, args.port, env) for _ in range(args.runs)]
+            median = {k: statistics.median(r[k] for r in runs) for k in runs[0]}
+            print(
+                f"{name:<8} {statistics.median(imports):>10.0f} {median['live']:>9.0f} {median['ready']:>9.0f} "
+                f"{median['login']:>9.0f} {median['chat']:>8.0f}",
+                flush=True,
+            )
+    finally:
+        fake.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Shared plumbing for the benchmarks: the throwaway schema, timing helpers
+and starting/stopping the fake OpenAI server and the backends."""
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+BENCH_SCHEMA = "icd_bench"
+
+SERVERS = {
+    # the current path: Flask's threaded server, as `python -m server.backend` runs it
+    "flask": [sys.executable, "-m", "flask", "--app", "server.backend", "run", "--port", "{port}"],
+    "asgi": [sys.executable, "-m", "hypercorn", "server.asgi:create_app()", "--bind", "127.0.0.1:{port}"],
+    "asgi-uvicorn": [
+        sys.executable, "-m", "uvicorn", "--factory", "server.asgi:create_app", "--port", "{port}", "--log-level", "warning",
+    ],
+}
+
+
+def use_bench_schema():
+    """Point every connection opened by this process (and the servers it
+    starts) at ``icd_bench``; call before the first query."""
+    os.environ["PGOPTIONS"] = f"-c search_path={BENCH_SCHEMA}"
+
+
+def reset_schema():
+    """Drop and recreate ``icd_bench`` with the current tables."""
+    import psycopg2
+
+    import server.db.db as dbx
+    from server.db.pool import db_settings, get_pool
+
+    conn = psycopg2.connect(**db_settings(), options="-c search_path=public")
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+        cur.execute(f"CREATE SCHEMA {BENCH_SCHEMA}")
+    conn.close()
+    get_pool().closeall()
+    dbx.create_tables()
+
+
+def percentile(samples, p: int) -> float:
+    if len(samples) < 2:
+        return samples[0] if samples else 0.0
+    return statistics.quantiles(samples, n=100, method="inclusive")[p - 1]
+
+
+def measure(fn, repeat: int) -> dict:
+    """Median / p95 wall time of ``fn()`` in ms, after one warm-up call."""
+    fn()
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return {"median_ms": statistics.median(samples), "p95_ms": percentile(samples, 95)}
+
+
+def cpu_seconds(pgid: int) -> float | None:
+    """User + system CPU time of every process in group ``pgid`` (Linux only);
+    hypercorn serves from a child process."""
+    if not os.path.isdir("/proc"):
+        return None
+    ticks = 0
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[2]) == pgid:
+            ticks += int(fields[11]) + int(fields[12])
+    return ticks / os.sysconf("SC_CLK_TCK")
+
+
+def wait_healthy(url: str, proc: subprocess.Popen | None, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc is not None and proc.poll() is not None:
+            raise RuntimeError(f"server exited with {proc.returncode}")
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} not up after {timeout}s")
+
+
+NO_LLM_LIMITS = {"LLM_REQUESTS_PER_MIN": "1000000", "LLM_TOKENS_PER_MIN": "1000000000"}
+
+
+def start_fake_openai(port: int, *args: str) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.fake_openai", "--port", str(port), *args],
+        stdout=subprocess.DEVNULL,
+    )
+
+
+def start_server(name: str, port: int, env: dict) -> subprocess.Popen:
+    """Start a backend in its own process group, so worker processes are
+    measured and stopped with it, and wait for ``/ready``."""
+    cmd = [part.format(port=port) for part in SERVERS[name]]
+    # the fake OpenAI has no rate limit, so neither has the LLM gateway unless the caller sets one
+    env = {**NO_LLM_LIMITS, **env}
+    proc = subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+    try:
+        wait_healthy(f"http://127.0.0.1:{port}/ready", proc)
+    except Exception:
+        stop_server(proc)
+        raise
+    return proc
+
+
+def stop_server(proc: subprocess.Popen):
+    # a graceful stop drains the queued summaries; not worth waiting for here
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    proc.wait()
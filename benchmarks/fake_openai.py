@@ -0,0 +1,144 @@
+"""OpenAI-compatible stand-in for load tests: set latency, no API key, no cost.
+
+    python -m benchmarks.fake_openai --port 8111 --latency 1.0
+
+Point the backend at it with ``OPENAI_BASE_URL=http://127.0.0.1:8111/v1``.
+Serves ``POST /v1/chat/completions`` (JSON or ``stream=True`` SSE). It runs on
+asyncio, so thousands of requests can wait out their latency at once and the
+server under test, not this process, is the bottleneck.
+
+``--rpm`` answers 429 with ``Retry-After`` beyond that many requests in any
+60 seconds, like OpenAI's own limit.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import deque
+
+
+def completion_text(body: dict, words: int) -> str:
+    last = body["messages"][-1]["content"]
+    return " ".join([f"Answer to: {last[:40]}"] + ["lorem"] * max(words - 3, 0))
+
+
+def usage(body: dict, text: str) -> dict:
+    prompt = sum(len(m["content"]) for m in body["messages"]) // 4
+    completion = len(text) // 4
+    return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+
+
+class FakeOpenAI:
+    def __init__(self, latency: float, words: int, token_delay: float, jitter: float = 0.0, rpm: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.words = words
+        self.token_delay = token_delay
+        self.requests = 0
+        self.rpm = rpm
+        self.limited = 0
+        self._recent = deque()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                lines = head.decode("latin-1").split("\r\n")
+                headers = {k.lower(): v.strip() for k, v in (l.split(":", 1) for l in lines[1:] if ":" in l)}
+                raw = await reader.readexactly(int(headers.get("content-length", "0")))
+                await self.respond(lines[0], raw, writer)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def over_limit(self) -> int:
+        """Seconds until another request is allowed under ``rpm``; 0 to serve it."""
+        if not self.rpm:
+            return 0
+        now = time.monotonic()
+        while self._recent and self._recent[0] <= now - 60:
+            self._recent.popleft()
+        if len(self._recent) >= self.rpm:
+            return int(self._recent[0] + 60 - now) + 1
+        self._recent.append(now)
+        return 0
+
+    async def respond(self, request_line: str, raw: bytes, writer: asyncio.StreamWriter):
+        method, path, _ = request_line.split(" ", 2)
+        if method != "POST" or not path.endswith("/chat/completions"):
+            writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n")
+            await writer.drain()
+            return
+        self.requests += 1
+        retry_after = self.over_limit()
+        if retry_after:
+            self.limited += 1
+            payload = json.dumps({"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}}).encode()
+            writer.write(
+                b"HTTP/1.1 429 Too Many Requests\r\nContent-Type: application/json\r\n"
+                + f"Retry-After: {retry_after}\r\nContent-Length: {len(payload)}\r\n\r\n".encode() + payload
+            )
+            await writer.drain()
+            return
+        body = json.loads(raw)
+        text = completion_text(body, self.words)
+        await asyncio.sleep(max(0.0, random.uniform(self.latency - self.jitter, self.latency + self.jitter)))
+        created = int(time.time())
+        if not body.get("stream"):
+            payload = json.dumps({
+                "id": "chatcmpl-fake", "object": "chat.completion", "created": created, "model": body["model"],
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": usage(body, text),
+            }).encode()
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                + f"Content-Length: {len(payload)}\r\n\r\n".encode() + payload
+            )
+            await writer.drain()
+            return
+
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n")
+
+        async def send(data: dict | str):
+            line = f"data: {data if isinstance(data, str) else json.dumps(data)}\n\n".encode()
+            writer.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+            await writer.drain()
+
+        chunk = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": created, "model": body["model"]}
+        for word in text.split(" "):
+            await send({**chunk, "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}]})
+            if self.token_delay:
+                await asyncio.sleep(self.token_delay)
+        await send({**chunk, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        if (body.get("stream_options") or {}).get("include_usage"):
+            await send({**chunk, "choices": [], "usage": usage(body, text)})
+        await send("[DONE]")
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+
+async def serve(host: str, port: int, fake: FakeOpenAI):
+    server = await asyncio.start_server(fake.handle, host, port, backlog=4096)
+    print(f"fake OpenAI on http://{host}:{port}/v1 (latency {fake.latency}s)", flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8111)
+    parser.add_argument("--latency", type=float, default=1.0, help="seconds before the first byte of every completion")
+    parser.add_argument("--jitter", type=float, default=0.0, help="latency varies uniformly by +/- this many seconds")
+    parser.add_argument("--words", type=int, default=40, help="words per completion")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="seconds between streamed words")
+    parser.add_argument("--rpm", type=int, default=0, help="answer 429 beyond this many requests a minute (0: no limit)")
+    args = parser.parse_args()
+    fake = FakeOpenAI(args.latency, args.words, args.token_delay, args.jitter, args.rpm)
+    asyncio.run(serve(args.host, args.port, fake))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Concurrent /chat load test: Flask (server/backend.py) vs ASGI (server/asgi.py).
+
+Starts the fake OpenAI server (benchmarks/fake_openai.py) and each backend in
+turn against the configured database (DB_* env vars), then drives N chats in
+flight at once and reports throughput and latency percentiles per level.
+
+    python -m benchmarks.load_chat --concurrency 50 200 1000 --latency 1.0
+    python -m benchmarks.load_chat --url http://127.0.0.1:5000 --concurrency 100   # an already running server
+
+Every message is unique, so neither the answer cache nor request coalescing
+kicks in and every chat costs one upstream call. High levels need a raised
+open-file limit (``ulimit -n 65536``).
+"""
+import argparse
+import asyncio
+import http.cookiejar
+import os
+import time
+import uuid
+
+import httpx
+
+from benchmarks.common import SERVERS, cpu_seconds, percentile, start_fake_openai, start_server, stop_server
+
+async def login_users(client: httpx.AsyncClient, base: str, n: int):
+    """Register and log in ``n`` users; returns ``(cookie, session_id)`` per user."""
+    run = uuid.uuid4().hex[:8]
+
+    async def one(i: int):
+        creds = {"username": f"load_{run}_{i}", "password": "load-test"}
+        await client.post(f"{base}/register", json=creds)
+        r = await client.post(f"{base}/login", json=creds)
+        r.raise_for_status()
+        cookie = f"session={r.cookies['session']}"
+        r = await client.post(f"{base}/sessions", json={"name": "load"}, headers={"Cookie": cookie})
+        return cookie, r.json()["session_id"]
+
+    sem = asyncio.Semaphore(50)  # registration hashes passwords; don't measure that
+
+    async def bounded(i: int):
+        async with sem:
+            return await one(i)
+
+    return await asyncio.gather(*(bounded(i) for i in range(n)))
+
+
+async def run_level(base: str, concurrency: int, requests: int, stream: bool, pgid: int | None = None):
+    limits = httpx.Limits(max_connections=concurrency + 10, max_keepalive_connections=concurrency + 10)
+    # one client for all virtual users: the shared jar must not keep anyone's cookie
+    no_cookies = http.cookiejar.CookieJar(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+    async with httpx.AsyncClient(limits=limits, timeout=300.0, cookies=no_cookies) as client:
+        users = await login_users(client, base, concurrency)
+        latencies, errors = [], 0
+        remaining = requests
+        path = "/chat/stream" if stream else "/chat"
+
+        async def worker(cookie: str, session_id: int):
+            nonlocal remaining, errors
+            while remaining > 0:
+                remaining -= 1
+                body = {"message": f"load test {uuid.uuid4().hex} chest pain workup", "session_id": session_id}
+                t0 = time.perf_counter()
+                try:
+                    r = await client.post(f"{base}{path}", json=body, headers={"Cookie": cookie})
+                    ok = r.status_code == 200 and (not stream or "event: done" in r.text)
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    latencies.append((time.perf_counter() - t0) * 1000)
+                else:
+                    errors += 1
+
+        cpu0 = cpu_seconds(pgid) if pgid else None
+        t0 = time.perf_counter()
+        await asyncio.gather(*(worker(c, s) for c, s in users))
+        elapsed = time.perf_counter() - t0
+        cpu1 = cpu_seconds(pgid) if pgid else None
+    return {
+        "ok": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        # server CPU per chat; on a machine with few cores this, not concurrency, caps throughput
+        "cpu_ms": (cpu1 - cpu0) * 1000 / max(len(latencies), 1) if cpu0 is not None and cpu1 is not None else None,
+    }
+
+
+def print_row(name: str, concurrency: int, r: dict):
+    cpu = "-" if r["cpu_ms"] is None else f"{r['cpu_ms']:.1f}"
+    print(
+        f"{name:>12} {concurrency:>6} {r['ok']:>6} {r['errors']:>6} {r['rps']:>8.1f} "
+        f"{r['p50']:>9.0f} {r['p95']:>9.0f} {r['p99']:>9.0f} {cpu:>8}",
+        flush=True,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--servers", nargs="+", choices=sorted(SERVERS), default=["flask", "asgi"],
+                        help="asgi-uvicorn needs `pip install uvicorn`")
+    parser.add_argument("--url", help="load an already running server instead of starting them")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[50, 200, 1000], help="chats in flight")
+    parser.add_argument("--rounds", type=int, default=3, help="chats per virtual user at each level")
+    parser.add_argument("--latency", type=float, default=1.0, help="fake OpenAI seconds per completion")
+    parser.add_argument("--stream", action="store_true", help="load /chat/stream instead of /chat")
+    parser.add_argument("--port", type=int, default=5100)
+    parser.add_argument("--openai-port", type=int, default=8111)
+    args = parser.parse_args()
+
+    header = (
+        f"{'server':>12} {'conc':>6} {'ok':>6} {'errors':>6} {'req/s':>8} "
+        f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'cpu ms':>8}"
+    )
+    if args.url:
+        print(header)
+        for c in args.concurrency:
+            print_row("url", c, asyncio.run(run_level(args.url, c, c * args.rounds, args.stream)))
+        return
+
+    env = {**os.environ, "OPENAI_BASE_URL": f"http://127.0.0.1:{args.openai_port}/v1", "OPENAI_API_KEY": "sk-load-test"}
+    fake = start_fake_openai(args.openai_port, "--latency", str(args.latency))
+    try:
+        print(header)
+        for name in args.servers:
+            proc = start_server(name, args.port, env)
+            try:
+                base = f"http://127.0.0.1:{args.port}"
+                for c in args.concurrency:
+                    print_row(name, c, asyncio.run(run_level(base, c, c * args.rounds, args.stream, proc.pid)))
+            finally:
+                stop_server(proc)
+    finally:
+        fake.terminate()
+
+if __name__ == "__main__":
+    main()
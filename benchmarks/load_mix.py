@@ -0,0 +1,259 @@
+"""Mixed-traffic load test with per-endpoint latency and DB query counts.
+
+Resets the throwaway ``icd_bench`` schema, starts the fake OpenAI server and
+a backend with ``DB_COUNT_QUERIES=1``, then runs ``--users`` virtual users
+for ``--duration`` seconds. Each picks its next request from a weighted mix
+of register, login, session list/create, message history, chat (plain and
+streamed) and feedback. Reports per endpoint: requests, errors, req/s,
+p50/p95/p99 latency and SQL statements per request.
+
+    python -m benchmarks.load_mix --server flask --users 50 --duration 60
+    python -m benchmarks.load_mix --server asgi --mix chat=60,sessions=20,feedback=20
+    python -m benchmarks.load_mix --url http://127.0.0.1:5000   # an already running server
+
+Against ``--url`` the query columns are empty unless that server was started
+with ``DB_COUNT_QUERIES=1``.
+"""
+import argparse
+import asyncio
+import http.cookiejar
+import json
+import os
+import random
+import statistics
+import time
+import uuid
+from collections import defaultdict
+
+import httpx
+
+from benchmarks.common import (
+    SERVERS, use_bench_schema, reset_schema, percentile, start_fake_openai, start_server, stop_server,
+)
+
+DEFAULT_MIX = "chat=35,chat_stream=10,sessions=15,messages=15,feedback=10,new_session=5,login=5,register=5"
+
+# questions real users repeat; these exercise the code index and the answer cache
+COMMON_QUESTIONS = [
+    "what is J18.9?", "what is pneumonia?", "ICD code for type 2 diabetes",
+    "children of J18", "title of E11.9", "Z80-Z87", "explain I10",
+]
+
+
+def parse_mix(spec: str) -> dict:
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight)
+    unknown = set(mix) - set(ACTIONS)
+    if unknown:
+        raise SystemExit(f"unknown endpoints in --mix: {', '.join(sorted(unknown))}")
+    return mix
+
+
+class VirtualUser:
+    def __init__(self, client: httpx.AsyncClient, base: str, name: str):
+        self.client = client
+        self.base = base
+        self.creds = {"username": name, "password": "load-test"}
+        self.cookie = ""
+        self.session_id = None
+        self.chat_id = None
+
+    async def request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        return await self.client.request(method, f"{self.base}{path}", headers={"Cookie": self.cookie}, **kwargs)
+
+    async def login(self) -> httpx.Response:
+        r = await self.client.post(f"{self.base}/login", json=self.creds)
+        if r.status_code == 200:
+            self.cookie = f"session={r.cookies['session']}"
+            self.session_id = r.json()["latest_session_id"] or self.session_id
+        return r
+
+    def question(self, repeat_share: float) -> str:
+        if random.random() < repeat_share:
+            return random.choice(COMMON_QUESTIONS)
+        return f"coding question {uuid.uuid4().hex[:8]} about chest pain workup"
+
+
+async def do_register(u: VirtualUser, _):
+    creds = {"username": f"{u.creds['username']}_{uuid.uuid4().hex[:6]}", "password": "load-test"}
+    return await u.client.post(f"{u.base}/register", json=creds)
+
+
+async def do_login(u: VirtualUser, _):
+    return await u.login()
+
+
+async def do_sessions(u: VirtualUser, _):
+    return await u.request("GET", "/sessions")
+
+
+async def do_new_session(u: VirtualUser, _):
+    r = await u.request("POST", "/sessions", json={"name": "load"})
+    if r.status_code == 200:
+        u.session_id = r.json()["session_id"]
+    return r
+
+
+async def do_messages(u: VirtualUser, _):
+    return await u.request("GET", f"/sessions/{u.session_id}/messages")
+
+
+async def do_chat(u: VirtualUser, args):
+    r = await u.request("POST", "/chat", json={"message": u.question(args.repeat_share), "session_id": u.session_id})
+    if r.status_code == 200:
+        body = r.json()
+        u.session_id, u.chat_id = body["session_id"], body["chat_id"]
+    return r
+
+
+async def do_chat_stream(u: VirtualUser, args):
+    r = await u.request("POST", "/chat/stream", json={"message": u.question(args.repeat_share), "session_id": u.session_id})
+    if r.status_code == 200:
+        for block in r.text.split("\n\n"):
+            if block.startswith("event: done"):
+                done = json.loads(block.split("data: ", 1)[1])
+                u.session_id, u.chat_id = done["session_id"], done["chat_id"]
+                break
+        else:
+            r.status_code = 599  # the stream ended with an error event
+    return r
+
+
+async def do_feedback(u: VirtualUser, _):
+    feedback = {"chat_id": u.chat_id, "feedback": random.choice(["liked", "disliked"])}
+    return await u.request("POST", "/feedback", json=feedback)
+
+
+ACTIONS = {
+    "register": do_register,
+    "login": do_login,
+    "sessions": do_sessions,
+    "new_session": do_new_session,
+    "messages": do_messages,
+    "chat": do_chat,
+    "chat_stream": do_chat_stream,
+    "feedback": do_feedback,
+}
+
+
+async def run(base: str, args) -> tuple[dict, float]:
+    mix = parse_mix(args.mix)
+    names, weights = list(mix), list(mix.values())
+    limits = httpx.Limits(max_connections=args.users + 10, max_keepalive_connections=args.users + 10)
+    # one client for all virtual users: the shared jar must not keep anyone's cookie
+    no_cookies = http.cookiejar.CookieJar(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+    stats = defaultdict(lambda: {"latency": [], "queries": [], "errors": 0})
+
+    async with httpx.AsyncClient(limits=limits, timeout=300.0, cookies=no_cookies) as client:
+        run_id = uuid.uuid4().hex[:6]
+        users = [VirtualUser(client, base, f"mix_{run_id}_{i}") for i in range(args.users)]
+        sem = asyncio.Semaphore(50)
+
+        async def setup(u: VirtualUser):
+            async with sem:
+                await u.client.post(f"{base}/register", json=u.creds)
+                (await u.login()).raise_for_status()
+
+        await asyncio.gather(*(setup(u) for u in users))
+
+        deadline = time.monotonic() + args.duration
+
+        async def loop(u: VirtualUser):
+            while time.monotonic() < deadline:
+                name = random.choices(names, weights)[0]
+                # a user without a session or an answer yet makes one first
+                if name == "messages" and u.session_id is None:
+                    name = "new_session"
+                elif name == "feedback" and u.chat_id is None:
+                    name = "chat"
+                t0 = time.perf_counter()
+                try:
+                    r = await ACTIONS[name](u, args)
+                    ok = r.is_success
+                    queries = r.headers.get("X-DB-Queries")
+                except httpx.HTTPError:
+                    ok, queries = False, None
+                s = stats[name]
+                if ok:
+                    s["latency"].append((time.perf_counter() - t0) * 1000)
+                    if queries is not None:
+                        s["queries"].append(int(queries))
+                else:
+                    s["errors"] += 1
+                if args.think:
+                    await asyncio.sleep(random.expovariate(1000 / args.think))
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(loop(u) for u in users))
+        elapsed = time.perf_counter() - t0
+    return stats, elapsed
+
+
+def report(stats: dict, elapsed: float):
+    print(
+        f"{'endpoint':<12} {'ok':>7} {'errors':>7} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+        f"{'queries':>8} {'max q':>6}"
+    )
+    total = 0
+    for name in ACTIONS:
+        s = stats.get(name)
+        if not s:
+            continue
+        lat, q = s["latency"], s["queries"]
+        total += len(lat)
+        mean_q = f"{statistics.mean(q):.1f}" if q else "-"
+        max_q = str(max(q)) if q else "-"
+        print(
+            f"{name:<12} {len(lat):>7} {s['errors']:>7} {len(lat) / elapsed:>8.1f} {percentile(lat, 50):>9.0f} "
+            f"{percentile(lat, 95):>9.0f} {percentile(lat, 99):>9.0f} {mean_q:>8} {max_q:>6}"
+        )
+    print(f"{'total':<12} {total:>7} {'':>7} {total / elapsed:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", choices=sorted(SERVERS), default="flask")
+    parser.add_argument("--url", help="load an already running server instead of starting one")
+    parser.add_argument("--users", type=int, default=50, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="endpoint=weight,... (default: %(default)s)")
+    parser.add_argument("--repeat-share", type=float, default=0.2, help="share of chats asking a common question")
+    parser.add_argument("--think", type=float, default=0.0, help="mean ms between a user's requests")
+    parser.add_argument("--latency", type=float, default=1.0, help="fake OpenAI seconds per completion")
+    parser.add_argument("--jitter", type=float, default=0.3, help="fake OpenAI latency varies by +/- this much")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="fake OpenAI seconds between streamed words")
+    parser.add_argument("--port", type=int, default=5100)
+    parser.add_argument("--openai-port", type=int, default=8111)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    if args.url:
+        report(*asyncio.run(run(args.url, args)))
+        return
+
+    use_bench_schema()
+    reset_schema()
+    env = {
+        **os.environ,
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{args.openai_port}/v1",
+        "OPENAI_API_KEY": "sk-load-test",
+        "DB_COUNT_QUERIES": "1",
+    }
+    fake = start_fake_openai(
+        args.openai_port, "--latency", str(args.latency), "--jitter", str(args.jitter), "--token-delay", str(args.token_delay)
+    )
+    try:
+        proc = start_server(args.server, args.port, env)
+        try:
+            report(*asyncio.run(run(f"http://127.0.0.1:{args.port}", args)))
+        finally:
+            stop_server(proc)
+    finally:
+        fake.terminate()
+
+
+if __name__ == "__main__":
+    main()
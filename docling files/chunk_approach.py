@@ -1,49 +1,167 @@
 from docling.document_converter import DocumentConverter
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import fitz  # PyMuPDF
+import argparse
+import json
 import os
 import time
- 
+
 # pdf_path = r"singlePageIcd.pdf"
 # pdf_path = r"21_splitted_1_splitted_2025_ICD_NEW[5].pdf"
 pdf_path = r"C:\Users\Tamil\Documents\LeeonTek Projects\splitted icd document\New folder\new folder\singlePageIcd.pdf"
 
-start_time = time.time()
- 
- 
 output_md = "output_chunk_docling.md"
 chunk_size = 50  # number of pages per chunk
+work_dir = "temp_chunks"  # chunk PDFs, per-chunk Markdown and the manifest
+workers = max(1, (os.cpu_count() or 2) // 2)  # Docling models are memory hungry
+
+# one converter per worker process, created once by the pool initializer
+_converter = None
+
+
+def init_worker():
+    global _converter
+    _converter = DocumentConverter()
+
+
+def convert_chunk(job):
+    """Convert one chunk PDF; the Markdown is written next to it, not returned."""
+    index, start, end, chunk_pdf_path, chunk_md_path = job
+    t0 = time.time()
+    result = _converter.convert(chunk_pdf_path)
+    tmp_path = chunk_md_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(result.document.export_to_markdown())
+    os.replace(tmp_path, chunk_md_path)  # a crash never leaves a half-written chunk
+    return index, time.time() - t0
+
+
+def split_pdf(pdf_path, chunk_size, work_dir, reuse=True):
+    """Write chunk PDFs and return the job list. With ``reuse``, chunk PDFs
+    already on disk are kept; they were written by a run on the same source."""
+    pdf_doc = fitz.open(pdf_path)
+    total_pages = len(pdf_doc)
+    jobs = []
+    for index, start in enumerate(range(0, total_pages, chunk_size)):
+        end = min(start + chunk_size - 1, total_pages - 1)  # zero-indexed
+        chunk_pdf_path = os.path.join(work_dir, f"chunk_{start+1}_{end+1}.pdf")
+        chunk_md_path = os.path.join(work_dir, f"chunk_{start+1}_{end+1}.md")
+        if not (reuse and os.path.exists(chunk_pdf_path)):
+            chunk_doc = fitz.open()
+            chunk_doc.insert_pdf(pdf_doc, from_page=start, to_page=end)
+            tmp_path = chunk_pdf_path + ".tmp"
+            chunk_doc.save(tmp_path)
+            chunk_doc.close()
+            os.replace(tmp_path, chunk_pdf_path)  # like the Markdown: never a truncated chunk
+        jobs.append((index, start, end, chunk_pdf_path, chunk_md_path))
+    pdf_doc.close()
+    return jobs, total_pages
+
+
+def source_info(pdf_path, chunk_size):
+    """What the chunks are made from; size and mtime catch a PDF replaced at the same path."""
+    stat = os.stat(pdf_path)
+    return {"pdf": os.path.abspath(pdf_path), "size": stat.st_size, "mtime": stat.st_mtime, "chunk_size": chunk_size}
+
+
+def load_manifest(path, source):
+    """``(manifest, resumed)``; ``resumed`` is False when there was none to resume."""
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        # a different source PDF or chunking invalidates every chunk on disk
+        if all(manifest.get(key) == value for key, value in source.items()):
+            return manifest, True
+    return {**source, "chunks": {}}, False
+
+
+def save_manifest(path, manifest):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a large PDF to Markdown with Docling in page chunks.")
+    parser.add_argument("pdf", nargs="?", default=pdf_path)
+    parser.add_argument("--output", default=output_md)
+    parser.add_argument("--chunk-size", type=int, default=chunk_size)
+    parser.add_argument("--workers", type=int, default=workers, help="converter processes (1 = in-process)")
+    parser.add_argument("--work-dir", default=work_dir)
+    args = parser.parse_args()
+
+    start_time = time.time()
+    os.makedirs(args.work_dir, exist_ok=True)
+    manifest_path = os.path.join(args.work_dir, "manifest.json")
+    manifest, resumed = load_manifest(manifest_path, source_info(args.pdf, args.chunk_size))
+
+    jobs, total_pages = split_pdf(args.pdf, args.chunk_size, args.work_dir, reuse=resumed)
+    done = {
+        job[0] for job in jobs
+        if str(job[0]) in manifest["chunks"] and os.path.exists(job[4])
+    }
+    pending = [job for job in jobs if job[0] not in done]
+    print(f"{total_pages} pages in {len(jobs)} chunks: {len(done)} already converted, {len(pending)} to go")
+
+    converted_pages = 0
+    failed = []
+    next_index = 0
+    with open(args.output, "w", encoding="utf-8") as out:
+
+        def flush_ready():
+            # append finished chunks to the output in page order
+            nonlocal next_index
+            while next_index < len(jobs) and next_index in done:
+                with open(jobs[next_index][4], encoding="utf-8") as f:
+                    if next_index:
+                        out.write("\n\n")
+                    out.write(f.read())
+                out.flush()
+                next_index += 1
+
+        def record(index, seconds):
+            nonlocal converted_pages
+            _, start, end, _, _ = jobs[index]
+            pages = end - start + 1
+            converted_pages += pages
+            manifest["chunks"][str(index)] = {"pages": [start + 1, end + 1], "seconds": round(seconds, 2)}
+            save_manifest(manifest_path, manifest)
+            done.add(index)
+            print(f"Pages {start+1} to {end+1}: {seconds:.1f}s ({pages / max(seconds, 1e-9):.2f} pages/sec)")
+            flush_ready()
+
+        def fail(job, error):
+            failed.append(job)
+            print(f"❌ Pages {job[1]+1} to {job[2]+1} failed: {error}")
+
+        flush_ready()
+        if args.workers <= 1:
+            init_worker()
+            for job in pending:
+                try:
+                    record(*convert_chunk(job))
+                except Exception as e:
+                    fail(job, e)
+        elif pending:
+            with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker) as pool:
+                futures = {pool.submit(convert_chunk, job): job for job in pending}
+                for future in as_completed(futures):
+                    try:
+                        record(*future.result())
+                    except Exception as e:
+                        fail(futures[future], e)
+
+    end_time = time.time()
+    elapsed = end_time - start_time
+    print(f"✅ Conversion completed in {elapsed:.2f} seconds")
+    if converted_pages:
+        print(f"✅ Converted {converted_pages} pages at {converted_pages / max(elapsed, 1e-9):.2f} pages/sec overall")
+    if failed:
+        print(f"⚠️ {len(failed)} chunk(s) failed; the Markdown stops before page {min(failed)[1]+1}. Re-run to retry them.")
+    else:
+        print(f"✅ Docling conversion done. Markdown saved to {args.output}")
+
 
-pdf_doc = fitz.open(pdf_path)
-total_pages = len(pdf_doc)
- 
-converter = DocumentConverter()
-all_md = []
- 
-# Create temp folder for chunks (optional)
-os.makedirs("temp_chunks", exist_ok=True)
- 
-# Process PDF in chunks
-for start in range(0, total_pages, chunk_size):
-    end = min(start + chunk_size - 1, total_pages - 1)  # zero-indexed
-    print(f"Processing pages {start+1} to {end+1}...")
- 
-    # Create a temporary PDF chunk
-    chunk_pdf_path = f"temp_chunks/chunk_{start+1}_{end+1}.pdf"
-    chunk_doc = fitz.open()
-    chunk_doc.insert_pdf(pdf_doc, from_page=start, to_page=end)
-    chunk_doc.save(chunk_pdf_path)
-    chunk_doc.close()
- 
-    # Convert chunk with Docling
-    result = converter.convert(chunk_pdf_path)
-    chunk_md = result.document.export_to_markdown()
-    all_md.append(chunk_md)
- 
-# Combine all chunks into a single Markdown file
-with open(output_md, "w", encoding="utf-8") as f:
-    f.write("\n\n".join(all_md))
- 
-end_time = time.time()
- 
-print(f"✅ Conversion completed in {end_time - start_time:.2f} seconds")
-print(f"✅ Docling conversion done. Markdown saved to {output_md}")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
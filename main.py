@@ -1,5 +1,3 @@
-import server.backend as backend
-
 def main():
     print("Hello from icd-chatbot!")
 
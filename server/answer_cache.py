@@ -0,0 +1,180 @@
+import hashlib
+import os
+import re
+import threading
+from typing import Any, Dict
+
+from cachetools import TTLCache
+
+import server.db.db as dbx
+from server.icd import CodeIndex, get_code_index, normalize_code
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "1") == "1"
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", str(7 * 24 * 3600)))  # seconds
+ANSWER_CACHE_MEMORY_SIZE = int(os.getenv("ANSWER_CACHE_MEMORY_SIZE", "1024"))
+ANSWER_CACHE_MAX_ROWS = int(os.getenv("ANSWER_CACHE_MAX_ROWS", "100000"))
+# run the Postgres eviction pass after this many inserts
+ANSWER_CACHE_EVICT_EVERY = 200
+# USD per million tokens, used to report cost saved (defaults: gpt-4o-mini)
+PRICE_INPUT_PER_1M = float(os.getenv("OPENAI_PRICE_INPUT_PER_1M", "0.15"))
+PRICE_OUTPUT_PER_1M = float(os.getenv("OPENAI_PRICE_OUTPUT_PER_1M", "0.60"))
+
+_CODE = r"[A-Z][0-9][0-9A-Z](?:\.?[0-9A-Z]{1,4})?"
+_ASK = r"(?:what is|what's|whats|explain|describe|define|tell me about|meaning of|details of|info on)"
+# "j18.9", "ICD code J18.9?", "explain icd-10 j18.9"
+_CODE_QUESTION_RE = re.compile(
+    rf"^\s*(?:{_ASK}\s+)?(?:the\s+)?(?:icd(?:-?10)?(?:-cm)?\s+)?(?:code\s+)?({_CODE})\s*[?.!]?\s*$",
+    re.IGNORECASE,
+)
+# "what is pneumonia?", "icd code for type 2 diabetes"
+_DISEASE_QUESTION_RE = re.compile(
+    rf"^\s*(?:{_ASK}|(?:the\s+)?(?:icd(?:-?10)?(?:-cm)?\s+)?codes?\s+for)\s+(?:a\s+|an\s+|the\s+)?([a-z][a-z0-9 ,'\-]{{2,80}}?)\s*[?.!]?\s*$",
+    re.IGNORECASE,
+)
+# anything about the user or the conversation depends on memory (SYSTEM_PROMPT rule 4)
+_PERSONAL_RE = re.compile(
+    r"\b(?:i|me|my|mine|we|us|our|you|your|name|remember|recall|discuss\w*|earlier|previous\w*|"
+    r"before|last|again|summar\w*|searched|asked|history of (?:our|this))\b",
+    re.IGNORECASE,
+)
+# words that point back into the conversation: "explain that", "the first one", "codes for it"
+_FOLLOW_UP_RE = re.compile(
+    r"\b(?:that|this|these|those|it|its|they|them|their|above|same|former|latter|other|another|"
+    r"one|ones|both|each|either|neither|more|else|such|here|there|"
+    r"first|second|third|fourth|fifth|next|final)\b",
+    re.IGNORECASE,
+)
+# what is asked about a disease rather than the disease itself; alone ("the
+# subcategories", "what is the treatment?") they ask about the previous answer
+_ASPECT_WORDS = frozenset(
+    "subcategories subcategory subcodes subcode children child codes code categories category "
+    "treatment treatments therapy symptoms symptom signs sign causes cause diagnosis diagnoses "
+    "complications complication prognosis types type examples example details detail difference "
+    "differences definition meaning risk risks factors billing guidelines guideline rules rule "
+    "criteria management prevention medication medications tests test list".split()
+)
+_PHRASE_STOPWORDS = frozenset("a an and or of for in on to with without the".split())
+
+
+def _prompt_version(system_prompt: str) -> str:
+    return hashlib.sha256(system_prompt.encode()).hexdigest()[:12]
+
+
+def disease_phrase(message: str) -> str | None:
+    """The normalized disease ``message`` asks about ("what is pneumonia?" ->
+    ``pneumonia``), or None for other questions, questions about the user and
+    follow-ups that only make sense after the previous answer."""
+    if _PERSONAL_RE.search(message) or _FOLLOW_UP_RE.search(message):
+        return None
+    m = _DISEASE_QUESTION_RE.match(message)
+    if not m:
+        return None
+    words = re.findall(r"[a-z0-9]+", m.group(1).lower())
+    if all(w in _ASPECT_WORDS or w in _PHRASE_STOPWORDS for w in words):
+        return None
+    return " ".join(words)
+
+
+def intent_key(message: str, index: CodeIndex | None = None) -> str | None:
+    """Normalized cacheable intent of ``message``, or None to bypass the cache.
+
+    Disease questions are only cacheable when the disease is in the code
+    table (all its words in one title), so their answer doesn't depend on
+    what was said before; without a code table only code questions are.
+    """
+    m = _CODE_QUESTION_RE.match(message)
+    if m:
+        return f"code:{normalize_code(m.group(1))}"
+    phrase = disease_phrase(message)
+    if phrase is None:
+        return None
+    index = index if index is not None else get_code_index()
+    names = [w for w in phrase.split() if w not in _ASPECT_WORDS and w not in _PHRASE_STOPWORDS]
+    if not len(index) or index.find_title(names) is None:
+        return None
+    return f"disease:{phrase}"
+
+
+class AnswerCache:
+    """Two-tier cache of model answers for repeated code/disease questions.
+
+    Tier 1 is a per-process TTL/LRU dict, tier 2 the shared ``answer_cache``
+    table (TTL via ``expires_at``, LRU eviction on ``last_hit_at``). Keys are
+    ``model:prompt_version:intent`` so a prompt or model change never serves
+    stale answers.
+    """
+
+    def __init__(self, model: str, system_prompt: str):
+        self.model = model
+        self.prompt_version = _prompt_version(system_prompt)
+        self._memory: TTLCache = TTLCache(ANSWER_CACHE_MEMORY_SIZE, ANSWER_CACHE_TTL)
+        self._lock = threading.Lock()
+        self._puts = 0
+        self.stats = {
+            "hits_memory": 0, "hits_db": 0, "misses": 0, "bypassed": 0,
+            "prompt_tokens_saved": 0, "completion_tokens_saved": 0,
+        }
+
+    def key_for(self, message: str) -> str | None:
+        if not ANSWER_CACHE_ENABLED:
+            return None
+        intent = intent_key(message)
+        if intent is None:
+            with self._lock:
+                self.stats["bypassed"] += 1
+            return None
+        return f"{self.model}:{self.prompt_version}:{intent}"
+
+    def _count_hit(self, tier: str, entry: Dict[str, Any]):
+        with self._lock:
+            self.stats[tier] += 1
+            self.stats["prompt_tokens_saved"] += entry.get("prompt_tokens") or 0
+            self.stats["completion_tokens_saved"] += entry.get("completion_tokens") or 0
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            entry = self._memory.get(key)
+        if entry is not None:
+            self._count_hit("hits_memory", entry)
+            return entry["response"]
+        entry = dbx.get_cached_answer(key)
+        if entry is not None:
+            with self._lock:
+                self._memory[key] = entry
+            self._count_hit("hits_db", entry)
+            return entry["response"]
+        with self._lock:
+            self.stats["misses"] += 1
+        return None
+
+    def put(self, key: str, response: str, usage=None):
+        entry = {
+            "response": response,
+            "prompt_tokens": getattr(usage, "prompt_tokens", None),
+            "completion_tokens": getattr(usage, "completion_tokens", None),
+        }
+        intent = key.split(":", 2)[2]
+        with self._lock:
+            self._memory[key] = entry
+            self._puts += 1
+            evict = self._puts % ANSWER_CACHE_EVICT_EVERY == 0
+        dbx.put_cached_answer(
+            key, intent, self.model, self.prompt_version, response,
+            entry["prompt_tokens"], entry["completion_tokens"], ANSWER_CACHE_TTL,
+        )
+        if evict:
+            dbx.evict_answer_cache(ANSWER_CACHE_MAX_ROWS)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            s = dict(self.stats)
+            s["memory_entries"] = len(self._memory)
+        hits = s["hits_memory"] + s["hits_db"]
+        lookups = hits + s["misses"]
+        s["hit_ratio"] = round(hits / lookups, 4) if lookups else 0.0
+        s["cost_saved_usd"] = round(
+            s["prompt_tokens_saved"] * PRICE_INPUT_PER_1M / 1e6
+            + s["completion_tokens_saved"] * PRICE_OUTPUT_PER_1M / 1e6,
+            6,
+        )
+        return s
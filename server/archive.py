@@ -0,0 +1,85 @@
+"""Move the chats of idle sessions into the cold ``chats_archive`` table, then exit.
+
+    python -m server.archive               # sessions idle for ARCHIVE_AFTER_DAYS
+    python -m server.archive --days 30
+    python -m server.archive --restore 42  # move one session back
+
+Run it daily (cron, a scheduled job). Each batch of ``ARCHIVE_BATCH_SIZE``
+sessions is one statement: their chats and digests become one compressed
+JSONB row per session and ``chat_sessions.archived_at`` is set. Sessions in
+use right then are skipped (``SKIP LOCKED``). Afterwards ``chats`` is
+vacuumed so the freed space is reused and the table and its indexes stay the
+size of the active sessions. Plain VACUUM doesn't shrink the files, so the
+first run over a large backlog should use ``--full``, in a quiet hour: it
+rewrites the tables and locks them meanwhile.
+
+Archived sessions still list in the sidebar, their messages are read from the
+archive in place, and exports include them. The first chat turn on one moves
+it back (``restore_session``), digests included and its facts re-linked to
+their chats, so the memory is unchanged. A turn stored while the session is
+archived (its ownership was cached) makes it active again; the archived part
+is still read in place and restored on the next load, or appended to if the
+session goes idle again first.
+"""
+import argparse
+import os
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import server.db.db as dbx
+from server.db.pool import close_pool
+
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "200"))
+
+
+def archive_idle(days: int = ARCHIVE_AFTER_DAYS, batch_size: int = ARCHIVE_BATCH_SIZE) -> tuple[int, int]:
+    """Archive every session idle for more than ``days`` days, a batch per
+    transaction; returns ``(sessions, chats)`` moved."""
+    sessions = chats = 0
+    while True:
+        moved, turns = dbx.archive_sessions(days, batch_size)
+        if not moved:
+            return sessions, chats
+        sessions += moved
+        chats += turns
+
+
+def _mb(n: int) -> str:
+    return f"{n / 1_048_576:.1f} MB"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS, help="archive sessions idle for longer than this")
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE, help="sessions per transaction")
+    parser.add_argument("--no-vacuum", action="store_true", help="leave vacuuming to autovacuum")
+    parser.add_argument(
+        "--full", action="store_true",
+        help="VACUUM FULL: give the space back to the OS (locks chats; for a first run over a large backlog)",
+    )
+    parser.add_argument("--restore", type=int, metavar="SESSION_ID", help="move one archived session back instead")
+    args = parser.parse_args()
+
+    try:
+        if args.restore is not None:
+            print(f"Restored {dbx.restore_session(args.restore)} chats of session {args.restore}")
+            return
+        started = time.perf_counter()
+        sessions, chats = archive_idle(args.days, args.batch_size)
+        print(f"Archived {sessions} sessions ({chats} chats) idle for more than {args.days} days "
+              f"in {time.perf_counter() - started:.1f}s")
+        if sessions and not args.no_vacuum:
+            dbx.vacuum_chats(full=args.full)
+        s = dbx.get_archive_stats()
+        print(f"chats: {s['chats']} rows, {_mb(s['chats_bytes'])} ({_mb(s['chats_index_bytes'])} indexes); "
+              f"chats_archive: {s['archived_sessions']} sessions, {s['archived_chats']} chats, {_mb(s['archive_bytes'])}")
+    finally:
+        close_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,557 @@
+"""Async serving mode: the backend's routes on Quart, AsyncOpenAI and psycopg 3.
+
+    hypercorn "server.asgi:create_app()" --bind 127.0.0.1:5000
+
+A chat waiting on OpenAI or Postgres is a suspended coroutine rather than a
+pinned thread, so one process holds thousands of in-flight chats. Routes,
+request/response bodies and the signed session cookie are the same as
+server/backend.py, so the Streamlit UI works against either; both build
+them with server/handlers.py and differ only in their I/O. Like there,
+nothing connects to Postgres or OpenAI before it is needed or ``/ready`` is
+asked, and the schema is applied by ``python -m server.migrate``.
+"""
+import os
+import asyncio
+import threading
+from typing import Any, Dict
+from quart import Blueprint, Quart, Response, request, jsonify, session
+from quart.sessions import SecureCookieSessionInterface
+from dotenv import load_dotenv
+
+# load .env before the server modules below read their settings
+load_dotenv()
+
+import server.db.db as dbx
+import server.db.async_db as adb
+from server.db.pool import get_pool, close_pool
+from server.db.async_pool import get_async_pool
+from server.db import querycount
+from server import handlers, metrics
+from server.passwords import hasher, login_throttle, PasswordBusy
+from server.context import SYSTEM_PROMPT
+from server.prompt import CHAT_HISTORY_MAX_TURNS
+from server.icd import get_code_index, direct_answer
+from server.facts import extract_facts, recall_kind, recall_answer, SESSION_FACTS_MAX
+from server.retrieval import get_guideline_index
+from server.answer_cache import AnswerCache
+from server.export import EXPORT_BATCH_SIZE, EXPORT_FORMATS, aexport_chunks, export_filename
+from server.feedback import FeedbackBuffer
+from server.llm import LLMBusy, gateway
+from server.singleflight import AsyncSingleFlight
+from server.summary import SummaryWorker, digest_turns, compact_summary, EMPTY_MEMORY, MEMORY_LOAD_DIGESTS
+from server.session_store import UserContextCache, get_session_store, persist, regenerate, session_for
+from server.serialize import sse
+from server.pagination import decode_cursor, parse_limit, SESSIONS_PAGE_SIZE, MESSAGES_PAGE_SIZE
+
+OPEN_AI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+# concurrent upstream connections; chats beyond this wait for a free one
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "1000"))
+
+def openai_key() -> str:
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise RuntimeError("OPENAI_API_KEY missing in .env")
+    return api_key
+
+# both clients are built on first use (see backend.get_client)
+_aclient = None
+_client = None
+_client_lock = threading.Lock()
+
+def get_aclient():
+    """The AsyncOpenAI client, for requests."""
+    global _aclient
+    if _aclient is None:
+        from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+        import httpx
+
+        limits = httpx.Limits(max_connections=OPENAI_MAX_CONNECTIONS, max_keepalive_connections=OPENAI_MAX_CONNECTIONS)
+        # no client retries: the LLM gateway retries (see backend.get_client)
+        _aclient = AsyncOpenAI(
+            api_key=openai_key(), http_client=DefaultAsyncHttpxClient(limits=limits), max_retries=0,
+        )
+    return _aclient
+
+def get_client():
+    """The blocking client, for the summary worker thread."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from openai import OpenAI
+
+                _client = OpenAI(api_key=openai_key(), max_retries=0)
+    return _client
+
+class ServerSideSessionInterface(SecureCookieSessionInterface):
+    """server.session_store.ServerSideSessionInterface for Quart; the store
+    is only read from Postgres on a cache miss and written at login/logout."""
+
+    def __init__(self, store):
+        self.store = store
+
+    async def open_session(self, app, request):
+        cookie = await super().open_session(app, request)
+        if cookie is None:
+            return None
+        sid = cookie.get("sid")
+        data = None
+        if sid:
+            data = self.store.cached(sid)
+            if data is None:
+                data = await asyncio.to_thread(self.store.load, sid)
+        return session_for(self.session_class, sid, data)
+
+    async def save_session(self, app, session, response):
+        if session.modified:
+            cookie = await asyncio.to_thread(persist, self.store, session)
+        else:
+            cookie = persist(self.store, session)
+        await super().save_session(app, cookie, response)
+
+bp = Blueprint("api", __name__)
+
+answer_cache = AnswerCache(OPEN_AI_MODEL, SYSTEM_PROMPT)
+flights = AsyncSingleFlight()
+user_context = UserContextCache()
+summary_worker = SummaryWorker(
+    lambda turns: digest_turns(get_client(), OPEN_AI_MODEL, turns),
+    lambda summary, digests: compact_summary(get_client(), OPEN_AI_MODEL, summary, digests),
+    on_update=user_context.set_memory,
+)
+# written by a thread with the sync pool, like the summaries
+feedback_buffer = FeedbackBuffer(dbx.apply_feedback)
+
+def create_app() -> Quart:
+    app = Quart(__name__)
+    app.secret_key = os.getenv("SECRET_KEY", "change-me")
+    app.session_interface = ServerSideSessionInterface(get_session_store())
+    # Flask has no limit on streamed responses; long answers shouldn't be cut at Quart's 60s
+    app.config["RESPONSE_TIMEOUT"] = None
+    app.register_blueprint(bp)
+    app.before_serving(startup)
+    app.after_serving(shutdown)
+    return app
+
+async def startup():
+    # fork the password hashing workers before to_thread starts the executor threads
+    hasher.start()
+    # connections are opened in the background; requests wait for the first one
+    await get_async_pool().open(wait=False)
+    summary_worker.start()
+    feedback_buffer.start()
+
+async def shutdown():
+    await asyncio.to_thread(summary_worker.shutdown)
+    await asyncio.to_thread(feedback_buffer.shutdown)
+    await get_async_pool().close()
+    if _aclient is not None:
+        await _aclient.close()
+    close_pool()
+    hasher.shutdown()
+
+_ready = False
+
+async def warm_up():
+    """``backend.warm_up``: the clients, pools, schema check, code table and
+    guideline index; raises when this process can't serve yet."""
+    global _ready
+    if _ready:
+        return
+    get_aclient()
+    pending = await asyncio.to_thread(dbx.pending_migrations)
+    if pending:
+        raise RuntimeError(f"database schema is behind (migrations {pending} pending); run python -m server.migrate")
+    await get_async_pool().wait()
+    await asyncio.to_thread(get_pool().warm)
+    await asyncio.to_thread(get_code_index)
+    await asyncio.to_thread(get_guideline_index)
+    _ready = True
+
+def pool_connections():
+    stats = get_async_pool().get_stats()
+    sync = get_pool().stats()
+    return {
+        ("async", "in_use"): stats["pool_size"] - stats["pool_available"],
+        ("async", "idle"): stats["pool_available"],
+        ("sync", "in_use"): sync["in_use"],
+        ("sync", "idle"): sync["idle"],
+    }
+
+# gauges, read when /metrics is scraped; the sync pool serves summaries and the answer cache
+metrics.gauge("icd_db_pool_connections", "Pooled DB connections by state.", pool_connections, ("pool", "state"))
+metrics.gauge(
+    "icd_db_pool_waiting", "Callers waiting for a DB connection.",
+    lambda: {("async",): get_async_pool().get_stats()["requests_waiting"], ("sync",): get_pool().stats()["waiting"]},
+    ("pool",),
+)
+metrics.gauge("icd_summary_queue_depth", "Sessions waiting for a summary update.", summary_worker.qsize)
+metrics.gauge("icd_feedback_pending", "Feedback clicks waiting to be written.", feedback_buffer.pending)
+metrics.gauge("icd_openai_in_flight", "Distinct completions in flight (after coalescing).", lambda: flights.snapshot()["in_flight"])
+metrics.gauge("icd_llm_queue_depth", "Completions waiting for admission by the LLM gateway.", gateway.queue_depth, ("priority",))
+
+@bp.before_app_request
+async def start_trace():
+    metrics.start_request(request.method, request.url_rule.rule if request.url_rule else "unmatched")
+
+@bp.after_app_request
+async def end_trace(response):
+    metrics.end_request(response.status_code)
+    return response
+
+if querycount.DB_COUNT_QUERIES:
+    @bp.before_app_request
+    async def count_queries():
+        querycount.begin()
+
+    @bp.after_app_request
+    async def report_queries(response):
+        response.headers["X-DB-Queries"] = str(querycount.count())
+        return response
+
+@bp.after_app_request
+async def cors(response):
+    # what flask_cors(supports_credentials=True) does for the Flask app
+    origin = request.headers.get("Origin")
+    if origin:
+        response.headers["Access-Control-Allow-Origin"] = origin
+        response.headers["Access-Control-Allow-Credentials"] = "true"
+        response.headers["Vary"] = "Origin"
+        if request.method == "OPTIONS":
+            response.headers["Access-Control-Allow-Methods"] = "GET, POST, OPTIONS"
+            if "Access-Control-Request-Headers" in request.headers:
+                response.headers["Access-Control-Allow-Headers"] = request.headers["Access-Control-Request-Headers"]
+    return response
+
+# helpers
+async def conditional_json(payload: Dict[str, Any]):
+    """``backend.conditional_json``: 200 with an ETag, or 304 when ``If-None-Match`` matches."""
+    response = jsonify(payload)
+    response.headers["Cache-Control"] = "private, no-cache"
+    await response.add_etag()
+    return await response.make_conditional(request)
+
+def page_args(default_limit: int):
+    """``(limit, before_cursor)`` from the query string; raises ValueError."""
+    return parse_limit(request.args.get("limit"), default_limit), decode_cursor(request.args.get("before"))
+
+async def sessions_page(user_id: int, limit: int, before=None):
+    return handlers.session_list(await adb.list_sessions_page(user_id, limit + 1, before), limit)
+
+async def messages_page(session_id: int, limit: int, before=None):
+    return handlers.message_list(await adb.get_chats_page(session_id, limit + 1, before), limit)
+
+async def owns_session(user_id: int, session_id: int) -> bool:
+    if user_context.owns(user_id, session_id):
+        return True
+    if not await adb.session_belongs_to_user(session_id, user_id):
+        return False
+    user_context.add_session(user_id, session_id)
+    return True
+
+async def load_chat_context(user_id: int, session_id: int) -> Dict[str, Any] | None:
+    loaded = await adb.load_chat_turn(session_id, user_id, CHAT_HISTORY_MAX_TURNS, MEMORY_LOAD_DIGESTS, SESSION_FACTS_MAX)
+    if loaded is not None and loaded["archived"]:
+        await adb.restore_session(session_id)
+        loaded = await adb.load_chat_turn(session_id, user_id, CHAT_HISTORY_MAX_TURNS, MEMORY_LOAD_DIGESTS, SESSION_FACTS_MAX)
+    if loaded is not None:
+        user_context.add_session(user_id, session_id, memory=loaded["memory"])
+    return loaded
+
+async def chat_context(user_id: int, session_id: int | None) -> Dict[str, Any]:
+    if not session_id:
+        return {"memory": EMPTY_MEMORY, "recent": []}
+    memory = user_context.memory(session_id)
+    if memory is not None:
+        history = await adb.get_recent_history(session_id, CHAT_HISTORY_MAX_TURNS)
+        if history is not None and not history["archived"]:
+            return {"memory": memory, "recent": history["recent"]}
+    return await load_chat_context(user_id, session_id) or {"memory": EMPTY_MEMORY, "recent": []}
+
+def require_login():
+    if "user_id" not in session:
+        return False, jsonify({"error": "Unauthorized"}), 401
+    return True, None, None
+
+# Auth
+@bp.post("/register")
+async def register():
+    username, password = handlers.credentials(await request.get_json(force=True) or {})
+    if not username or not password:
+        return handlers.error("username and password required")
+    if await adb.get_user_by_username(username):
+        return handlers.error("username already exists")
+    # password hashing is deliberately slow CPU work; it runs in the hasher's processes
+    try:
+        password_hash = await hasher.hash_async(password)
+    except PasswordBusy:
+        return handlers.password_busy()
+    user_id = await adb.insert_user(username, password_hash)
+    return jsonify({"message": "registered", "user_id": user_id}), 200
+
+@bp.post("/login")
+async def login():
+    username, password = handlers.credentials(await request.get_json(force=True) or {})
+    retry_after = login_throttle.acquire(username)
+    if retry_after:
+        return handlers.too_many_attempts(retry_after)
+    ok = None
+    try:
+        user = await adb.get_user_by_username(username)
+        ok, new_hash = await hasher.verify_async(user["password_hash"], password) if user else (False, None)
+    except PasswordBusy:
+        return handlers.password_busy()
+    finally:
+        login_throttle.release(username, ok)
+    if not ok:
+        return handlers.error("invalid credentials", 401)
+    if new_hash:
+        await adb.update_password_hash(user["id"], new_hash)
+    # a new session id for the login, never the one the request came with
+    regenerate(session)
+    session["user_id"] = user["id"]
+    session["username"] = user["username"]
+
+    sessions, sessions_cursor = await sessions_page(user["id"], SESSIONS_PAGE_SIZE)
+    user_context.add_sessions(user["id"], [s["id"] for s in sessions])
+    latest_messages, messages_cursor = await messages_page(sessions[0]["id"], MESSAGES_PAGE_SIZE) if sessions else ([], None)
+    return jsonify(handlers.login_body(user, sessions, sessions_cursor, latest_messages, messages_cursor)), 200
+
+@bp.get("/logout")
+async def logout():
+    if "user_id" in session:
+        user_context.drop_user(session["user_id"])
+    session.clear()
+    return jsonify({"message": "logged out"}), 200
+
+@bp.get("/me")
+async def me():
+    if "user_id" not in session:
+        return handlers.error("not logged in", 401)
+    return jsonify({"id": session["user_id"], "username": session["username"]}), 200
+
+# sessions
+@bp.get("/sessions")
+async def list_sessions():
+    ok, err, code = require_login()
+    if not ok: return err, code
+    try:
+        limit, before = page_args(SESSIONS_PAGE_SIZE)
+    except ValueError as e:
+        return handlers.error(str(e))
+    sessions, next_cursor = await sessions_page(session["user_id"], limit, before)
+    return await conditional_json({"sessions": sessions, "next_cursor": next_cursor})
+
+@bp.post("/sessions")
+async def create_new_session():
+    ok, err, code = require_login()
+    if not ok: return err, code
+    name = handlers.session_name(await request.get_json(force=True) or {})
+    sid = await adb.create_session(session["user_id"], session_name=name)
+    user_context.add_session(session["user_id"], sid, memory=EMPTY_MEMORY)
+    return jsonify({"session_id": sid}), 200
+
+@bp.get("/sessions/<int:session_id>/messages")
+async def get_session_messages(session_id: int):
+    ok, err, code = require_login()
+    if not ok: return err, code
+    if not await owns_session(session["user_id"], session_id):
+        return handlers.error("not found", 404)
+    try:
+        limit, before = page_args(MESSAGES_PAGE_SIZE)
+    except ValueError as e:
+        return handlers.error(str(e))
+    messages, next_cursor = await messages_page(session_id, limit, before)
+    return await conditional_json({"messages": messages, "next_cursor": next_cursor})
+
+@bp.get("/export")
+async def export_history():
+    """Every chat of the caller streamed as NDJSON or Parquet; same as the Flask route."""
+    ok, err, code = require_login()
+    if not ok: return err, code
+    fmt = request.args.get("format", "ndjson")
+    if fmt not in EXPORT_FORMATS:
+        return handlers.error(f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    user_id = session["user_id"]
+    chunks = aexport_chunks(adb.iter_user_export(user_id, EXPORT_BATCH_SIZE), fmt)
+    headers = {"Content-Disposition": f'attachment; filename="{export_filename(user_id, fmt)}"'}
+    return Response(chunks, content_type=EXPORT_FORMATS[fmt][0], headers=headers)
+
+# chat
+async def prepare_chat():
+    """Async ``backend.prepare_chat``: ``(turn, None)`` or ``(None, (response, status))``."""
+    try:
+        user_message, session_id = handlers.chat_request(await request.get_json(force=True) or {})
+    except ValueError as e:
+        return None, handlers.error(str(e))
+    user_id = session["user_id"]
+    context = None
+    if session_id and not user_context.owns(user_id, session_id):
+        context = await load_chat_context(user_id, session_id)
+        if context is None:
+            return None, handlers.error("invalid session")
+
+    answer = direct_answer(user_message)
+    if answer:
+        return handlers.answered(session_id, user_message, answer, "code_index"), None
+
+    recall = recall_kind(user_message) if session_id else None
+    if recall:
+        answer = recall_answer(recall, await adb.get_session_facts(session_id))
+        if answer:
+            return handlers.answered(session_id, user_message, answer, "facts"), None
+
+    cache_key = answer_cache.key_for(user_message)
+    if cache_key:
+        answer = await asyncio.to_thread(answer_cache.get, cache_key)
+        if answer:
+            return handlers.answered(session_id, user_message, answer, "cache"), None
+
+    context = context or await chat_context(user_id, session_id)
+    return handlers.build_turn(session_id, user_message, context, cache_key), None
+
+async def finish_chat(user_id: int, session_id: int | None, user_message: str, answer: str) -> tuple[int, int]:
+    facts = extract_facts(user_message, answer)
+    chat_id, new_id = await adb.record_chat_turn(user_id, session_id, user_message, answer, facts)
+    handlers.turn_recorded(user_context, summary_worker, user_id, session_id, new_id, facts)
+    return chat_id, new_id
+
+@bp.post("/chat")
+async def chat():
+    ok, err, code = require_login()
+    if not ok: return err, code
+    turn, error = await prepare_chat()
+    if error: return error
+    user_id, session_id = session["user_id"], turn["session_id"]
+
+    if "direct_answer" in turn:
+        answer = turn["direct_answer"]
+        chat_id, session_id = await finish_chat(user_id, session_id, turn["user_message"], answer)
+        return jsonify(handlers.chat_body(turn, answer, chat_id, session_id)), 200
+
+    try:
+        key, kwargs = handlers.completion(OPEN_AI_MODEL, turn)
+        with metrics.span("openai.chat"):
+            resp, shared = await flights.do(
+                key, lambda: gateway.complete_async(get_aclient().chat.completions.create, **kwargs),
+            )
+        if not shared:
+            metrics.count_tokens("chat", resp.usage)
+        answer = resp.choices[0].message.content
+        if handlers.cacheable(turn, answer, shared):
+            await asyncio.to_thread(answer_cache.put, turn["cache_key"], answer, resp.usage)
+        chat_id, session_id = await finish_chat(user_id, session_id, turn["user_message"], answer)
+        return jsonify(handlers.chat_body(turn, answer, chat_id, session_id)), 200
+    except LLMBusy as e:
+        return handlers.llm_busy(e)
+    except Exception as e:
+        print("Chat error:", e)
+        return handlers.error(str(e), 500)
+
+@bp.post("/chat/stream")
+async def chat_stream():
+    """Server-Sent Events variant of /chat; same events as the Flask route."""
+    ok, err, code = require_login()
+    if not ok: return err, code
+    turn, error = await prepare_chat()
+    if error: return error
+    user_id, session_id = session["user_id"], turn["session_id"]
+    if not session_id:
+        session_id = await adb.create_session(user_id, "New Chat")
+        user_context.add_session(user_id, session_id, memory=EMPTY_MEMORY)
+
+    async def events():
+        yield handlers.meta_event(turn, session_id)
+        if "direct_answer" in turn:
+            yield sse({"delta": turn["direct_answer"]})
+            chat_id, _ = await finish_chat(user_id, session_id, turn["user_message"], turn["direct_answer"])
+            yield handlers.done_event(chat_id, session_id)
+            return
+        try:
+            key, kwargs = handlers.completion(OPEN_AI_MODEL, turn, stream=True)
+            streamed = handlers.StreamedAnswer()
+            with metrics.span("openai.chat_stream"):
+                stream, shared = flights.stream(
+                    key, lambda: gateway.complete_async(get_aclient().chat.completions.create, **kwargs),
+                )
+                async for chunk in stream:
+                    delta = streamed.feed(chunk)
+                    if delta:
+                        yield sse({"delta": delta})
+            if not shared:
+                metrics.count_tokens("chat", streamed.usage)
+            answer = streamed.answer
+            if handlers.cacheable(turn, answer, shared):
+                await asyncio.to_thread(answer_cache.put, turn["cache_key"], answer, streamed.usage)
+            chat_id, _ = await finish_chat(user_id, session_id, turn["user_message"], answer)
+            yield handlers.done_event(chat_id, session_id)
+        except Exception as e:
+            if not isinstance(e, LLMBusy):
+                print("Chat error:", e)
+            yield handlers.error_event(e)
+
+    # the request is timed until the last event is sent
+    trace = metrics.defer_request()
+
+    async def generate():
+        try:
+            async for event in events():
+                yield event
+        finally:
+            if trace is not None:
+                trace.finish()
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(generate(), mimetype="text/event-stream", headers=headers)
+
+# feedback
+@bp.post("/feedback")
+async def feedback():
+    ok, err, code = require_login()
+    if not ok: return err, code
+    try:
+        chat_id, feedback_val = handlers.feedback_request(await request.get_json(force=True) or {})
+    except ValueError as e:
+        return handlers.error(str(e))
+    session_id = await adb.get_chat_session(chat_id, session["user_id"])
+    if session_id is None:
+        return handlers.error("not found", 404)
+    if not feedback_buffer.add(chat_id, session_id, feedback_val):
+        return handlers.error("server busy, try again", 503, {"Retry-After": "1"})
+    return jsonify({"message": "feedback received"}), 202
+
+@bp.get("/feedback/stats")
+async def feedback_stats():
+    ok, err, code = require_login()
+    if not ok: return err, code
+    try:
+        days = handlers.stats_days(request.args.get("days", "30"))
+    except ValueError as e:
+        return handlers.error(str(e))
+    return jsonify(handlers.feedback_stats_body(await adb.get_feedback_daily(days), feedback_buffer.snapshot())), 200
+
+@bp.get("/cache/stats")
+async def cache_stats():
+    ok, err, code = require_login()
+    if not ok: return err, code
+    return jsonify(handlers.cache_stats_body(answer_cache, flights, user_context)), 200
+
+@bp.get("/metrics")
+async def prometheus_metrics():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@bp.get("/health")
+async def health():
+    return {"ok": True, "model": OPEN_AI_MODEL}, 200
+
+@bp.get("/ready")
+async def ready():
+    try:
+        await warm_up()
+    except Exception as e:
+        return {"ready": False, "error": str(e)}, 503
+    return {"ready": True}, 200
+
+if __name__ == "__main__":
+    print("✅ ASGI backend at http://127.0.0.1:5000")
+    create_app().run(host="127.0.0.1", port=5000)
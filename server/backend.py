@@ -1,215 +1,513 @@
+"""The Flask backend.
+
+    flask --app server.backend run         # or: python -m server.backend
+
+``create_app()`` builds the app; Flask's CLI finds it by name. Neither the
+import nor ``create_app`` talks to Postgres or OpenAI: the pool, the OpenAI
+client, the code table and the guideline index are built on first use, and
+``GET /ready`` builds them all and checks the schema (applied separately with
+``python -m server.migrate``). ``GET /health`` only says the process is up.
+"""
 import os
-from flask import Flask, request, jsonify, session
+import atexit
+import threading
+from typing import Any, Dict
+from flask import Blueprint, Flask, Response, request, jsonify, session, stream_with_context
 from flask_cors import CORS
 from dotenv import load_dotenv
-from werkzeug.security import generate_password_hash, check_password_hash
-from openai import OpenAI
+
+# load .env before the server modules below read their settings
+load_dotenv()
 
 import server.db.db as dbx
+from server.db.pool import get_pool, close_pool
+from server.db import querycount
+from server import handlers, metrics
+from server.passwords import hasher, login_throttle, PasswordBusy
 from server.context import SYSTEM_PROMPT
+from server.prompt import CHAT_HISTORY_MAX_TURNS
+from server.icd import get_code_index, direct_answer
+from server.facts import extract_facts, recall_kind, recall_answer, SESSION_FACTS_MAX
+from server.retrieval import get_guideline_index
+from server.answer_cache import AnswerCache
+from server.export import EXPORT_BATCH_SIZE, EXPORT_FORMATS, export_chunks, export_filename
+from server.feedback import FeedbackBuffer
+from server.llm import LLMBusy, gateway
+from server.singleflight import SingleFlight
+from server.summary import SummaryWorker, digest_turns, compact_summary, EMPTY_MEMORY, MEMORY_LOAD_DIGESTS
+from server.session_store import ServerSideSessionInterface, UserContextCache, get_session_store, regenerate
+from server.serialize import sse
+from server.pagination import decode_cursor, parse_limit, SESSIONS_PAGE_SIZE, MESSAGES_PAGE_SIZE
 
-load_dotenv()
-
-API_KEY = os.getenv("OPENAI_API_KEY")
 OPEN_AI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
-if not API_KEY:
-    raise RuntimeError("OPENAI_API_KEY missing in .env")
 
-client = OpenAI(api_key=API_KEY)
+bp = Blueprint("api", __name__)
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """The OpenAI client, built on first use; raises RuntimeError without ``OPENAI_API_KEY``."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                api_key = os.getenv("OPENAI_API_KEY")
+                if not api_key:
+                    raise RuntimeError("OPENAI_API_KEY missing in .env")
+                # imported here: the openai package alone takes ~0.4 s to import
+                from openai import OpenAI
+                # the LLM gateway retries; the client's own retries would multiply its attempts
+                _client = OpenAI(api_key=api_key, max_retries=0)
+    return _client
+
+# repeated code / disease questions are served from here
+answer_cache = AnswerCache(OPEN_AI_MODEL, SYSTEM_PROMPT)
+# identical prompts in flight at the same time share one upstream call
+flights = SingleFlight()
+
+# owned chat sessions and their memory, so a turn doesn't ask Postgres for them
+user_context = UserContextCache()
+
+# session memory (digests, summary) is maintained off the request path
+summary_worker = SummaryWorker(
+    lambda turns: digest_turns(get_client(), OPEN_AI_MODEL, turns),
+    lambda summary, digests: compact_summary(get_client(), OPEN_AI_MODEL, summary, digests),
+    on_update=user_context.set_memory,
+)
+
+# feedback clicks are applied in bulk by a background thread
+feedback_buffer = FeedbackBuffer(dbx.apply_feedback)
+
+# gauges, read when /metrics is scraped
+metrics.gauge(
+    "icd_db_pool_connections", "Pooled DB connections by state.",
+    lambda: {("sync", state): get_pool().stats()[state] for state in ("in_use", "idle")}, ("pool", "state"),
+)
+metrics.gauge("icd_db_pool_waiting", "Callers waiting for a DB connection.", lambda: {("sync",): get_pool().stats()["waiting"]}, ("pool",))
+metrics.gauge("icd_summary_queue_depth", "Sessions waiting for a summary update.", summary_worker.qsize)
+metrics.gauge("icd_feedback_pending", "Feedback clicks waiting to be written.", feedback_buffer.pending)
+metrics.gauge("icd_openai_in_flight", "Distinct completions in flight (after coalescing).", lambda: flights.snapshot()["in_flight"])
+metrics.gauge("icd_llm_queue_depth", "Completions waiting for admission by the LLM gateway.", gateway.queue_depth, ("priority",))
+
+def create_app() -> Flask:
+    """The app, with the password hashing, summary and feedback workers started."""
+    app = Flask(__name__)
+    app.secret_key = os.getenv("SECRET_KEY", "change-me")
+    # the cookie holds a signed session id; session data is kept server-side (SESSION_STORE)
+    app.session_interface = ServerSideSessionInterface(get_session_store())
+    CORS(app, supports_credentials=True)
+    app.register_blueprint(bp)
+
+    # fork the password hashing workers before any other threads start
+    hasher.start()
+    summary_worker.start()
+    feedback_buffer.start()
+    # run last to first: feedback is flushed before the pool closes
+    atexit.register(hasher.shutdown)
+    atexit.register(close_pool)
+    atexit.register(summary_worker.shutdown)
+    atexit.register(feedback_buffer.shutdown)
+    return app
+
+_ready = False
+
+def warm_up():
+    """Build what requests would otherwise build on first use and check the
+    schema; raises when this process can't serve yet. Done once."""
+    global _ready
+    if _ready:
+        return
+    get_client()
+    pending = dbx.pending_migrations()
+    if pending:
+        raise RuntimeError(f"database schema is behind (migrations {pending} pending); run python -m server.migrate")
+    get_pool().warm()
+    get_code_index()
+    get_guideline_index()
+    _ready = True
+
+@bp.before_app_request
+def start_trace():
+    metrics.start_request(request.method, request.url_rule.rule if request.url_rule else "unmatched")
 
-app = Flask(__name__)
-app.secret_key = os.getenv("SECRET_KEY", "change-me")
-CORS(app, supports_credentials=True)
+@bp.after_app_request
+def end_trace(response):
+    metrics.end_request(response.status_code)
+    return response
 
-# create tables at startup
-dbx.create_tables()
+if querycount.DB_COUNT_QUERIES:
+    @bp.before_app_request
+    def count_queries():
+        querycount.begin()
+
+    @bp.after_app_request
+    def report_queries(response):
+        response.headers["X-DB-Queries"] = str(querycount.count())
+        return response
 
 # helpers
+def page_args(default_limit: int):
+    """``(limit, before_cursor)`` from the query string; raises ValueError."""
+    return parse_limit(request.args.get("limit"), default_limit), decode_cursor(request.args.get("before"))
+
+def conditional_json(payload: Dict[str, Any]):
+    """200 with an ETag of the body, or an empty 304 when it matches the client's ``If-None-Match``."""
+    response = jsonify(payload)
+    # always revalidate; the body is per user
+    response.headers["Cache-Control"] = "private, no-cache"
+    response.add_etag()
+    return response.make_conditional(request)
+
+def sessions_page(user_id: int, limit: int, before=None):
+    return handlers.session_list(dbx.list_sessions_page(user_id, limit + 1, before), limit)
+
+def messages_page(session_id: int, limit: int, before=None):
+    return handlers.message_list(dbx.get_chats_page(session_id, limit + 1, before), limit)
+
+def owns_session(user_id: int, session_id: int) -> bool:
+    if user_context.owns(user_id, session_id):
+        return True
+    if not dbx.session_belongs_to_user(session_id, user_id):
+        return False
+    user_context.add_session(user_id, session_id)
+    return True
+
+def load_chat_context(user_id: int, session_id: int) -> Dict[str, Any] | None:
+    """Memory and newest turns of a session ``user_id`` owns, in one query; None if not owned."""
+    loaded = dbx.load_chat_turn(session_id, user_id, CHAT_HISTORY_MAX_TURNS, MEMORY_LOAD_DIGESTS, SESSION_FACTS_MAX)
+    if loaded is not None and loaded["archived"]:
+        # the user came back to an archived session: its turns and digests move back first
+        dbx.restore_session(session_id)
+        loaded = dbx.load_chat_turn(session_id, user_id, CHAT_HISTORY_MAX_TURNS, MEMORY_LOAD_DIGESTS, SESSION_FACTS_MAX)
+    if loaded is not None:
+        user_context.add_session(user_id, session_id, memory=loaded["memory"])
+    return loaded
+
+def chat_context(user_id: int, session_id: int | None) -> Dict[str, Any]:
+    """Memory and newest turns for the prompt; one query at most."""
+    if not session_id:
+        return {"memory": EMPTY_MEMORY, "recent": []}
+    memory = user_context.memory(session_id)
+    if memory is not None:
+        history = dbx.get_recent_history(session_id, CHAT_HISTORY_MAX_TURNS)
+        # archived since its memory was cached: the full load restores it
+        if history is not None and not history["archived"]:
+            return {"memory": memory, "recent": history["recent"]}
+    return load_chat_context(user_id, session_id) or {"memory": EMPTY_MEMORY, "recent": []}
+
 def require_login():
     if "user_id" not in session:
         return False, jsonify({"error": "Unauthorized"}), 401
     return True, None, None
 
 # Auth
-@app.post("/register")
+@bp.post("/register")
 def register():
-    data = request.get_json(force=True) or {}
-    username = (data.get("username") or "").strip()
-    password = (data.get("password") or "").strip()
+    username, password = handlers.credentials(request.get_json(force=True) or {})
     if not username or not password:
-        return jsonify({"error": "username and password required"}), 400
+        return handlers.error("username and password required")
     if dbx.get_user_by_username(username):
-        return jsonify({"error": "username already exists"}), 400
-    user_id = dbx.insert_user(username, generate_password_hash(password))
+        return handlers.error("username already exists")
+    try:
+        password_hash = hasher.hash(password)
+    except PasswordBusy:
+        return handlers.password_busy()
+    user_id = dbx.insert_user(username, password_hash)
     return jsonify({"message": "registered", "user_id": user_id}), 200
 
-@app.post("/login")
+@bp.post("/login")
 def login():
-    data = request.get_json(force=True) or {}
-    username = (data.get("username") or "").strip()
-    password = (data.get("password") or "").strip()
-    user = dbx.get_user_by_username(username)
-    if not user or not check_password_hash(user["password_hash"], password):
-        return jsonify({"error": "invalid credentials"}), 401
+    username, password = handlers.credentials(request.get_json(force=True) or {})
+    retry_after = login_throttle.acquire(username)
+    if retry_after:
+        return handlers.too_many_attempts(retry_after)
+    ok = None
+    try:
+        user = dbx.get_user_by_username(username)
+        ok, new_hash = hasher.verify(user["password_hash"], password) if user else (False, None)
+    except PasswordBusy:
+        return handlers.password_busy()
+    finally:
+        login_throttle.release(username, ok)
+    if not ok:
+        return handlers.error("invalid credentials", 401)
+    if new_hash:
+        # stored with older hash parameters; upgrade while we have the password
+        dbx.update_password_hash(user["id"], new_hash)
+    # a new session id for the login, never the one the request came with
+    regenerate(session)
     session["user_id"] = user["id"]
     session["username"] = user["username"]
 
-    sessions_with_msgs = dbx.get_user_sessions_with_messages(user["id"])
-    latest_session_id = sessions_with_msgs[0]["id"] if sessions_with_msgs else None
-    latest_messages = sessions_with_msgs[0]["messages"] if sessions_with_msgs else []
+    # first page of session metadata only; older pages come from /sessions and
+    # other sessions' messages load via /sessions/<id>/messages
+    sessions, sessions_cursor = sessions_page(user["id"], SESSIONS_PAGE_SIZE)
+    user_context.add_sessions(user["id"], [s["id"] for s in sessions])
+    latest_messages, messages_cursor = messages_page(sessions[0]["id"], MESSAGES_PAGE_SIZE) if sessions else ([], None)
+    return jsonify(handlers.login_body(user, sessions, sessions_cursor, latest_messages, messages_cursor)), 200
 
-    return jsonify({
-        "message": "ok",
-        "user_id": user["id"],
-        "username": user["username"],
-        "sessions": sessions_with_msgs,
-        "latest_session_id": latest_session_id,
-        "latest_messages": latest_messages
-    }), 200
-
-@app.get("/logout")
+@bp.get("/logout")
 def logout():
+    if "user_id" in session:
+        user_context.drop_user(session["user_id"])
     session.clear()
     return jsonify({"message": "logged out"}), 200
 
-@app.get("/me")
+@bp.get("/me")
 def me():
     if "user_id" not in session:
-        return jsonify({"error": "not logged in"}), 401
+        return handlers.error("not logged in", 401)
     return jsonify({"id": session["user_id"], "username": session["username"]}), 200
 
 # sessions
-@app.get("/sessions")
+@bp.get("/sessions")
 def list_sessions():
+    """Newest-first page of sessions; pass ``next_cursor`` back as ``before``.
+    Send the ``ETag`` back as ``If-None-Match`` to get a 304 when nothing changed."""
     ok, err, code = require_login()
     if not ok: return err, code
     user_id = session["user_id"]
-    rows = dbx.list_sessions_with_preview(user_id)
-    out = []
-    for r in rows:
-        title = r.get("first_user_message") or r.get("session_name") or f"Chat {r['id']}"
-        if title and len(title) > 60:
-            title = title[:60] + "…"
-        out.append({
-            "id": r["id"],
-            "title": title,
-            "session_name": r.get("session_name"),
-            "started_at": r["started_at"],
-            "last_activity": r.get("last_activity")
-        })
-    return jsonify({"sessions": out}), 200
-
-@app.post("/sessions")
+    try:
+        limit, before = page_args(SESSIONS_PAGE_SIZE)
+    except ValueError as e:
+        return handlers.error(str(e))
+    sessions, next_cursor = sessions_page(user_id, limit, before)
+    return conditional_json({"sessions": sessions, "next_cursor": next_cursor})
+
+@bp.post("/sessions")
 def create_new_session():
     ok, err, code = require_login()
     if not ok: return err, code
     user_id = session["user_id"]
-    data = request.get_json(force=True) or {}
-    name = (data.get("name") or "New Chat").strip()
-    sid = dbx.create_session(user_id, session_name=name)
+    sid = dbx.create_session(user_id, session_name=handlers.session_name(request.get_json(force=True) or {}))
+    user_context.add_session(user_id, sid, memory=EMPTY_MEMORY)
     return jsonify({"session_id": sid}), 200
 
-@app.get("/sessions/<int:session_id>/messages")
+@bp.get("/sessions/<int:session_id>/messages")
 def get_session_messages(session_id: int):
     ok, err, code = require_login()
     if not ok: return err, code
     user_id = session["user_id"]
-    if not dbx.session_belongs_to_user(session_id, user_id):
-        return jsonify({"error": "not found"}), 404
-    messages = dbx.get_chats_for_session(session_id)
-    return jsonify({"messages": messages}), 200
+    if not owns_session(user_id, session_id):
+        return handlers.error("not found", 404)
+    try:
+        limit, before = page_args(MESSAGES_PAGE_SIZE)
+    except ValueError as e:
+        return handlers.error(str(e))
+    # newest page first, in chronological order; ``next_cursor`` pages back in time
+    messages, next_cursor = messages_page(session_id, limit, before)
+    return conditional_json({"messages": messages, "next_cursor": next_cursor})
 
-# chat
-@app.post("/chat")
-def chat():
+@bp.get("/export")
+def export_history():
+    """Every chat of the caller, archived ones included, streamed as NDJSON
+    (default) or Parquet (``?format=parquet``); see server/export.py."""
     ok, err, code = require_login()
     if not ok: return err, code
-    data = request.get_json(force=True) or {}
-    user_message = (data.get("message") or "").strip()
-    session_id = data.get("session_id")
-    if not user_message:
-        return jsonify({"error": "message is required"}), 400
+    fmt = request.args.get("format", "ndjson")
+    if fmt not in EXPORT_FORMATS:
+        return handlers.error(f"format must be one of {', '.join(EXPORT_FORMATS)}")
     user_id = session["user_id"]
-    if session_id:
-        if not dbx.session_belongs_to_user(session_id, user_id):
-            return jsonify({"error": "invalid session"}), 400
-    else:
-        session_id = dbx.create_session(user_id, "New Chat")
+    chunks = export_chunks(dbx.iter_user_export(user_id, EXPORT_BATCH_SIZE), fmt)
+    headers = {"Content-Disposition": f'attachment; filename="{export_filename(user_id, fmt)}"'}
+    return Response(stream_with_context(chunks), content_type=EXPORT_FORMATS[fmt][0], headers=headers)
 
-    # Build history
-    history = dbx.get_history_pairs(session_id)
-    summary = dbx.get_session_summary(session_id)
+# chat
+def prepare_chat():
+    """Validate a chat request and assemble the model messages.
 
-    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
-    if summary:
-        messages.append({"role": "system", "content": f"Summary of previous conversation:\n{summary}"})
+    Returns ``(turn, None)`` on success or ``(None, (response, status))``.
+    """
+    try:
+        user_message, session_id = handlers.chat_request(request.get_json(force=True) or {})
+    except ValueError as e:
+        return None, handlers.error(str(e))
+    user_id = session["user_id"]
+    # a new session is created together with its first chat (see finish_chat)
+    context = None
+    if session_id and not user_context.owns(user_id, session_id):
+        context = load_chat_context(user_id, session_id)
+        if context is None:
+            return None, handlers.error("invalid session")
 
-    # include last 10 chat pairs to keep context
-    for m in history[-20:]:
-        messages.append({"role": m["role"], "content": m["content"]})
+    # title / hierarchy / range lookups are answered from the code table
+    answer = direct_answer(user_message)
+    if answer:
+        return handlers.answered(session_id, user_message, answer, "code_index"), None
 
-    messages.append({"role": "user", "content": user_message})
+    # "what is my name?", "summarize what I searched" are answered from the session's facts
+    recall = recall_kind(user_message) if session_id else None
+    if recall:
+        answer = recall_answer(recall, dbx.get_session_facts(session_id))
+        if answer:
+            return handlers.answered(session_id, user_message, answer, "facts"), None
+
+    # repeated, memory-independent questions are answered from the cache
+    cache_key = answer_cache.key_for(user_message)
+    if cache_key:
+        answer = answer_cache.get(cache_key)
+        if answer:
+            return handlers.answered(session_id, user_message, answer, "cache"), None
+
+    # Build history: newest turns that fit the token budget
+    context = context or chat_context(user_id, session_id)
+    return handlers.build_turn(session_id, user_message, context, cache_key), None
+
+def finish_chat(user_id: int, session_id: int | None, user_message: str, answer: str) -> tuple[int, int]:
+    """Store the turn and its facts; returns ``(chat_id, session_id)``. Without
+    a session id a new session is created in the same statement."""
+    facts = extract_facts(user_message, answer)
+    chat_id, new_id = dbx.record_chat_turn(user_id, session_id, user_message, answer, facts)
+    handlers.turn_recorded(user_context, summary_worker, user_id, session_id, new_id, facts)
+    return chat_id, new_id
+
+@bp.post("/chat")
+def chat():
+    ok, err, code = require_login()
+    if not ok: return err, code
+    turn, error = prepare_chat()
+    if error: return error
+    user_id, session_id = session["user_id"], turn["session_id"]
+
+    if "direct_answer" in turn:
+        answer = turn["direct_answer"]
+        chat_id, session_id = finish_chat(user_id, session_id, turn["user_message"], answer)
+        return jsonify(handlers.chat_body(turn, answer, chat_id, session_id)), 200
 
     try:
-        resp = client.chat.completions.create(
-            model=OPEN_AI_MODEL,
-            messages=messages,
-            temperature=0.3,
-        )
+        key, kwargs = handlers.completion(OPEN_AI_MODEL, turn)
+        with metrics.span("openai.chat"):
+            resp, shared = flights.do(key, lambda: gateway.complete(get_client().chat.completions.create, **kwargs))
+        if not shared:
+            metrics.count_tokens("chat", resp.usage)
         answer = resp.choices[0].message.content
-        chat_id = dbx.insert_chat(session_id, user_message, answer, feedback=None)
-
-        # Update session summary for memory
-        summary_prompt = f"""
-        Summarize the following conversation in a structured, chronological timeline for future reference. 
-        Keep it concise but preserve the order of what the user asked and how the assistant responded. 
-        Do not merge or rephrase the sequence into a single narrative—use numbered steps.
-
-        Previous summary:
-        {summary or "None"}
-
-        New conversation:
-        User: {user_message}
-        Assistant: {answer}
-        """
-
-        summary_resp = client.chat.completions.create(
-            model=OPEN_AI_MODEL,
-            messages=[{"role": "user", "content": summary_prompt}],
-            temperature=0.0,
-        )
-        summary_text = summary_resp.choices[0].message.content
-        dbx.update_session_summary(session_id, summary_text)
-
-        return jsonify({"response": answer, "chat_id": chat_id, "session_id": session_id}), 200
+        if handlers.cacheable(turn, answer, shared):
+            answer_cache.put(turn["cache_key"], answer, resp.usage)
+        chat_id, session_id = finish_chat(user_id, session_id, turn["user_message"], answer)
+        return jsonify(handlers.chat_body(turn, answer, chat_id, session_id)), 200
+    except LLMBusy as e:
+        return handlers.llm_busy(e)
     except Exception as e:
         print("Chat error:", e)
-        return jsonify({"error": str(e)}), 500
+        return handlers.error(str(e), 500)
+
+@bp.post("/chat/stream")
+def chat_stream():
+    """Server-Sent Events variant of /chat.
+
+    Emits ``meta`` (session id), then one ``data`` event per model delta
+    (``{"delta": "..."}``), then ``done`` with the persisted ``chat_id``, or
+    ``error``. The answer is stored once the model stream completes.
+    """
+    ok, err, code = require_login()
+    if not ok: return err, code
+    turn, error = prepare_chat()
+    if error: return error
+    user_id, session_id = session["user_id"], turn["session_id"]
+    if not session_id:
+        # the meta event carries the session id, so it's needed before the answer
+        session_id = dbx.create_session(user_id, "New Chat")
+        user_context.add_session(user_id, session_id, memory=EMPTY_MEMORY)
+
+    def events():
+        yield handlers.meta_event(turn, session_id)
+        if "direct_answer" in turn:
+            yield sse({"delta": turn["direct_answer"]})
+            chat_id, _ = finish_chat(user_id, session_id, turn["user_message"], turn["direct_answer"])
+            yield handlers.done_event(chat_id, session_id)
+            return
+        try:
+            key, kwargs = handlers.completion(OPEN_AI_MODEL, turn, stream=True)
+            streamed = handlers.StreamedAnswer()
+            with metrics.span("openai.chat_stream"):
+                stream, shared = flights.stream(
+                    key, lambda: gateway.complete(get_client().chat.completions.create, **kwargs),
+                )
+                for chunk in stream:
+                    delta = streamed.feed(chunk)
+                    if delta:
+                        yield sse({"delta": delta})
+            if not shared:
+                metrics.count_tokens("chat", streamed.usage)
+            answer = streamed.answer
+            if handlers.cacheable(turn, answer, shared):
+                answer_cache.put(turn["cache_key"], answer, streamed.usage)
+            chat_id, _ = finish_chat(user_id, session_id, turn["user_message"], answer)
+            yield handlers.done_event(chat_id, session_id)
+        except Exception as e:
+            if not isinstance(e, LLMBusy):
+                print("Chat error:", e)
+            yield handlers.error_event(e)
+
+    # the request is timed until the last event is sent
+    trace = metrics.defer_request()
+
+    def generate():
+        try:
+            yield from events()
+        finally:
+            if trace is not None:
+                trace.finish()
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(stream_with_context(generate()), mimetype="text/event-stream", headers=headers)
 
 
 # feedback
-@app.post("/feedback")
+@bp.post("/feedback")
 def feedback():
+    """Queue a like / dislike; it is written within ``FEEDBACK_FLUSH_INTERVAL``
+    seconds. 404 unless the chat is in one of the caller's sessions."""
     ok, err, code = require_login()
     if not ok: return err, code
-    data = request.get_json(force=True) or {}
-    chat_id = data.get("chat_id")
-    feedback_val = (data.get("feedback") or "").strip().lower()
-    if feedback_val not in ("liked", "disliked"):
-        return jsonify({"error": "feedback must be 'liked' or 'disliked'"}), 400
-    if not chat_id:
-        return jsonify({"error": "chat_id required"}), 400
     try:
-        dbx.update_feedback(chat_id, feedback_val)
-        return jsonify({"message": "feedback saved"}), 200
-    except Exception as e:
-        print("Feedback error:", e)
-        return jsonify({"error": str(e)}), 500
+        chat_id, feedback_val = handlers.feedback_request(request.get_json(force=True) or {})
+    except ValueError as e:
+        return handlers.error(str(e))
+    # the chat's session, looked up here: one named by the client isn't trusted
+    session_id = dbx.get_chat_session(chat_id, session["user_id"])
+    if session_id is None:
+        return handlers.error("not found", 404)
+    if not feedback_buffer.add(chat_id, session_id, feedback_val):
+        return handlers.error("server busy, try again", 503, {"Retry-After": "1"})
+    return jsonify({"message": "feedback received"}), 202
 
-@app.get("/health")
+@bp.get("/feedback/stats")
+def feedback_stats():
+    """Daily likes / dislikes per code (``""``: answers without a code), newest day first."""
+    ok, err, code = require_login()
+    if not ok: return err, code
+    try:
+        days = handlers.stats_days(request.args.get("days", "30"))
+    except ValueError as e:
+        return handlers.error(str(e))
+    return jsonify(handlers.feedback_stats_body(dbx.get_feedback_daily(days), feedback_buffer.snapshot())), 200
+
+@bp.get("/cache/stats")
+def cache_stats():
+    ok, err, code = require_login()
+    if not ok: return err, code
+    return jsonify(handlers.cache_stats_body(answer_cache, flights, user_context)), 200
+
+@bp.get("/metrics")
+def prometheus_metrics():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@bp.get("/health")
 def health():
+    """Liveness: answers as soon as the process serves, without touching Postgres or OpenAI."""
     return {"ok": True, "model": OPEN_AI_MODEL}, 200
 
+@bp.get("/ready")
+def ready():
+    """Readiness: 200 once ``warm_up`` has passed; the first call does the work."""
+    try:
+        warm_up()
+    except Exception as e:
+        return {"ready": False, "error": str(e)}, 503
+    return {"ready": True}, 200
+
 if __name__ == "__main__":
     print("✅ Flask backend at http://127.0.0.1:5000")
-    app.run(host="127.0.0.1", port=5000, debug=False)
+    create_app().run(host="127.0.0.1", port=5000, debug=False)
@@ -0,0 +1,146 @@
+"""Async versions of the request-path queries in db.py, for server/asgi.py.
+
+Schema setup, summaries and the answer cache stay on the threaded psycopg2
+pool; everything a chat request waits on goes through the async pool.
+"""
+from typing import AsyncIterator, List, Dict, Any
+
+from psycopg.types.json import Json
+
+from server.db.async_pool import get_async_pool
+from server.db.db import (
+    LIST_SESSIONS_PAGE_SQL, INSERT_CHAT_SQL, CHATS_PAGE_SQL, LOAD_CHAT_TURN_SQL, INSERT_SESSION_WITH_CHAT_SQL,
+    RECENT_HISTORY_SQL, SESSION_FACTS_SQL, CHAT_SESSION_SQL, FEEDBACK_DAILY_SQL, EXPORT_SQL, RESTORE_SESSION_SQL, fact_codes,
+)
+from server.metrics import timed
+
+
+async def _fetchone(sql: str, params: tuple) -> Dict[str, Any] | None:
+    async with get_async_pool().connection() as conn:
+        cur = await conn.execute(sql, params)
+        return await cur.fetchone()
+
+
+async def _fetchall(sql: str, params: tuple) -> List[Dict[str, Any]]:
+    async with get_async_pool().connection() as conn:
+        cur = await conn.execute(sql, params)
+        return await cur.fetchall()
+
+
+@timed("db")
+async def get_user_by_username(username: str) -> Dict[str, Any] | None:
+    return await _fetchone("SELECT * FROM users WHERE username=%s", (username,))
+
+
+@timed("db")
+async def insert_user(username: str, password_hash: str) -> int:
+    row = await _fetchone(
+        "INSERT INTO users (username, password_hash) VALUES (%s, %s) RETURNING id",
+        (username, password_hash),
+    )
+    return row["id"]
+
+
+@timed("db")
+async def update_password_hash(user_id: int, password_hash: str):
+    async with get_async_pool().connection() as conn:
+        await conn.execute("UPDATE users SET password_hash=%s WHERE id=%s", (password_hash, user_id))
+
+
+@timed("db")
+async def create_session(user_id: int, session_name: str | None = None) -> int:
+    row = await _fetchone(
+        "INSERT INTO chat_sessions (user_id, session_name) VALUES (%s, %s) RETURNING id",
+        (user_id, session_name),
+    )
+    return row["id"]
+
+
+@timed("db")
+async def session_belongs_to_user(session_id: int, user_id: int) -> bool:
+    row = await _fetchone("SELECT 1 FROM chat_sessions WHERE id=%s AND user_id=%s", (session_id, user_id))
+    return row is not None
+
+
+@timed("db")
+async def list_sessions_page(user_id: int, limit: int, before: tuple | None = None) -> List[Dict[str, Any]]:
+    ts, sid = before or (None, None)
+    return await _fetchall(LIST_SESSIONS_PAGE_SQL, (user_id, ts, ts, sid, limit))
+
+
+@timed("db")
+async def get_chats_page(session_id: int, limit: int, before: tuple | None = None) -> List[Dict[str, Any]]:
+    ts, cid = before or (None, None)
+    return await _fetchall(CHATS_PAGE_SQL, (session_id, ts, ts, cid, limit) * 2 + (limit,))
+
+
+@timed("db")
+async def get_recent_history(session_id: int, max_turns: int) -> Dict[str, Any] | None:
+    return await _fetchone(RECENT_HISTORY_SQL, (max_turns, session_id))
+
+
+@timed("db")
+async def get_session_summary(session_id: int) -> str:
+    row = await _fetchone("SELECT history_summary FROM chat_sessions WHERE id=%s", (session_id,))
+    return row["history_summary"] if row else ""
+
+
+@timed("db")
+async def insert_chat(session_id: int, user_message: str, ai_response: str, feedback: str | None = None,
+                      facts: List[Dict[str, str]] | None = None) -> int:
+    row = await _fetchone(
+        INSERT_CHAT_SQL,
+        (session_id, user_message, ai_response, feedback, fact_codes(facts), Json(facts or []), user_message or None, session_id),
+    )
+    return row["id"]
+
+
+@timed("db")
+async def load_chat_turn(session_id: int, user_id: int, max_turns: int, max_digests: int, max_facts: int) -> Dict[str, Any] | None:
+    return await _fetchone(LOAD_CHAT_TURN_SQL, (max_digests, max_facts, max_turns, session_id, user_id))
+
+
+@timed("db")
+async def record_chat_turn(user_id: int, session_id: int | None, user_message: str, ai_response: str,
+                           facts: List[Dict[str, str]] | None = None, session_name: str = "New Chat") -> tuple[int, int]:
+    if session_id is not None:
+        return await insert_chat(session_id, user_message, ai_response, facts=facts), session_id
+    row = await _fetchone(
+        INSERT_SESSION_WITH_CHAT_SQL,
+        (user_id, session_name, user_message or None, user_message, ai_response, fact_codes(facts), Json(facts or [])),
+    )
+    return row["id"], row["session_id"]
+
+
+@timed("db")
+async def get_session_facts(session_id: int) -> List[Dict[str, Any]]:
+    return await _fetchall(SESSION_FACTS_SQL, (session_id,))
+
+
+@timed("db")
+async def get_chat_session(chat_id: int, user_id: int) -> int | None:
+    row = await _fetchone(CHAT_SESSION_SQL, (chat_id, user_id))
+    return row["session_id"] if row else None
+
+
+@timed("db")
+async def get_feedback_daily(days: int) -> List[Dict[str, Any]]:
+    return await _fetchall(FEEDBACK_DAILY_SQL, (days,))
+
+
+@timed("db")
+async def restore_session(session_id: int) -> int:
+    row = await _fetchone(RESTORE_SESSION_SQL, (session_id, session_id))
+    return row["restored"] if row else 0
+
+
+async def iter_user_export(user_id: int, batch_size: int = 1000) -> AsyncIterator[Dict[str, Any]]:
+    """``db.iter_user_export`` on a server-side cursor of the async pool."""
+    async with get_async_pool().connection() as conn:
+        # the pool's connections are autocommit; a server-side cursor needs a transaction
+        async with conn.transaction():
+            async with conn.cursor(name="export") as cur:
+                cur.itersize = batch_size
+                await cur.execute(EXPORT_SQL, (user_id,))
+                async for row in cur:
+                    yield row
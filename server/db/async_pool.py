@@ -0,0 +1,41 @@
+from psycopg import AsyncClientCursor
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+
+from server.db import querycount
+from server.db.pool import db_settings, pool_settings
+
+
+class CountingAsyncClientCursor(AsyncClientCursor):
+    async def execute(self, query, params=None, **kwargs):
+        querycount.record()
+        return await super().execute(query, params, **kwargs)
+
+_pool: AsyncConnectionPool | None = None
+
+
+def get_async_pool() -> AsyncConnectionPool:
+    """psycopg 3 pool for the ASGI app; opened and closed by its serving hooks.
+
+    Sized by the same DB_POOL_* settings as the threaded pool. A chat only
+    holds a connection for the few milliseconds of each query, so a small
+    pool serves many concurrent in-flight chats.
+    """
+    global _pool
+    if _pool is None:
+        settings = pool_settings()
+        _pool = AsyncConnectionPool(
+            kwargs={
+                **db_settings(),
+                # every query is a single statement, so no explicit transactions
+                "autocommit": True,
+                "row_factory": dict_row,
+                # client-side binding like psycopg2, so the shared SQL plans identically
+                "cursor_factory": CountingAsyncClientCursor if querycount.DB_COUNT_QUERIES else AsyncClientCursor,
+            },
+            min_size=settings["minconn"],
+            max_size=settings["maxconn"],
+            timeout=settings["timeout"],
+            open=False,
+        )
+    return _pool
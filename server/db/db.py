@@ -1,18 +1,20 @@
-import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from typing import List, Dict, Any
+from psycopg2.extras import RealDictCursor, Json, execute_values
+from typing import Iterator, List, Dict, Any
 
+from server.db.pool import pooled_connection
+from server.db.migrations import apply_migrations, pending_migrations as _pending_migrations
+from server.metrics import timed
+
+# connections are borrowed from the shared pool (see server/db/pool.py);
+# pool size is configured with DB_POOL_MIN / DB_POOL_MAX next to the DB_* settings.
+# Query functions are @timed: each call shows up as db.<name> in /metrics.
 def get_connection():
-    return psycopg2.connect(
-        host=os.getenv("DB_HOST", "localhost"),
-        port=os.getenv("DB_PORT", "5432"),
-        database=os.getenv("DB_NAME", "icd_chatbot"),
-        user=os.getenv("DB_USER", "postgres"),
-        password=os.getenv("DB_PASSWORD", "postgres"),
-    )
-
-def create_tables():
+    return pooled_connection()
+
+@timed("db")
+def create_tables() -> List[int]:
+    """Create the baseline tables and apply pending migrations (``python -m server.migrate``);
+    returns the migration versions applied. Schema changes go in ``MIGRATIONS``."""
     ddl = """
     CREATE TABLE IF NOT EXISTS users (
         id SERIAL PRIMARY KEY,
@@ -25,7 +27,7 @@ def create_tables():
         id SERIAL PRIMARY KEY,
         user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
         session_name VARCHAR(255),
-        started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
         history_summary TEXT DEFAULT ''
     );
 
@@ -38,26 +40,27 @@ def create_tables():
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     );
     """
-    conn = get_connection()
-    try:
+    with get_connection() as conn:
         with conn:
             with conn.cursor() as cur:
                 cur.execute(ddl)
-    finally:
-        conn.close()
+        return apply_migrations(conn)
 
+@timed("db")
+def pending_migrations() -> List[int]:
+    with get_connection() as conn:
+        return _pending_migrations(conn)
+
+@timed("db")
 def get_user_by_username(username: str) -> Dict[str, Any] | None:
-    conn = get_connection()
-    try:
+    with get_connection() as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute("SELECT * FROM users WHERE username=%s", (username,))
             return cur.fetchone()
-    finally:
-        conn.close()
 
+@timed("db")
 def insert_user(username: str, password_hash: str) -> int:
-    conn = get_connection()
-    try:
+    with get_connection() as conn:
         with conn:
             with conn.cursor() as cur:
                 cur.execute(
@@ -65,12 +68,17 @@ def insert_user(username: str, password_hash: str) -> int:
                     (username, password_hash),
                 )
                 return cur.fetchone()[0]
-    finally:
-        conn.close()
 
+@timed("db")
+def update_password_hash(user_id: int, password_hash: str):
+    with get_connection() as conn:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute("UPDATE users SET password_hash=%s WHERE id=%s", (password_hash, user_id))
+
+@timed("db")
 def create_session(user_id: int, session_name: str | None = None) -> int:
-    conn = get_connection()
-    try:
+    with get_connection() as conn:
         with conn:
             with conn.cursor() as cur:
                 cur.execute(
@@ -78,74 +86,204 @@ def create_session(user_id: int, session_name: str | None = None) -> int:
                     (user_id, session_name),
                 )
                 return cur.fetchone()[0]
-    finally:
-        conn.close()
 
+@timed("db")
 def session_belongs_to_user(session_id: int, user_id: int) -> bool:
-    conn = get_connection()
-    try:
+    with get_connection() as conn:
         with conn.cursor() as cur:
             cur.execute("SELECT 1 FROM chat_sessions WHERE id=%s AND user_id=%s", (session_id, user_id))
             return cur.fetchone() is not None
-    finally:
-        conn.close()
 
+@timed("db")
 def get_latest_session_id(user_id: int) -> int | None:
-    conn = get_connection()
-    try:
+    with get_connection() as conn:
         with conn.cursor() as cur:
             cur.execute("SELECT id FROM chat_sessions WHERE user_id=%s ORDER BY started_at DESC, id DESC LIMIT 1", (user_id,))
             row = cur.fetchone()
             return row[0] if row else None
-    finally:
-        conn.close()
 
+@timed("db")
 def list_sessions_with_preview(user_id: int) -> List[Dict[str, Any]]:
+    # last_activity / first_user_message are maintained by insert_chat, so this
+    # is a single range scan of idx_chat_sessions_user_activity
     sql = """
-    SELECT
-      cs.id,
-      cs.session_name,
-      cs.started_at,
-      (SELECT c.user_message
-         FROM chats c
-        WHERE c.session_id = cs.id
-          AND c.user_message IS NOT NULL
-        ORDER BY c.created_at ASC, c.id ASC
-        LIMIT 1) AS first_user_message,
-      (SELECT MAX(c.created_at)
-         FROM chats c
-        WHERE c.session_id = cs.id) AS last_activity
-    FROM chat_sessions cs
-    WHERE cs.user_id = %s
-    ORDER BY COALESCE(
-               (SELECT MAX(c.created_at) FROM chats c WHERE c.session_id = cs.id),
-               cs.started_at
-             ) DESC, cs.id DESC;
+    SELECT id, session_name, started_at, first_user_message, last_activity
+      FROM chat_sessions
+     WHERE user_id = %s
+     ORDER BY last_activity DESC, id DESC;
     """
-    conn = get_connection()
-    try:
+    with get_connection() as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute(sql, (user_id,))
             return cur.fetchall()
-    finally:
-        conn.close()
 
-def insert_chat(session_id: int, user_message: str, ai_response: str, feedback: str | None = None) -> int:
-    conn = get_connection()
-    try:
+# the *_SQL statements are shared with the async queries in server/db/async_db.py
+LIST_SESSIONS_PAGE_SQL = """
+SELECT id, session_name, started_at, first_user_message, last_activity
+  FROM chat_sessions
+ WHERE user_id = %s
+   AND (%s::timestamp IS NULL OR (last_activity, id) < (%s, %s))
+ ORDER BY last_activity DESC, id DESC
+ LIMIT %s;
+"""
+
+@timed("db")
+def list_sessions_page(user_id: int, limit: int, before: tuple | None = None) -> List[Dict[str, Any]]:
+    """Sessions ordered newest activity first, strictly older than the
+    ``(last_activity, id)`` keyset cursor ``before`` when given."""
+    ts, sid = before or (None, None)
+    with get_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(LIST_SESSIONS_PAGE_SQL, (user_id, ts, ts, sid, limit))
+            return cur.fetchall()
+
+# facts of the turn (server/facts.py), upserted in the statement that stores it;
+# takes a JSON list of {"kind", "key", "value"}
+UPSERT_FACTS_SQL = """
+    INSERT INTO session_facts (session_id, kind, fact_key, value, chat_id, first_seen, last_seen)
+    SELECT c.session_id, v.kind, v.key, v.value, c.id, c.created_at, c.created_at
+      FROM c, json_to_recordset(%s::json) AS v(kind TEXT, key TEXT, value TEXT)
+    ON CONFLICT (session_id, kind, fact_key) DO UPDATE
+       SET value = EXCLUDED.value,
+           chat_id = EXCLUDED.chat_id,
+           last_seen = EXCLUDED.last_seen,
+           mentions = session_facts.mentions + 1"""
+
+def fact_codes(facts: List[Dict[str, str]] | None) -> List[str]:
+    """Codes among a turn's facts, stored on the chat for the feedback rollup."""
+    return [f["key"] for f in facts or () if f["kind"] == "code"]
+
+# insert the chat and keep the session's denormalized sidebar columns current.
+# A session with a new turn is active again: if it was archived meanwhile (its
+# ownership was cached), the archived part stays readable and is restored on
+# the next load (LOAD_CHAT_TURN_SQL checks chats_archive, not archived_at)
+INSERT_CHAT_SQL = f"""
+WITH c AS (
+    INSERT INTO chats (session_id, user_message, ai_response, feedback, codes)
+    VALUES (%s, %s, %s, %s, %s::text[])
+    RETURNING id, session_id, created_at
+), f AS ({UPSERT_FACTS_SQL}
+)
+UPDATE chat_sessions cs
+   SET last_activity = c.created_at,
+       first_user_message = COALESCE(cs.first_user_message, %s),
+       archived_at = NULL
+  FROM c
+ WHERE cs.id = %s
+RETURNING c.id
+"""
+
+@timed("db")
+def insert_chat(session_id: int, user_message: str, ai_response: str, feedback: str | None = None,
+                facts: List[Dict[str, str]] | None = None) -> int:
+    with get_connection() as conn:
         with conn:
             with conn.cursor() as cur:
-                cur.execute(
-                    "INSERT INTO chats (session_id, user_message, ai_response, feedback) VALUES (%s, %s, %s, %s) RETURNING id",
-                    (session_id, user_message, ai_response, feedback),
-                )
+                cur.execute(INSERT_CHAT_SQL, (
+                    session_id, user_message, ai_response, feedback, fact_codes(facts), Json(facts or []),
+                    user_message or None, session_id,
+                ))
                 return cur.fetchone()[0]
-    finally:
-        conn.close()
 
+# a chat turn is one read before the model call and one write after it, each
+# a single statement; a connection isn't held across the model call
+
+# a session's memory for the prompt: the compacted summary, the newest
+# digests not folded into it yet and the name plus the most recently
+# mentioned facts (both oldest first); takes the digest and fact limits
+MEMORY_SQL = """
+json_build_object(
+    'summary', COALESCE(cs.history_summary, ''),
+    'digests', COALESCE((
+        SELECT json_agg(json_build_object('chat_id', d.chat_id, 'digest', d.digest) ORDER BY d.chat_id)
+          FROM (SELECT chat_id, digest
+                  FROM chat_digests
+                 WHERE session_id = cs.id AND chat_id > cs.summary_chat_id
+                 ORDER BY chat_id DESC
+                 LIMIT %s) d
+    ), '[]'::json),
+    'facts', COALESCE((
+        SELECT json_agg(json_build_object('kind', f.kind, 'key', f.fact_key, 'value', f.value) ORDER BY f.last_seen)
+          FROM (SELECT kind, fact_key, value, last_seen
+                  FROM session_facts
+                 WHERE session_id = cs.id
+                 ORDER BY kind = 'name' DESC, last_seen DESC
+                 LIMIT %s) f
+    ), '[]'::json)
+) AS memory"""
+
+# the newest turns (newest first); takes the turn limit.
+# ``archived``: some turns are in chats_archive, restore_session first
+RECENT_SQL = """
+       COALESCE((
+           SELECT json_agg(json_build_object('id', h.id, 'user_message', h.user_message, 'ai_response', h.ai_response)
+                           ORDER BY h.created_at DESC, h.id DESC)
+             FROM (SELECT id, user_message, ai_response, created_at
+                     FROM chats
+                    WHERE session_id = cs.id
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT %s) h
+       ), '[]'::json) AS recent,
+       EXISTS (SELECT 1 FROM chats_archive a WHERE a.session_id = cs.id) AS archived"""
+
+# ownership, memory and the newest turns in one round trip; no row if not owned
+LOAD_CHAT_TURN_SQL = f"""
+SELECT {MEMORY_SQL},{RECENT_SQL}
+  FROM chat_sessions cs
+ WHERE cs.id = %s AND cs.user_id = %s
+"""
+
+# the newest turns when the memory is cached; no row if the session is gone
+RECENT_HISTORY_SQL = f"""
+SELECT {RECENT_SQL.lstrip()}
+  FROM chat_sessions cs
+ WHERE cs.id = %s
+"""
+
+# first turn of a new session: the session and its first chat in one statement
+# (last_activity and created_at both default to the same transaction timestamp)
+INSERT_SESSION_WITH_CHAT_SQL = f"""
+WITH s AS (
+    INSERT INTO chat_sessions (user_id, session_name, first_user_message)
+    VALUES (%s, %s, %s)
+    RETURNING id
+), c AS (
+    INSERT INTO chats (session_id, user_message, ai_response, codes)
+    SELECT id, %s, %s, %s::text[] FROM s
+    RETURNING id, session_id, created_at
+), f AS ({UPSERT_FACTS_SQL}
+)
+SELECT id, session_id FROM c
+"""
+
+@timed("db")
+def load_chat_turn(session_id: int, user_id: int, max_turns: int, max_digests: int, max_facts: int) -> Dict[str, Any] | None:
+    """``{"memory", "recent"}`` for a session ``user_id`` owns, else None."""
+    with get_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(LOAD_CHAT_TURN_SQL, (max_digests, max_facts, max_turns, session_id, user_id))
+            return cur.fetchone()
+
+@timed("db")
+def record_chat_turn(user_id: int, session_id: int | None, user_message: str, ai_response: str,
+                     facts: List[Dict[str, str]] | None = None, session_name: str = "New Chat") -> tuple[int, int]:
+    """Store a turn and its facts, creating the session first when
+    ``session_id`` is None. Returns ``(chat_id, session_id)``."""
+    if session_id is not None:
+        return insert_chat(session_id, user_message, ai_response, facts=facts), session_id
+    with get_connection() as conn:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(INSERT_SESSION_WITH_CHAT_SQL, (
+                    user_id, session_name, user_message or None, user_message, ai_response, fact_codes(facts),
+                    Json(facts or []),
+                ))
+                chat_id, session_id = cur.fetchone()
+                return chat_id, session_id
+
+@timed("db")
 def get_history_pairs(session_id: int) -> List[Dict[str, Any]]:
-    conn = get_connection()
-    try:
+    with get_connection() as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute("SELECT user_message, ai_response, id FROM chats WHERE session_id=%s ORDER BY created_at ASC, id ASC", (session_id,))
             rows = cur.fetchall()
@@ -156,40 +294,160 @@ def get_history_pairs(session_id: int) -> List[Dict[str, Any]]:
                 if r["ai_response"]:
                     messages.append({"role": "assistant", "content": r["ai_response"], "chat_id": r["id"]})
             return messages
-    finally:
-        conn.close()
 
+@timed("db")
+def get_recent_history(session_id: int, max_turns: int) -> Dict[str, Any] | None:
+    """``{"recent", "archived"}``: the newest ``max_turns`` chat rows of a
+    session, newest first, and whether some are in chats_archive."""
+    with get_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(RECENT_HISTORY_SQL, (max_turns, session_id))
+            return cur.fetchone()
+
+def chat_rows_to_messages(rows) -> List[Dict[str, Any]]:
+    out = []
+    for r in rows:
+        if r["user_message"]:
+            out.append({"role": "user", "content": r["user_message"], "chat_id": r["id"], "feedback": None})
+        if r["ai_response"]:
+            out.append({"role": "assistant", "content": r["ai_response"], "chat_id": r["id"], "feedback": r.get("feedback")})
+    return out
+
+@timed("db")
 def get_chats_for_session(session_id: int) -> List[Dict[str, Any]]:
-    conn = get_connection()
-    try:
+    with get_connection() as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute("SELECT id, user_message, ai_response, feedback, created_at FROM chats WHERE session_id=%s ORDER BY created_at ASC, id ASC", (session_id,))
-            rows = cur.fetchall()
-            out = []
-            for r in rows:
-                if r["user_message"]:
-                    out.append({"role": "user", "content": r["user_message"], "chat_id": r["id"], "feedback": None})
-                if r["ai_response"]:
-                    out.append({"role": "assistant", "content": r["ai_response"], "chat_id": r["id"], "feedback": r.get("feedback")})
-            return out
-    finally:
-        conn.close()
+            return chat_rows_to_messages(cur.fetchall())
+
+# the columns of a chat kept in chats_archive.chats, for jsonb_to_recordset
+ARCHIVED_CHAT = "(id INTEGER, user_message TEXT, ai_response TEXT, feedback VARCHAR(10), codes TEXT[], created_at TIMESTAMP)"
+
+# archived chats are read in place (one primary key probe for other sessions);
+# the limit is applied to each part too, so the hot part stays an index range scan.
+# Takes the session id, the cursor and the limit twice.
+CHATS_PAGE_SQL = f"""
+(SELECT id, user_message, ai_response, feedback, created_at
+   FROM chats
+  WHERE session_id = %s
+    AND (%s::timestamp IS NULL OR (created_at, id) < (%s, %s))
+  ORDER BY created_at DESC, id DESC
+  LIMIT %s)
+UNION ALL
+(SELECT r.id, r.user_message, r.ai_response, r.feedback, r.created_at
+   FROM chats_archive a, jsonb_to_recordset(a.chats) AS r{ARCHIVED_CHAT}
+  WHERE a.session_id = %s
+    AND (%s::timestamp IS NULL OR (r.created_at, r.id) < (%s, %s))
+  ORDER BY r.created_at DESC, r.id DESC
+  LIMIT %s)
+ORDER BY created_at DESC, id DESC
+LIMIT %s;
+"""
 
-def update_feedback(chat_id: int, feedback: str):
-    conn = get_connection()
-    try:
+@timed("db")
+def get_chats_page(session_id: int, limit: int, before: tuple | None = None) -> List[Dict[str, Any]]:
+    """Newest ``limit`` chat rows older than the ``(created_at, id)`` cursor, newest first."""
+    ts, cid = before or (None, None)
+    with get_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(CHATS_PAGE_SQL, (session_id, ts, ts, cid, limit) * 2 + (limit,))
+            return cur.fetchall()
+
+@timed("db")
+def get_chats_for_sessions(session_ids: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+    """Messages of many sessions in one query, keyed by session id."""
+    out: Dict[int, List[Dict[str, Any]]] = {sid: [] for sid in session_ids}
+    if not session_ids:
+        return out
+    with get_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(
+                "SELECT session_id, id, user_message, ai_response, feedback, created_at FROM chats "
+                "WHERE session_id = ANY(%s) ORDER BY session_id, created_at ASC, id ASC",
+                (list(session_ids),),
+            )
+            by_session: Dict[int, list] = {}
+            for r in cur.fetchall():
+                by_session.setdefault(r["session_id"], []).append(r)
+    for sid, rows in by_session.items():
+        out[sid] = chat_rows_to_messages(rows)
+    return out
+
+# session of a chat ``user_id`` owns
+CHAT_SESSION_SQL = """
+SELECT c.session_id
+  FROM chats c JOIN chat_sessions cs ON cs.id = c.session_id
+ WHERE c.id = %s AND cs.user_id = %s
+"""
+
+@timed("db")
+def get_chat_session(chat_id: int, user_id: int) -> int | None:
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(CHAT_SESSION_SQL, (chat_id, user_id))
+            row = cur.fetchone()
+            return row[0] if row else None
+
+# buffered feedback clicks (server/feedback.py) in one statement. A click only
+# applies to a chat of the session it names, whose owner was checked when it
+# was buffered. Changed rows move their day's per-code counts by the
+# difference; unchanged ones are skipped, so applying a batch twice is harmless.
+APPLY_FEEDBACK_SQL = """
+WITH v(chat_id, session_id, feedback) AS (VALUES %s),
+changed AS (
+    SELECT c.id, c.created_at::date AS day, c.codes, c.feedback AS old, v.feedback AS new
+      FROM chats c JOIN v ON c.id = v.chat_id AND c.session_id = v.session_id
+     WHERE c.feedback IS DISTINCT FROM v.feedback
+       FOR UPDATE OF c
+), updated AS (
+    UPDATE chats c SET feedback = changed.new FROM changed WHERE c.id = changed.id
+)
+INSERT INTO feedback_daily (day, code, likes, dislikes)
+SELECT day, COALESCE(code, ''),
+       SUM((new = 'liked')::int - COALESCE(old = 'liked', false)::int),
+       SUM((new = 'disliked')::int - COALESCE(old = 'disliked', false)::int)
+  FROM changed LEFT JOIN LATERAL unnest(codes) AS code ON true
+ GROUP BY 1, 2
+ON CONFLICT (day, code) DO UPDATE
+   SET likes = feedback_daily.likes + EXCLUDED.likes,
+       dislikes = feedback_daily.dislikes + EXCLUDED.dislikes
+"""
+
+@timed("db")
+def apply_feedback(rows: List[tuple]):
+    """Apply ``(chat_id, session_id, feedback)`` rows, one per chat."""
+    with get_connection() as conn:
         with conn:
             with conn.cursor() as cur:
-                cur.execute("UPDATE chats SET feedback=%s WHERE id=%s", (feedback, chat_id))
-    finally:
-        conn.close()
+                execute_values(cur, APPLY_FEEDBACK_SQL, rows, page_size=max(len(rows), 1))
+
+FEEDBACK_DAILY_SQL = """
+SELECT day, code, likes, dislikes
+  FROM feedback_daily
+ WHERE day > CURRENT_DATE - %s
+ ORDER BY day DESC, likes + dislikes DESC, code
+"""
+
+@timed("db")
+def get_feedback_daily(days: int) -> List[Dict[str, Any]]:
+    """Rollup rows of the last ``days`` days, newest first."""
+    with get_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(FEEDBACK_DAILY_SQL, (days,))
+            return cur.fetchall()
 
+@timed("db")
 def get_user_sessions_with_messages(user_id: int) -> List[Dict[str, Any]]:
+    """Every session with all of its messages, archived ones excluded
+    (``iter_user_export`` streams everything).
+
+    Two queries regardless of session count; /login no longer uses this.
+    """
     sessions = list_sessions_with_preview(user_id)
+    chats_by_session = get_chats_for_sessions([s["id"] for s in sessions])
     out = []
     for s in sessions:
         sid = s["id"]
-        chats = get_chats_for_session(sid)
         title = s.get("first_user_message") or s.get("session_name") or f"Chat {sid}"
         out.append({
             "id": sid,
@@ -198,28 +456,356 @@ def get_user_sessions_with_messages(user_id: int) -> List[Dict[str, Any]]:
             "started_at": s.get("started_at"),
             "first_user_message": s.get("first_user_message"),
             "last_activity": s.get("last_activity"),
-            "messages": chats
+            "messages": chats_by_session[sid]
         })
     return out
 
-def update_session_summary(session_id: int, summary: str):
-    conn = get_connection()
-    try:
+# every chat of a user, hot and archived, one row per chat: sessions newest
+# first (from idx_chat_sessions_user_activity), chats oldest first within each,
+# so the sort is per session and the rows stream through a server-side cursor
+EXPORT_SQL = f"""
+SELECT cs.id AS session_id, cs.session_name, cs.started_at AS session_started_at,
+       cs.last_activity AS session_last_activity, cs.archived_at IS NOT NULL AS archived,
+       c.id AS chat_id, c.created_at, c.user_message, c.ai_response, c.feedback, c.codes
+  FROM chat_sessions cs
+ CROSS JOIN LATERAL (
+       SELECT id, user_message, ai_response, feedback, codes, created_at
+         FROM chats
+        WHERE session_id = cs.id
+       UNION ALL
+       SELECT r.*
+         FROM chats_archive a, jsonb_to_recordset(a.chats) AS r{ARCHIVED_CHAT}
+        WHERE a.session_id = cs.id
+ ) c
+ WHERE cs.user_id = %s
+ ORDER BY cs.user_id, cs.last_activity DESC, cs.id DESC, c.created_at, c.id
+"""
+
+def iter_user_export(user_id: int, batch_size: int = 1000) -> Iterator[Dict[str, Any]]:
+    """Stream ``EXPORT_SQL`` rows, ``batch_size`` at a time, holding one pooled
+    connection until the iterator is exhausted or closed."""
+    with get_connection() as conn:
+        with conn:
+            with conn.cursor(name="export", cursor_factory=RealDictCursor) as cur:
+                cur.itersize = batch_size
+                cur.execute(EXPORT_SQL, (user_id,))
+                yield from cur
+
+# moves the chats and digests of up to ``limit`` sessions idle for ``days``
+# into chats_archive, one row per session; sessions in use are skipped. A
+# session that got turns without being restored is archived again: the new
+# chats are appended to its row. Returns the chats moved per session
+ARCHIVE_SESSIONS_SQL = """
+WITH s AS (
+    SELECT id
+      FROM chat_sessions cs
+     WHERE archived_at IS NULL
+       AND last_activity < CURRENT_TIMESTAMP - make_interval(days => %s)
+       AND EXISTS (SELECT 1 FROM chats c WHERE c.session_id = cs.id)
+     ORDER BY last_activity
+     LIMIT %s
+       FOR UPDATE SKIP LOCKED
+), d AS (
+    DELETE FROM chat_digests d USING s WHERE d.session_id = s.id
+    RETURNING d.session_id, d.chat_id, d.digest, d.created_at
+), c AS (
+    DELETE FROM chats c USING s WHERE c.session_id = s.id
+    RETURNING c.session_id, c.id, c.user_message, c.ai_response, c.feedback, c.codes, c.created_at
+), a AS (
+    INSERT INTO chats_archive (session_id, turns, first_chat_at, last_chat_at, chats, digests)
+    SELECT c.session_id, COUNT(*), MIN(c.created_at), MAX(c.created_at),
+           jsonb_agg(jsonb_build_object(
+               'id', c.id, 'user_message', c.user_message, 'ai_response', c.ai_response,
+               'feedback', c.feedback, 'codes', c.codes, 'created_at', c.created_at
+           ) ORDER BY c.created_at, c.id),
+           COALESCE((SELECT jsonb_agg(jsonb_build_object('chat_id', d.chat_id, 'digest', d.digest, 'created_at', d.created_at)
+                                      ORDER BY d.chat_id)
+                       FROM d WHERE d.session_id = c.session_id), '[]')
+      FROM c
+     GROUP BY c.session_id
+    ON CONFLICT (session_id) DO UPDATE
+       SET turns = chats_archive.turns + EXCLUDED.turns,
+           first_chat_at = LEAST(chats_archive.first_chat_at, EXCLUDED.first_chat_at),
+           last_chat_at = GREATEST(chats_archive.last_chat_at, EXCLUDED.last_chat_at),
+           chats = chats_archive.chats || EXCLUDED.chats,
+           digests = chats_archive.digests || EXCLUDED.digests,
+           archived_at = EXCLUDED.archived_at
+    RETURNING session_id
+)
+UPDATE chat_sessions cs
+   SET archived_at = CURRENT_TIMESTAMP
+  FROM a
+ WHERE cs.id = a.session_id
+RETURNING (SELECT COUNT(*) FROM c WHERE c.session_id = cs.id)
+"""
+
+# moves an archived session's chats and digests back, with their ids; chats
+# stored while it was archived stay. Archiving set session_facts.chat_id to
+# NULL (ON DELETE SET NULL); a fact's last_seen is the created_at of the chat
+# that last mentioned it, which links it again
+RESTORE_SESSION_SQL = f"""
+WITH a AS (
+    DELETE FROM chats_archive WHERE session_id = %s RETURNING session_id, chats, digests
+), c AS (
+    INSERT INTO chats (id, session_id, user_message, ai_response, feedback, codes, created_at)
+    SELECT r.id, a.session_id, r.user_message, r.ai_response, r.feedback, r.codes, r.created_at
+      FROM a, jsonb_to_recordset(a.chats) AS r{ARCHIVED_CHAT}
+    ON CONFLICT (id) DO NOTHING
+    RETURNING id
+), d AS (
+    INSERT INTO chat_digests (chat_id, session_id, digest, created_at)
+    SELECT r.chat_id, a.session_id, r.digest, r.created_at
+      FROM a, jsonb_to_recordset(a.digests) AS r(chat_id INTEGER, digest TEXT, created_at TIMESTAMP)
+    ON CONFLICT (chat_id) DO NOTHING
+), f AS (
+    UPDATE session_facts sf
+       SET chat_id = r.id
+      FROM a, jsonb_to_recordset(a.chats) AS r{ARCHIVED_CHAT}
+     WHERE sf.session_id = a.session_id
+       AND sf.chat_id IS NULL
+       AND sf.last_seen = r.created_at
+)
+UPDATE chat_sessions
+   SET archived_at = NULL
+ WHERE id = %s
+RETURNING (SELECT COUNT(*) FROM c) AS restored
+"""
+
+@timed("db")
+def archive_sessions(days: int, limit: int) -> tuple[int, int]:
+    """Archive up to ``limit`` sessions idle for more than ``days`` days;
+    returns ``(sessions, chats)`` moved."""
+    with get_connection() as conn:
         with conn:
             with conn.cursor() as cur:
-                cur.execute(
-                    "UPDATE chat_sessions SET history_summary=%s WHERE id=%s",
-                    (summary, session_id)
-                )
-    finally:
-        conn.close()
+                cur.execute(ARCHIVE_SESSIONS_SQL, (days, limit))
+                turns = [row[0] for row in cur.fetchall()]
+                return len(turns), sum(turns)
+
+@timed("db")
+def restore_session(session_id: int) -> int:
+    """Move an archived session back into ``chats``; returns the chats restored."""
+    with get_connection() as conn:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(RESTORE_SESSION_SQL, (session_id, session_id))
+                row = cur.fetchone()
+                return row[0] if row else 0
+
+@timed("db")
+def vacuum_chats(full: bool = False):
+    """VACUUM ANALYZE the hot tables, so space freed by archiving is reused;
+    ``full`` rewrites them to their live size (locks them while it runs)."""
+    options = "FULL, ANALYZE" if full else "ANALYZE"
+    with get_connection() as conn:
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f"VACUUM ({options}) chats")
+                cur.execute(f"VACUUM ({options}) chat_digests")
+        finally:
+            conn.autocommit = False
+
+@timed("db")
+def get_archive_stats() -> Dict[str, Any]:
+    """Rows and on-disk size (with indexes and TOAST) of the hot and cold tables."""
+    with get_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute("""
+                SELECT (SELECT COUNT(*) FROM chats) AS chats,
+                       pg_total_relation_size('chats') AS chats_bytes,
+                       pg_indexes_size('chats') AS chats_index_bytes,
+                       (SELECT COUNT(*) FROM chats_archive) AS archived_sessions,
+                       (SELECT COALESCE(SUM(turns), 0) FROM chats_archive) AS archived_chats,
+                       pg_total_relation_size('chats_archive') AS archive_bytes
+            """)
+            return cur.fetchone()
+
+@timed("db")
+def update_session_summary(session_id: int, summary: str, through_chat_id: int | None = None):
+    with get_connection() as conn:
+        with conn:
+            with conn.cursor() as cur:
+                if through_chat_id is None:
+                    cur.execute(
+                        "UPDATE chat_sessions SET history_summary=%s WHERE id=%s",
+                        (summary, session_id)
+                    )
+                else:
+                    # never move the summary backwards if a newer one already landed
+                    cur.execute(
+                        "UPDATE chat_sessions SET history_summary=%s, summary_chat_id=%s WHERE id=%s AND summary_chat_id < %s",
+                        (summary, through_chat_id, session_id, through_chat_id)
+                    )
 
+@timed("db")
 def get_session_summary(session_id: int) -> str:
-    conn = get_connection()
-    try:
+    with get_connection() as conn:
         with conn.cursor() as cur:
             cur.execute("SELECT history_summary FROM chat_sessions WHERE id=%s", (session_id,))
             row = cur.fetchone()
             return row[0] if row else ""
-    finally:
-        conn.close()
+
+@timed("db")
+def get_memory(session_id: int, max_digests: int, max_facts: int) -> Dict[str, Any] | None:
+    with get_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(f"SELECT {MEMORY_SQL} FROM chat_sessions cs WHERE cs.id=%s", (max_digests, max_facts, session_id))
+            row = cur.fetchone()
+            return row["memory"] if row else None
+
+SESSION_FACTS_SQL = """
+SELECT kind, fact_key AS key, value, mentions, first_seen, last_seen
+  FROM session_facts
+ WHERE session_id = %s
+ ORDER BY first_seen ASC, kind, fact_key
+"""
+
+@timed("db")
+def get_session_facts(session_id: int) -> List[Dict[str, Any]]:
+    """Every fact of a session, oldest first."""
+    with get_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(SESSION_FACTS_SQL, (session_id,))
+            return cur.fetchall()
+
+@timed("db")
+def get_memory_state(session_id: int) -> Dict[str, Any] | None:
+    """Summary position, last digested chat and the number of digests not yet compacted."""
+    with get_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute("""
+                SELECT cs.history_summary, cs.summary_chat_id,
+                       GREATEST(cs.summary_chat_id,
+                                COALESCE((SELECT MAX(chat_id) FROM chat_digests WHERE session_id = cs.id), 0)) AS digest_chat_id,
+                       (SELECT COUNT(*) FROM chat_digests
+                         WHERE session_id = cs.id AND chat_id > cs.summary_chat_id) AS digests
+                  FROM chat_sessions cs
+                 WHERE cs.id = %s
+            """, (session_id,))
+            return cur.fetchone()
+
+@timed("db")
+def add_digests(session_id: int, digests: List[tuple]):
+    """Append ``(chat_id, digest)`` rows; chats digested already are skipped."""
+    with get_connection() as conn:
+        with conn:
+            with conn.cursor() as cur:
+                execute_values(
+                    cur,
+                    "INSERT INTO chat_digests (chat_id, session_id, digest) VALUES %s ON CONFLICT (chat_id) DO NOTHING",
+                    [(chat_id, session_id, digest) for chat_id, digest in digests],
+                )
+
+@timed("db")
+def get_digests(session_id: int, after_chat_id: int, limit: int) -> List[Dict[str, Any]]:
+    """Oldest first."""
+    with get_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(
+                "SELECT chat_id, digest FROM chat_digests WHERE session_id=%s AND chat_id > %s ORDER BY chat_id ASC LIMIT %s",
+                (session_id, after_chat_id, limit),
+            )
+            return cur.fetchall()
+
+@timed("db")
+def get_chats_after(session_id: int, chat_id: int, limit: int | None = None) -> List[Dict[str, Any]]:
+    with get_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(
+                "SELECT id, user_message, ai_response FROM chats WHERE session_id=%s AND id > %s ORDER BY id ASC LIMIT %s",
+                (session_id, chat_id, limit),
+            )
+            return cur.fetchall()
+
+@timed("db")
+def get_cached_answer(key: str) -> Dict[str, Any] | None:
+    with get_connection() as conn:
+        with conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute(
+                    """
+                    UPDATE answer_cache SET hits = hits + 1, last_hit_at = CURRENT_TIMESTAMP
+                     WHERE key = %s AND expires_at > CURRENT_TIMESTAMP
+                    RETURNING response, prompt_tokens, completion_tokens
+                    """,
+                    (key,),
+                )
+                return cur.fetchone()
+
+@timed("db")
+def put_cached_answer(key: str, intent: str, model: str, prompt_version: str, response: str,
+                      prompt_tokens: int | None, completion_tokens: int | None, ttl_seconds: int):
+    with get_connection() as conn:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    INSERT INTO answer_cache (key, intent, model, prompt_version, response,
+                                              prompt_tokens, completion_tokens, expires_at)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP + make_interval(secs => %s))
+                    ON CONFLICT (key) DO UPDATE
+                       SET response = EXCLUDED.response,
+                           prompt_tokens = EXCLUDED.prompt_tokens,
+                           completion_tokens = EXCLUDED.completion_tokens,
+                           created_at = CURRENT_TIMESTAMP,
+                           expires_at = EXCLUDED.expires_at
+                    """,
+                    (key, intent, model, prompt_version, response, prompt_tokens, completion_tokens, ttl_seconds),
+                )
+
+@timed("db")
+def evict_answer_cache(max_rows: int) -> int:
+    """Drop expired entries, then the least recently hit ones beyond ``max_rows``."""
+    with get_connection() as conn:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM answer_cache WHERE expires_at <= CURRENT_TIMESTAMP")
+                deleted = cur.rowcount
+                cur.execute(
+                    """
+                    DELETE FROM answer_cache
+                     WHERE key IN (SELECT key FROM answer_cache
+                                    ORDER BY last_hit_at DESC OFFSET %s)
+                    """,
+                    (max_rows,),
+                )
+                return deleted + cur.rowcount
+
+# server-side login sessions (server/session_store.py, SESSION_STORE=postgres)
+@timed("db")
+def get_auth_session(sid: str) -> Dict[str, Any] | None:
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT data FROM auth_sessions WHERE sid=%s AND expires_at > CURRENT_TIMESTAMP", (sid,))
+            row = cur.fetchone()
+            return row[0] if row else None
+
+@timed("db")
+def put_auth_session(sid: str, data: Dict[str, Any], ttl_seconds: int):
+    with get_connection() as conn:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    INSERT INTO auth_sessions (sid, data, expires_at)
+                    VALUES (%s, %s, CURRENT_TIMESTAMP + make_interval(secs => %s))
+                    ON CONFLICT (sid) DO UPDATE SET data = EXCLUDED.data, expires_at = EXCLUDED.expires_at
+                    """,
+                    (sid, Json(data), ttl_seconds),
+                )
+
+@timed("db")
+def delete_auth_session(sid: str):
+    with get_connection() as conn:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM auth_sessions WHERE sid=%s", (sid,))
+
+@timed("db")
+def purge_auth_sessions() -> int:
+    with get_connection() as conn:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM auth_sessions WHERE expires_at <= CURRENT_TIMESTAMP")
+                return cur.rowcount
@@ -0,0 +1,175 @@
+from typing import List, Tuple
+
+# Ordered, append-only list of (version, name, sql). Each migration runs once,
+# in its own transaction, and is recorded in schema_migrations.
+MIGRATIONS: List[Tuple[int, str, str]] = [
+    (1, "session_activity_columns", """
+    ALTER TABLE chat_sessions ADD COLUMN IF NOT EXISTS last_activity TIMESTAMP;
+    ALTER TABLE chat_sessions ADD COLUMN IF NOT EXISTS first_user_message TEXT;
+
+    UPDATE chat_sessions cs
+       SET last_activity = COALESCE(
+             (SELECT MAX(c.created_at) FROM chats c WHERE c.session_id = cs.id),
+             cs.started_at),
+           first_user_message = (
+             SELECT c.user_message
+               FROM chats c
+              WHERE c.session_id = cs.id
+                AND c.user_message IS NOT NULL
+              ORDER BY c.created_at ASC, c.id ASC
+              LIMIT 1);
+
+    ALTER TABLE chat_sessions ALTER COLUMN last_activity SET DEFAULT CURRENT_TIMESTAMP;
+    ALTER TABLE chat_sessions ALTER COLUMN last_activity SET NOT NULL;
+
+    CREATE INDEX IF NOT EXISTS idx_chat_sessions_user_activity
+        ON chat_sessions (user_id, last_activity DESC, id DESC);
+    """),
+    (2, "answer_cache", """
+    CREATE TABLE IF NOT EXISTS answer_cache (
+        key TEXT PRIMARY KEY,
+        intent TEXT NOT NULL,
+        model TEXT NOT NULL,
+        prompt_version TEXT NOT NULL,
+        response TEXT NOT NULL,
+        prompt_tokens INTEGER,
+        completion_tokens INTEGER,
+        hits BIGINT NOT NULL DEFAULT 0,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        last_hit_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        expires_at TIMESTAMP NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_answer_cache_expires ON answer_cache (expires_at);
+    CREATE INDEX IF NOT EXISTS idx_answer_cache_last_hit ON answer_cache (last_hit_at);
+    """),
+    (3, "auth_sessions", """
+    CREATE TABLE IF NOT EXISTS auth_sessions (
+        sid TEXT PRIMARY KEY,
+        data JSONB NOT NULL,
+        expires_at TIMESTAMP NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_auth_sessions_expires ON auth_sessions (expires_at);
+    """),
+    (4, "chat_digests", """
+    -- one line per turn; digests up to chat_sessions.summary_chat_id are folded into history_summary
+    CREATE TABLE IF NOT EXISTS chat_digests (
+        chat_id INTEGER PRIMARY KEY REFERENCES chats(id) ON DELETE CASCADE,
+        session_id INTEGER NOT NULL REFERENCES chat_sessions(id) ON DELETE CASCADE,
+        digest TEXT NOT NULL,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS idx_chat_digests_session ON chat_digests (session_id, chat_id DESC);
+    """),
+    (5, "session_facts", """
+    -- kind: name | code | disease; fact_key is 'name', the code without dot or the normalized disease
+    CREATE TABLE IF NOT EXISTS session_facts (
+        session_id INTEGER NOT NULL REFERENCES chat_sessions(id) ON DELETE CASCADE,
+        kind VARCHAR(20) NOT NULL,
+        fact_key TEXT NOT NULL,
+        value TEXT NOT NULL,
+        chat_id INTEGER REFERENCES chats(id) ON DELETE SET NULL,
+        mentions INTEGER NOT NULL DEFAULT 1,
+        first_seen TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        last_seen TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (session_id, kind, fact_key)
+    );
+    CREATE INDEX IF NOT EXISTS idx_session_facts_last_seen ON session_facts (session_id, last_seen DESC);
+    """),
+    (6, "feedback_daily", """
+    -- codes (without dot) found in the turn, for the feedback rollup
+    ALTER TABLE chats ADD COLUMN IF NOT EXISTS codes TEXT[];
+
+    -- likes / dislikes per day the answer was given and per code; '' counts answers without a code
+    CREATE TABLE IF NOT EXISTS feedback_daily (
+        day DATE NOT NULL,
+        code TEXT NOT NULL,
+        likes INTEGER NOT NULL DEFAULT 0,
+        dislikes INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, code)
+    );
+
+    -- earlier chats have no codes recorded
+    INSERT INTO feedback_daily (day, code, likes, dislikes)
+    SELECT created_at::date, '', COUNT(*) FILTER (WHERE feedback = 'liked'), COUNT(*) FILTER (WHERE feedback = 'disliked')
+      FROM chats
+     WHERE feedback IS NOT NULL
+     GROUP BY 1
+    ON CONFLICT (day, code) DO NOTHING;
+    """),
+    (7, "chats_archive", """
+    -- set while the session's chats are in chats_archive (server/archive.py)
+    ALTER TABLE chat_sessions ADD COLUMN IF NOT EXISTS archived_at TIMESTAMP;
+
+    -- cold storage: one row per archived session, its chats and digests as JSON arrays
+    CREATE TABLE IF NOT EXISTS chats_archive (
+        session_id INTEGER PRIMARY KEY REFERENCES chat_sessions(id) ON DELETE CASCADE,
+        turns INTEGER NOT NULL,
+        first_chat_at TIMESTAMP,
+        last_chat_at TIMESTAMP,
+        chats JSONB NOT NULL,
+        digests JSONB NOT NULL DEFAULT '[]',
+        archived_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+    -- compress (TOAST) rows from 256 bytes on instead of 2 kB, with lz4 where the server has it
+    ALTER TABLE chats_archive SET (toast_tuple_target = 256);
+    DO $$
+    BEGIN
+        ALTER TABLE chats_archive ALTER COLUMN chats SET COMPRESSION lz4;
+        ALTER TABLE chats_archive ALTER COLUMN digests SET COMPRESSION lz4;
+    EXCEPTION WHEN feature_not_supported THEN
+        NULL;
+    END $$;
+
+    -- sessions the archival job looks at, least recently active first
+    CREATE INDEX IF NOT EXISTS idx_chat_sessions_idle ON chat_sessions (last_activity) WHERE archived_at IS NULL;
+    """),
+    # 8 and 9 used to run inline in create_tables; on databases that had them they change nothing
+    (8, "summary_chat_id", """
+    -- id of the last chat folded into history_summary
+    ALTER TABLE chat_sessions ADD COLUMN IF NOT EXISTS summary_chat_id INTEGER NOT NULL DEFAULT 0;
+    """),
+    (9, "chats_session_created_index", """
+    -- newest-first history window (get_recent_history)
+    CREATE INDEX IF NOT EXISTS idx_chats_session_created ON chats (session_id, created_at DESC, id DESC);
+    """),
+]
+
+# arbitrary constant; serializes migrations across workers starting at once
+_LOCK_KEY = 4_212_001
+
+
+def pending_migrations(conn) -> List[int]:
+    """Versions not applied yet on ``conn``'s database (all of them on an empty one)."""
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT to_regclass('schema_migrations') IS NOT NULL")
+            if not cur.fetchone()[0]:
+                return [version for version, _, _ in MIGRATIONS]
+            cur.execute("SELECT version FROM schema_migrations")
+            applied = {row[0] for row in cur.fetchall()}
+    return [version for version, _, _ in MIGRATIONS if version not in applied]
+
+
+def apply_migrations(conn) -> List[int]:
+    """Apply pending migrations on ``conn``; returns the versions applied."""
+    applied = []
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            """)
+    for version, name, sql in MIGRATIONS:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_xact_lock(%s)", (_LOCK_KEY,))
+                cur.execute("SELECT 1 FROM schema_migrations WHERE version=%s", (version,))
+                if cur.fetchone():
+                    continue
+                cur.execute(sql)
+                cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+                applied.append(version)
+    return applied
@@ -0,0 +1,190 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+from server.db import querycount
+from server import metrics
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """Thread-safe psycopg2 connection pool with health checks.
+
+    Up to ``maxconn`` connections are open at once; callers beyond that wait
+    up to ``timeout`` seconds for one to be returned. Idle connections are
+    kept for reuse (psycopg2's own pools close everything above ``minconn``),
+    pinged before checkout once they have been idle for ``check_idle``
+    seconds, and discarded and reopened when they turn out to be dead.
+    """
+
+    def __init__(self, minconn: int, maxconn: int, timeout: float, check_idle: float, **dsn):
+        self._dsn = dsn
+        self._minconn = minconn
+        self._maxconn = maxconn
+        self._timeout = timeout
+        self._check_idle = check_idle
+        self._cond = threading.Condition()
+        self._idle: list[tuple[object, float]] = []  # (conn, returned_at), most recent last
+        self._size = 0
+        self._waiting = 0
+
+    def _connect(self):
+        return psycopg2.connect(**self._dsn)
+
+    def _is_healthy(self, conn, idle_since: float) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self._check_idle:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self):
+        deadline = time.monotonic() + self._timeout
+        while True:
+            with self._cond:
+                if not self._idle and self._size >= self._maxconn:
+                    self._wait(deadline)
+                if self._idle:
+                    conn, idle_since = self._idle.pop()
+                else:
+                    conn, idle_since = None, 0.0
+                self._size += 1 if conn is None else 0
+            # connect and ping outside the lock so other callers aren't stalled
+            if conn is None:
+                try:
+                    return self._connect()
+                except Exception:
+                    self._release_slot()
+                    raise
+            if self._is_healthy(conn, idle_since):
+                return conn
+            # dead connection (e.g. server restart): drop it and try the next one
+            self._discard(conn)
+            self._release_slot()
+
+    def _wait(self, deadline: float):
+        # called with the lock held, until a connection is idle or a slot is free
+        t0 = time.monotonic()
+        self._waiting += 1
+        try:
+            while not self._idle and self._size >= self._maxconn:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout(f"no database connection available within {self._timeout}s")
+                self._cond.wait(remaining)
+        finally:
+            self._waiting -= 1
+            metrics.observe("db.pool_wait", time.monotonic() - t0)
+
+    def _release_slot(self):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def putconn(self, conn):
+        if not conn.closed and conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                self._discard(conn)
+        if conn.closed:
+            self._release_slot()
+            return
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def warm(self):
+        """Open ``minconn`` connections up front."""
+        conns = [self.getconn() for _ in range(max(self._minconn - len(self._idle), 0))]
+        for conn in conns:
+            self.putconn(conn)
+
+    def closeall(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def stats(self) -> dict:
+        with self._cond:
+            idle = len(self._idle)
+            return {
+                "size": self._size, "idle": idle, "in_use": self._size - idle,
+                "waiting": self._waiting, "max": self._maxconn,
+            }
+
+
+def db_settings() -> dict:
+    """Connection keywords from the DB_* settings (libpq names, so psycopg 3 accepts them too)."""
+    return {
+        "host": os.getenv("DB_HOST", "localhost"),
+        "port": os.getenv("DB_PORT", "5432"),
+        "dbname": os.getenv("DB_NAME", "icd_chatbot"),
+        "user": os.getenv("DB_USER", "postgres"),
+        "password": os.getenv("DB_PASSWORD", "postgres"),
+    }
+
+
+def pool_settings() -> dict:
+    return {
+        "minconn": int(os.getenv("DB_POOL_MIN", "1")),
+        "maxconn": int(os.getenv("DB_POOL_MAX", "10")),
+        # seconds a caller waits for a free connection before giving up
+        "timeout": float(os.getenv("DB_POOL_TIMEOUT", "10")),
+        # connections idle for longer than this are pinged before reuse
+        "check_idle": float(os.getenv("DB_POOL_CHECK_IDLE", "30")),
+    }
+
+
+_pool: ConnectionPool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    # built on first use so settings loaded from .env after import still apply
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                dsn = db_settings()
+                if querycount.DB_COUNT_QUERIES:
+                    dsn["connection_factory"] = querycount.CountingConnection
+                _pool = ConnectionPool(**pool_settings(), **dsn)
+    return _pool
+
+
+def close_pool():
+    """Close the pool's connections, if it was ever built."""
+    if _pool is not None:
+        _pool.closeall()
+
+
+@contextmanager
+def pooled_connection():
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        yield conn
+    finally:
+        pool.putconn(conn)
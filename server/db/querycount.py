@@ -0,0 +1,54 @@
+"""Per-request SQL statement counts, for spotting N+1 queries under load.
+
+With ``DB_COUNT_QUERIES=1`` every statement run on a pooled connection is
+counted against the request that issued it, and both backends report the
+total in an ``X-DB-Queries`` response header. Queries made by background
+workers are not counted. Streamed responses report the statements made
+before the stream started.
+"""
+import os
+from contextvars import ContextVar
+
+import psycopg2.extensions
+
+DB_COUNT_QUERIES = os.getenv("DB_COUNT_QUERIES", "0") == "1"
+
+# a list, so tasks spawned by the request (asyncio.gather, to_thread) add to the same count
+_queries: ContextVar[list | None] = ContextVar("db_queries", default=None)
+
+
+def begin():
+    _queries.set([0])
+
+
+def count() -> int | None:
+    queries = _queries.get()
+    return queries[0] if queries is not None else None
+
+
+def record():
+    queries = _queries.get()
+    if queries is not None:
+        queries[0] += 1
+
+
+_counting_cursors: dict = {}
+
+
+def _counting(base: type) -> type:
+    cls = _counting_cursors.get(base)
+    if cls is None:
+        def execute(self, query, vars=None):
+            record()
+            return base.execute(self, query, vars)
+
+        cls = _counting_cursors[base] = type(f"Counting{base.__name__}", (base,), {"execute": execute})
+    return cls
+
+
+class CountingConnection(psycopg2.extensions.connection):
+    """psycopg2 connection whose cursors, whatever their factory, count executes."""
+
+    def cursor(self, *args, cursor_factory=None, **kwargs):
+        base = cursor_factory or self.cursor_factory or psycopg2.extensions.cursor
+        return super().cursor(*args, cursor_factory=_counting(base), **kwargs)
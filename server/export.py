@@ -0,0 +1,194 @@
+"""Export a user's chat history as NDJSON or Parquet.
+
+    python -m server.export alice -o alice.ndjson
+    python -m server.export alice --format parquet -o alice.parquet
+
+One record per chat, archived ones included: sessions newest first, each
+session's chats oldest first (``EXPORT_SQL``). Rows are read from a
+server-side cursor ``EXPORT_BATCH_SIZE`` at a time and written out per batch
+(a Parquet row group each), so memory stays flat however long the history is.
+``GET /export?format=ndjson|parquet`` streams the same bytes.
+"""
+import argparse
+import io
+import json
+import os
+import sys
+from typing import Any, AsyncIterable, AsyncIterator, Dict, Iterable, Iterator, List
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+# format -> (content type, file extension)
+EXPORT_FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+# fields of a record, in order
+FIELDS = (
+    "session_id", "session_name", "session_started_at", "session_last_activity", "archived",
+    "chat_id", "created_at", "user_message", "ai_response", "feedback", "codes",
+)
+
+
+def export_filename(user_id: int, fmt: str) -> str:
+    return f"icd-chat-history-{user_id}.{EXPORT_FORMATS[fmt][1]}"
+
+
+def _isoformat(value: Any) -> str:
+    return value.isoformat() if hasattr(value, "isoformat") else str(value)
+
+
+class NdjsonEncoder:
+    """Rows in, one JSON line per row out, handed back ``batch_size`` rows at a time."""
+
+    def __init__(self, batch_size: int = EXPORT_BATCH_SIZE):
+        self._batch_size = batch_size
+        self._lines: List[str] = []
+
+    def add(self, row: Dict[str, Any]) -> bytes:
+        self._lines.append(json.dumps({k: row[k] for k in FIELDS}, default=_isoformat, ensure_ascii=False))
+        if len(self._lines) < self._batch_size:
+            return b""
+        return self._take()
+
+    def close(self) -> bytes:
+        return self._take() if self._lines else b""
+
+    def _take(self) -> bytes:
+        out = ("\n".join(self._lines) + "\n").encode()
+        self._lines = []
+        return out
+
+
+class _Chunks(io.RawIOBase):
+    """Write-only file that hands back what was written since the last ``take``."""
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._parts.append(bytes(b))
+        return len(b)
+
+    def take(self) -> bytes:
+        out, self._parts = b"".join(self._parts), []
+        return out
+
+
+class ParquetEncoder:
+    """Rows in, Parquet bytes out: one row group per ``batch_size`` rows, the
+    footer on ``close``."""
+
+    def __init__(self, batch_size: int = EXPORT_BATCH_SIZE):
+        # imported here: pyarrow is large and only exports need it
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self._pa = pa
+        self._schema = pa.schema([
+            ("session_id", pa.int32()),
+            ("session_name", pa.string()),
+            ("session_started_at", pa.timestamp("us")),
+            ("session_last_activity", pa.timestamp("us")),
+            ("archived", pa.bool_()),
+            ("chat_id", pa.int32()),
+            ("created_at", pa.timestamp("us")),
+            ("user_message", pa.string()),
+            ("ai_response", pa.string()),
+            ("feedback", pa.string()),
+            ("codes", pa.list_(pa.string())),
+        ])
+        self._batch_size = batch_size
+        self._rows: List[Dict[str, Any]] = []
+        self._sink = _Chunks()
+        self._writer = pq.ParquetWriter(self._sink, self._schema, compression="zstd")
+
+    def add(self, row: Dict[str, Any]) -> bytes:
+        self._rows.append({k: row[k] for k in FIELDS})
+        if len(self._rows) < self._batch_size:
+            return b""
+        self._write()
+        return self._sink.take()
+
+    def close(self) -> bytes:
+        if self._rows:
+            self._write()
+        self._writer.close()
+        return self._sink.take()
+
+    def _write(self):
+        self._writer.write_batch(self._pa.RecordBatch.from_pylist(self._rows, schema=self._schema))
+        self._rows = []
+
+
+def encoder(fmt: str, batch_size: int = EXPORT_BATCH_SIZE):
+    return ParquetEncoder(batch_size) if fmt == "parquet" else NdjsonEncoder(batch_size)
+
+
+def export_chunks(rows: Iterable[Dict[str, Any]], fmt: str, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[bytes]:
+    """The encoded export of ``rows`` (``db.iter_user_export``), a batch at a time."""
+    enc = encoder(fmt, batch_size)
+    for row in rows:
+        chunk = enc.add(row)
+        if chunk:
+            yield chunk
+    chunk = enc.close()
+    if chunk:
+        yield chunk
+
+
+async def aexport_chunks(rows: AsyncIterable[Dict[str, Any]], fmt: str,
+                         batch_size: int = EXPORT_BATCH_SIZE) -> AsyncIterator[bytes]:
+    """``export_chunks`` for ``async_db.iter_user_export``."""
+    enc = encoder(fmt, batch_size)
+    async for row in rows:
+        chunk = enc.add(row)
+        if chunk:
+            yield chunk
+    chunk = enc.close()
+    if chunk:
+        yield chunk
+
+
+def main():
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+    import server.db.db as dbx
+    from server.db.pool import close_pool
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("username")
+    parser.add_argument("--format", choices=sorted(EXPORT_FORMATS), help="default: from the -o extension, else ndjson")
+    parser.add_argument("-o", "--output", help="file to write (default: stdout)")
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE)
+    args = parser.parse_args()
+    fmt = args.format or ("parquet" if (args.output or "").endswith(".parquet") else "ndjson")
+
+    try:
+        user = dbx.get_user_by_username(args.username)
+        if user is None:
+            sys.exit(f"No user {args.username!r}")
+        out = open(args.output, "wb") if args.output else sys.stdout.buffer
+        try:
+            rows = dbx.iter_user_export(user["id"], args.batch_size)
+            size = 0
+            for chunk in export_chunks(rows, fmt, args.batch_size):
+                out.write(chunk)
+                size += len(chunk)
+        finally:
+            if args.output:
+                out.close()
+    finally:
+        close_pool()
+    if args.output:
+        print(f"Wrote {size} bytes to {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Facts remembered per chat session: the user's name and the codes and
+diseases discussed (``session_facts``).
+
+Facts are pulled out of each turn with regular expressions and the ICD code
+table, not with a model call, and stored in the same statement as the turn.
+The prompt carries them as a short block (``facts_text``), and recall
+questions like "what is my name?" or "summarize what I searched" are answered
+straight from the table (``recall_kind`` / ``recall_answer``).
+"""
+import os
+import re
+from typing import Any, Dict, List
+
+from server.answer_cache import disease_phrase
+from server.icd import CODE_RE, get_code_index, normalize_code, format_code
+from server.tokens import estimate_tokens
+
+# facts loaded with the session memory for the prompt: the name and the most recently mentioned
+SESSION_FACTS_MAX = 40
+FACTS_MAX_TOKENS = int(os.getenv("FACTS_MAX_TOKENS", "300"))
+# codes taken from one answer; listings (children of J18, Z80-Z87) would add dozens
+MAX_ANSWER_CODES = 5
+
+# the name is matched case-sensitively after the phrase: "my name is John Smith and ..." -> "John Smith"
+_NAME_RE = re.compile(
+    r"\b(?i:my name is|my name's|call me|i am called|i'm called)\s+([A-Za-z][A-Za-z'\-]*(?:\s+[A-Z][A-Za-z'\-]*){0,2})"
+)
+_NOT_NAMES = {"not", "a", "an", "the", "what", "unknown", "secret", "none", "nothing"}
+
+_RECALL_NAME_RE = re.compile(r"\b(?:what(?:'s| is) my name|who am i|do you (?:know|remember) (?:my name|who i am))\b", re.IGNORECASE)
+_RECALL_HISTORY_RE = re.compile(
+    r"\b(?:(?:what|which) (?:icd )?(?:codes?|diseases?|conditions?|topics?|things?) (?:did|have) (?:we|i) "
+    r"(?:discuss|search|ask|look|talk)\w*"
+    r"|what (?:did|have) (?:we|i) (?:discuss|search|ask|look|talk)\w*(?: (?:about|up|for))?(?: so far| before| earlier)?\s*\??\s*$"
+    r"|summar\w* (?:what|everything|all) (?:i|we) (?:searched|asked|discussed|looked up)"
+    r"|summar\w* (?:my|our) (?:searches|questions|conversation|chat))",
+    re.IGNORECASE,
+)
+
+
+def fact(kind: str, key: str, value: str) -> Dict[str, str]:
+    return {"kind": kind, "key": key, "value": value}
+
+
+def stated_name(message: str) -> str | None:
+    m = _NAME_RE.search(message)
+    if not m:
+        return None
+    name = m.group(1).strip(" '-")
+    if name.lower() in _NOT_NAMES:
+        return None
+    return name if not name.islower() else name.title()
+
+
+def extract_facts(user_message: str, ai_response: str | None) -> List[Dict[str, str]]:
+    """Facts in one turn, without duplicates (``kind``, ``key``, ``value``)."""
+    out: Dict[tuple, Dict[str, str]] = {}
+    name = stated_name(user_message)
+    if name:
+        out["name", "name"] = fact("name", "name", name)
+
+    index = get_code_index()
+    if len(index):
+        entries = index.find_codes(user_message) + index.find_codes(ai_response or "")[:MAX_ANSWER_CODES]
+        for e in entries:
+            out.setdefault(("code", e.code), fact("code", e.code, e.title))
+    else:
+        # no code table: codes the user typed, unverified
+        for m in CODE_RE.finditer(user_message):
+            code = normalize_code(m.group(1))
+            out.setdefault(("code", code), fact("code", code, ""))
+
+    # "what is pneumonia?"; not questions about the user ("what is my name?")
+    disease = disease_phrase(user_message)
+    if disease:
+        out["disease", disease] = fact("disease", disease, disease)
+    return list(out.values())
+
+
+def _code_line(f: Dict[str, Any]) -> str:
+    return f"{format_code(f['key'])} {f['value']}".strip()
+
+
+def facts_text(facts: List[Dict[str, Any]], max_tokens: int = FACTS_MAX_TOKENS) -> str | None:
+    """The prompt block: name, codes and diseases, the oldest mentions dropped to fit ``max_tokens``."""
+    name = next((f["value"] for f in facts if f["kind"] == "name"), None)
+    codes = [_code_line(f) for f in facts if f["kind"] == "code"]
+    diseases = [f["value"] for f in facts if f["kind"] == "disease"]
+
+    def render() -> str:
+        lines = ["Facts from this conversation:"]
+        if name:
+            lines.append(f"- User's name: {name}")
+        if codes:
+            lines.append(f"- Codes discussed: {'; '.join(codes)}")
+        if diseases:
+            lines.append(f"- Diseases asked about: {'; '.join(diseases)}")
+        return "\n".join(lines)
+
+    if not (name or codes or diseases):
+        return None
+    text = render()
+    while estimate_tokens(text) > max_tokens and (codes or diseases):
+        (codes if len(codes) >= len(diseases) else diseases).pop(0)
+        text = render()
+    return text
+
+
+def recall_kind(message: str) -> str | None:
+    """``"name"`` or ``"history"`` for questions the fact table answers."""
+    if _RECALL_NAME_RE.search(message):
+        return "name"
+    if _RECALL_HISTORY_RE.search(message):
+        return "history"
+    return None
+
+
+def recall_answer(kind: str, facts: List[Dict[str, Any]]) -> str | None:
+    """Answer a recall question from every fact of the session (oldest first);
+    None when there is nothing to recall, so the model answers instead."""
+    if kind == "name":
+        name = next((f["value"] for f in facts if f["kind"] == "name"), None)
+        return f"Your name is {name}." if name else None
+
+    codes = [f for f in facts if f["kind"] == "code"]
+    diseases = [f for f in facts if f["kind"] == "disease"]
+    if not codes and not diseases:
+        return None
+    lines = ["Here's what we've covered in this conversation:"]
+    if codes:
+        lines += ["", "ICD codes:"]
+        lines += [f"- {_code_line(f)} (first asked {f['first_seen']:%Y-%m-%d %H:%M})" for f in codes]
+    if diseases:
+        lines += ["", "Diseases and conditions:"]
+        lines += [f"- {f['value']} (first asked {f['first_seen']:%Y-%m-%d %H:%M})" for f in diseases]
+    lines += ["", "👉 Ask about any of them again for the full explanation."]
+    return "\n".join(lines)
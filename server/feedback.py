@@ -0,0 +1,119 @@
+"""Write-behind feedback: 👍/👎 clicks are buffered per process and applied
+in bulk.
+
+``POST /feedback`` checks that the caller owns the chat's session, then only
+puts the click in ``FeedbackBuffer``; a background thread applies everything
+buffered with one ``dbx.apply_feedback`` statement once ``FEEDBACK_FLUSH_SIZE``
+clicks are waiting or every ``FEEDBACK_FLUSH_INTERVAL`` seconds. Repeated
+clicks on one chat before a flush are coalesced (the last one wins).
+
+Delivery is at least once: a batch leaves the buffer only after it was
+committed, a failed flush is retried with the next one, and ``shutdown``
+flushes what is left. Applying a batch twice changes nothing (see
+``APPLY_FEEDBACK_SQL``).
+"""
+import os
+import time
+import threading
+from typing import Callable, Dict, List, Tuple
+
+FEEDBACK_FLUSH_SIZE = int(os.getenv("FEEDBACK_FLUSH_SIZE", "200"))
+FEEDBACK_FLUSH_INTERVAL = float(os.getenv("FEEDBACK_FLUSH_INTERVAL", "2"))
+# clicks held while the database is unreachable; beyond this /feedback answers 503
+FEEDBACK_MAX_PENDING = int(os.getenv("FEEDBACK_MAX_PENDING", "10000"))
+# flush attempts at shutdown
+SHUTDOWN_RETRIES = 3
+
+
+class FeedbackBuffer:
+    def __init__(
+        self,
+        apply: Callable[[List[Tuple[int, int, str]]], None],
+        flush_size: int = FEEDBACK_FLUSH_SIZE,
+        interval: float = FEEDBACK_FLUSH_INTERVAL,
+        max_pending: int = FEEDBACK_MAX_PENDING,
+    ):
+        self._apply = apply
+        self._flush_size = flush_size
+        self._interval = interval
+        self._max_pending = max_pending
+        # chat_id -> (session_id, feedback)
+        self._pending: Dict[int, Tuple[int, str]] = {}
+        self._lock = threading.Lock()
+        # one flush at a time: the writer thread's and the one at shutdown
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="feedback-writer", daemon=True)
+        self._started = False
+        self.stats = {"received": 0, "applied": 0, "flushes": 0, "failures": 0}
+
+    def start(self):
+        if not self._started:
+            self._started = True
+            self._thread.start()
+
+    def add(self, chat_id: int, session_id: int, feedback: str) -> bool:
+        """Buffer a click; False when the buffer is full."""
+        with self._lock:
+            if chat_id not in self._pending and len(self._pending) >= self._max_pending:
+                return False
+            self._pending[chat_id] = (session_id, feedback)
+            self.stats["received"] += 1
+            full = len(self._pending) >= self._flush_size
+        if full:
+            self._wake.set()
+        return True
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self.stats, "pending": len(self._pending)}
+
+    def flush(self) -> int:
+        """Apply everything buffered; returns the number of clicks applied.
+        On error the batch goes back into the buffer and the error is raised."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+            try:
+                self._apply([(chat_id, session_id, fb) for chat_id, (session_id, fb) in batch.items()])
+            except Exception:
+                with self._lock:
+                    # clicks that arrived meanwhile are newer
+                    self._pending = {**batch, **self._pending}
+                    self.stats["failures"] += 1
+                raise
+            with self._lock:
+                self.stats["applied"] += len(batch)
+                self.stats["flushes"] += 1
+            return len(batch)
+
+    def shutdown(self):
+        """Stop the writer thread and flush what is left."""
+        if self._started:
+            self._stop.set()
+            self._wake.set()
+            self._thread.join()
+        for attempt in range(SHUTDOWN_RETRIES):
+            try:
+                self.flush()
+                return
+            except Exception as e:
+                print("Feedback flush error:", e)
+                time.sleep(attempt + 1)
+        print(f"Feedback lost at shutdown: {self.pending()} clicks")
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self._interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print("Feedback flush error:", e)
@@ -0,0 +1,216 @@
+"""The parts of the routes that don't depend on the web framework.
+
+server/backend.py (Flask) and server/asgi.py (Quart) serve the same API; each
+keeps only its own I/O, blocking or async, and calls these for request
+validation, the decisions of a chat turn and the response bodies. Nothing
+here touches Postgres or OpenAI.
+
+Both frameworks serialize a returned dict as JSON, so errors are
+``(body, status[, headers])`` tuples a route can return as they are.
+Validation raises ValueError with the message for a 400.
+"""
+import time
+from typing import Any, Dict, List, Tuple
+
+from server import metrics
+from server.db.db import chat_rows_to_messages
+from server.context import SYSTEM_PROMPT
+from server.prompt import build_messages
+from server.icd import code_context, format_code
+from server.facts import facts_text
+from server.retrieval import guideline_context
+from server.llm import LLMBusy, gateway
+from server.singleflight import prompt_key
+from server.summary import memory_text, EMPTY_MEMORY
+from server.serialize import session_to_json, sse
+from server.pagination import split_page
+
+CHAT_TEMPERATURE = 0.3
+FEEDBACK_VALUES = ("liked", "disliked")
+
+
+# errors
+def error(message: str, status: int = 400, headers: Dict[str, str] | None = None):
+    return ({"error": message}, status, headers) if headers else ({"error": message}, status)
+
+def retry_after(seconds: float) -> Dict[str, str]:
+    return {"Retry-After": str(int(seconds) + 1)}
+
+def password_busy():
+    return error("server busy, try again", 503, {"Retry-After": "1"})
+
+def too_many_attempts(seconds: float):
+    return error("too many failed attempts, try again later", 429, retry_after(seconds))
+
+def llm_busy(e: LLMBusy):
+    return {"error": str(e), "retry_after": round(e.retry_after, 1)}, 429, retry_after(e.retry_after)
+
+
+# request bodies
+def credentials(data: Dict[str, Any]) -> Tuple[str, str]:
+    return (data.get("username") or "").strip(), (data.get("password") or "").strip()
+
+def session_name(data: Dict[str, Any]) -> str:
+    return (data.get("name") or "New Chat").strip()
+
+def chat_request(data: Dict[str, Any]) -> Tuple[str, Any]:
+    """``(user_message, session_id)``; a falsy session id starts a new session."""
+    user_message = (data.get("message") or "").strip()
+    if not user_message:
+        raise ValueError("message is required")
+    return user_message, data.get("session_id")
+
+def feedback_request(data: Dict[str, Any]) -> Tuple[int, str]:
+    """``(chat_id, feedback)``."""
+    chat_id = data.get("chat_id")
+    feedback = (data.get("feedback") or "").strip().lower()
+    if feedback not in FEEDBACK_VALUES:
+        raise ValueError("feedback must be 'liked' or 'disliked'")
+    if not chat_id:
+        raise ValueError("chat_id required")
+    # JSON true / false are bools, which are ints in Python
+    if not isinstance(chat_id, int) or isinstance(chat_id, bool):
+        raise ValueError("chat_id must be an integer")
+    return chat_id, feedback
+
+def stats_days(value: str) -> int:
+    if not value.isdigit() or int(value) < 1:
+        raise ValueError("days must be a positive integer")
+    return int(value)
+
+
+# response bodies
+def session_list(rows: List[Dict[str, Any]], limit: int):
+    """A page of sessions, fetched with ``limit + 1``; returns ``(sessions, next_cursor)``."""
+    rows, next_cursor = split_page(rows, limit, "last_activity")
+    return [session_to_json(r) for r in rows], next_cursor
+
+def message_list(rows: List[Dict[str, Any]], limit: int):
+    """A page of chats, fetched newest first with ``limit + 1``; returns
+    ``(messages, next_cursor)``, the messages oldest first as they are displayed."""
+    rows, next_cursor = split_page(rows, limit, "created_at")
+    return chat_rows_to_messages(reversed(rows)), next_cursor
+
+def login_body(user: Dict[str, Any], sessions, sessions_cursor, latest_messages, messages_cursor) -> Dict[str, Any]:
+    return {
+        "message": "ok",
+        "user_id": user["id"],
+        "username": user["username"],
+        "sessions": sessions,
+        "sessions_next_cursor": sessions_cursor,
+        "latest_session_id": sessions[0]["id"] if sessions else None,
+        "latest_messages": latest_messages,
+        "latest_messages_next_cursor": messages_cursor
+    }
+
+def feedback_stats_body(rows: List[Dict[str, Any]], buffer: Dict[str, int]) -> Dict[str, Any]:
+    return {
+        "days": [{**r, "day": r["day"].isoformat(), "code": format_code(r["code"])} for r in rows],
+        "buffer": buffer,
+    }
+
+def cache_stats_body(answer_cache, flights, user_context) -> Dict[str, Any]:
+    return {
+        **answer_cache.snapshot(), "coalescing": flights.snapshot(), "user_context": user_context.snapshot(),
+        "llm": gateway.snapshot(),
+    }
+
+
+# chat turns
+def answered(session_id, user_message: str, answer: str, source: str) -> Dict[str, Any]:
+    """A turn answered without the model (``source``: code_index, facts or cache)."""
+    return {"session_id": session_id, "user_message": user_message, "direct_answer": answer, "source": source}
+
+def build_turn(session_id, user_message: str, context: Dict[str, Any], cache_key: str | None) -> Dict[str, Any]:
+    """A turn for the model, from the session's memory and newest turns
+    (``{"memory", "recent"}``): the messages within the token budget and
+    the answer cache key, if the answer may be stored for everyone."""
+    summary = memory_text(context["memory"], context["recent"])
+    facts = facts_text(context["memory"]["facts"])
+    with metrics.span("prompt.build"):
+        messages, context_tokens = build_messages(
+            SYSTEM_PROMPT, summary, context["recent"], user_message,
+            context_blocks={
+                "facts": facts,
+                "codes": code_context(user_message),
+                "guidelines": guideline_context(user_message),
+            },
+        )
+    return {
+        "session_id": session_id,
+        "user_message": user_message,
+        "messages": messages,
+        "context_tokens": context_tokens,
+        # an answer shaped by earlier turns, memory or facts isn't stored for everyone
+        "cache_key": None if context["recent"] or summary or facts else cache_key,
+    }
+
+def completion(model: str, turn: Dict[str, Any], stream: bool = False) -> Tuple[str, Dict[str, Any]]:
+    """``(flight_key, kwargs)`` of the turn's ``chat.completions.create`` call."""
+    kwargs = {"model": model, "messages": turn["messages"], "temperature": CHAT_TEMPERATURE}
+    key = prompt_key(model, turn["messages"], temperature=CHAT_TEMPERATURE)
+    if stream:
+        kwargs.update(stream=True, stream_options={"include_usage": True})
+    return key, kwargs
+
+def cacheable(turn: Dict[str, Any], answer: str | None, shared: bool) -> bool:
+    """Store the answer? Only the caller that made the upstream call does."""
+    return bool(turn.get("cache_key") and answer and not shared)
+
+def chat_body(turn: Dict[str, Any], answer: str, chat_id: int, session_id: int) -> Dict[str, Any]:
+    body = {"response": answer, "chat_id": chat_id, "session_id": session_id, "source": turn.get("source", "model")}
+    if "context_tokens" in turn:
+        body["context_tokens"] = turn["context_tokens"]
+    return body
+
+def turn_recorded(user_context, summary_worker, user_id: int, session_id, new_id: int, facts):
+    """Update the caches after a turn of ``session_id`` was stored as part of
+    ``new_id`` (a new session when they differ), and queue its digest."""
+    if new_id != session_id:
+        user_context.add_session(user_id, new_id, memory={**EMPTY_MEMORY, "facts": facts})
+    elif facts:
+        user_context.drop_memory(new_id)
+    # Digest the turn into the session memory (background, coalesced per session)
+    summary_worker.submit(new_id)
+
+
+# /chat/stream events
+def meta_event(turn: Dict[str, Any], session_id: int) -> str:
+    meta = {"session_id": session_id, "source": turn.get("source", "model")}
+    if "context_tokens" in turn:
+        meta["context_tokens"] = turn["context_tokens"]
+    return sse(meta, event="meta")
+
+def done_event(chat_id: int, session_id: int) -> str:
+    return sse({"chat_id": chat_id, "session_id": session_id}, event="done")
+
+def error_event(e: Exception) -> str:
+    if isinstance(e, LLMBusy):
+        return sse({"error": str(e), "retry_after": round(e.retry_after, 1)}, event="error")
+    return sse({"error": str(e)}, event="error")
+
+
+class StreamedAnswer:
+    """Collects a streamed completion: ``feed`` it every chunk and send on
+    the text it returns. Records the time to the first token."""
+
+    def __init__(self):
+        self.parts: List[str] = []
+        self.usage = None
+        self._started = time.perf_counter()
+
+    def feed(self, chunk) -> str | None:
+        if chunk.usage:
+            self.usage = chunk.usage
+        if not chunk.choices:
+            return None
+        delta = chunk.choices[0].delta.content
+        if delta:
+            if not self.parts:
+                metrics.observe("openai.first_token", time.perf_counter() - self._started)
+            self.parts.append(delta)
+        return delta
+
+    @property
+    def answer(self) -> str:
+        return "".join(self.parts)
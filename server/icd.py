@@ -0,0 +1,281 @@
+import bisect
+import os
+from array import array
+import re
+import threading
+from typing import Dict, Iterable, List, NamedTuple, Tuple
+
+# CMS ICD-10-CM code table. Either the "order" file (icd10cm_order_YYYY.txt,
+# includes category headers) or the flat codes file (icd10cm_codes_YYYY.txt);
+# "CODE<TAB>TITLE" lines work as well. Download from
+# https://www.cms.gov/medicare/coding-billing/icd-10-codes
+ICD_CODES_PATH = os.getenv(
+    "ICD_CODES_PATH", os.path.join(os.path.dirname(__file__), "data", "icd10cm_order.txt")
+)
+# cap on codes listed in a direct (non-LLM) answer
+MAX_LISTED_CODES = 50
+
+# ICD-10-CM code: letter, digit, digit/letter, optional dot, up to four more characters
+_CODE = r"[A-Z][0-9][0-9A-Z](?:\.?[0-9A-Z]{1,4})?"
+CODE_RE = re.compile(rf"\b({_CODE})\b", re.IGNORECASE)
+RANGE_RE = re.compile(rf"\b({_CODE})\s*[-–]\s*({_CODE})\b", re.IGNORECASE)
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+# lookups answered straight from the index
+_TITLE_RE = re.compile(
+    rf"^\s*(?:what(?:'s| is) the )?(?:title|name|description) (?:of|for) (?:icd(?:-?10)?(?:-cm)? )?(?:code )?({_CODE})\s*\??\s*$"
+    rf"|^\s*({_CODE}) (?:title|name)\s*\??\s*$",
+    re.IGNORECASE,
+)
+_CHILDREN_RE = re.compile(
+    rf"^\s*(?:list |show )?(?:the )?(?:children|subcodes|sub-codes|subcategories) (?:of|for|under) (?:code )?({_CODE})\s*\??\s*$",
+    re.IGNORECASE,
+)
+_PARENT_RE = re.compile(
+    rf"^\s*(?:what is the )?(?:parent|category|hierarchy) (?:of|for) (?:code )?({_CODE})\s*\??\s*$",
+    re.IGNORECASE,
+)
+_RANGE_ONLY_RE = re.compile(
+    rf"^\s*(?:list |show )?(?:the )?(?:codes? |categories )?(?:in |from )?({_CODE})\s*[-–]\s*({_CODE})\s*\??\s*$",
+    re.IGNORECASE,
+)
+
+
+class CodeEntry(NamedTuple):
+    code: str  # normalized, no dot: "J189"
+    title: str
+
+    @property
+    def display(self) -> str:
+        return format_code(self.code)
+
+
+def normalize_code(code: str) -> str:
+    return code.replace(".", "").strip().upper()
+
+
+def format_code(code: str) -> str:
+    return code if len(code) <= 3 else f"{code[:3]}.{code[3:]}"
+
+
+def _parse_line(line: str) -> Tuple[str, str] | None:
+    line = line.rstrip("\r\n")
+    if not line.strip():
+        return None
+    if "\t" in line:
+        code, title = line.split("\t", 1)
+        return normalize_code(code), title.strip()
+    # order file: "00001 A00     0 Cholera (short)   Cholera (long)"
+    if len(line) > 16 and line[:5].isdigit() and line[5] == " ":
+        code = line[6:13].strip()
+        long_title = line[77:].strip() if len(line) > 77 else line[16:].strip()
+        return normalize_code(code), long_title
+    # codes file: "A000    Cholera due to Vibrio cholerae 01, biovar cholerae"
+    parts = line.split(None, 1)
+    if len(parts) == 2:
+        return normalize_code(parts[0]), parts[1].strip()
+    return None
+
+
+class CodeIndex:
+    """Sorted in-memory ICD-10-CM table with prefix and range lookups.
+
+    Codes are stored undotted in one sorted list (titles in a parallel list),
+    so exact, prefix and range queries are a couple of bisects.
+    """
+
+    def __init__(self, entries: Iterable[Tuple[str, str]]):
+        table: Dict[str, str] = {}
+        for code, title in entries:
+            table[normalize_code(code)] = title
+        self._codes = sorted(table)
+        self._titles = [table[c] for c in self._codes]
+        # title word -> positions of the titles containing it, built on first find_title
+        self._words: Dict[str, array] | None = None
+        self._words_lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: str) -> "CodeIndex":
+        if not os.path.exists(path):
+            return cls([])
+        with open(path, encoding="utf-8", errors="replace") as f:
+            return cls(e for e in map(_parse_line, f) if e)
+
+    def __len__(self) -> int:
+        return len(self._codes)
+
+    def _entry(self, i: int) -> CodeEntry:
+        return CodeEntry(self._codes[i], self._titles[i])
+
+    def get(self, code: str) -> CodeEntry | None:
+        code = normalize_code(code)
+        i = bisect.bisect_left(self._codes, code)
+        if i < len(self._codes) and self._codes[i] == code:
+            return self._entry(i)
+        return None
+
+    def prefix(self, prefix: str, limit: int | None = None) -> List[CodeEntry]:
+        prefix = normalize_code(prefix)
+        lo = bisect.bisect_left(self._codes, prefix)
+        hi = bisect.bisect_left(self._codes, prefix + "\uffff")
+        if limit is not None:
+            hi = min(hi, lo + limit)
+        return [self._entry(i) for i in range(lo, hi)]
+
+    def range(self, start: str, end: str, limit: int | None = None, depth: int | None = None) -> List[CodeEntry]:
+        """Codes from ``start`` through ``end`` inclusive of ``end``'s subcodes
+        (``Z80-Z87`` includes ``Z87.891``). ``depth`` keeps only codes of that length."""
+        start, end = normalize_code(start), normalize_code(end)
+        lo = bisect.bisect_left(self._codes, start)
+        hi = bisect.bisect_left(self._codes, end + "\uffff")
+        out = []
+        for i in range(lo, hi):
+            if depth is None or len(self._codes[i]) == depth:
+                out.append(self._entry(i))
+                if limit is not None and len(out) >= limit:
+                    break
+        return out
+
+    def parents(self, code: str) -> List[CodeEntry]:
+        """Ancestors present in the table, category first."""
+        code = normalize_code(code)
+        return [e for e in (self.get(code[:n]) for n in range(3, len(code))) if e]
+
+    def children(self, code: str, limit: int | None = None) -> List[CodeEntry]:
+        """Codes one level below ``code``; falls back to all descendants when
+        the table skips intermediate levels."""
+        code = normalize_code(code)
+        below = [e for e in self.prefix(code) if e.code != code]
+        direct = [e for e in below if len(e.code) == len(code) + 1]
+        out = direct or below
+        return out[:limit] if limit is not None else out
+
+    def _title_words(self) -> Dict[str, array]:
+        if self._words is None:
+            with self._words_lock:
+                if self._words is None:
+                    words: Dict[str, array] = {}
+                    for i, title in enumerate(self._titles):
+                        for w in set(_WORD_RE.findall(title.lower())):
+                            words.setdefault(w, array("I")).append(i)
+                    self._words = words
+        return self._words
+
+    def find_title(self, words: Iterable[str]) -> CodeEntry | None:
+        """The first entry whose title contains all ``words`` (lowercase), or None."""
+        postings = [self._title_words().get(w) for w in set(words)]
+        if not postings or not all(postings):
+            return None
+        postings.sort(key=len)
+        common = set(postings[0]).intersection(*postings[1:])
+        return self._entry(min(common)) if common else None
+
+    def find_codes(self, text: str) -> List[CodeEntry]:
+        """Known codes mentioned in ``text``, in order of appearance, without duplicates."""
+        seen, out = set(), []
+        for m in CODE_RE.finditer(text):
+            entry = self.get(m.group(1))
+            if entry and entry.code not in seen:
+                seen.add(entry.code)
+                out.append(entry)
+        return out
+
+
+_index: CodeIndex | None = None
+_index_lock = threading.Lock()
+
+
+def get_code_index() -> CodeIndex:
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = CodeIndex.load(ICD_CODES_PATH)
+    return _index
+
+
+def _describe(index: CodeIndex, entry: CodeEntry) -> List[str]:
+    lines = [f"{entry.display} — {entry.title}"]
+    for parent in index.parents(entry.code):
+        lines.append(f"  ↳ within {parent.display} — {parent.title}")
+    return lines
+
+
+def _listing(header: str, entries: List[CodeEntry], total: int) -> str:
+    lines = [header, ""]
+    lines += [f"- {e.display} — {e.title}" for e in entries]
+    if total > len(entries):
+        lines.append(f"- … and {total - len(entries)} more")
+    return "\n".join(lines)
+
+
+def direct_answer(message: str, index: CodeIndex | None = None) -> str | None:
+    """Answer pure title/hierarchy/range lookups from the code table.
+
+    Returns None when the message needs the LLM (explanations, disease names,
+    unknown codes, or no code table loaded).
+    """
+    index = index if index is not None else get_code_index()
+    if not len(index):
+        return None
+
+    m = _TITLE_RE.match(message)
+    if m:
+        entry = index.get(m.group(1) or m.group(2))
+        return "\n".join(_describe(index, entry)) if entry else None
+
+    m = _PARENT_RE.match(message)
+    if m:
+        entry = index.get(m.group(1))
+        if not entry:
+            return None
+        if not index.parents(entry.code):
+            return f"{entry.display} — {entry.title} is a top-level category."
+        return "\n".join(_describe(index, entry))
+
+    m = _CHILDREN_RE.match(message)
+    if m:
+        entry = index.get(m.group(1))
+        if not entry:
+            return None
+        children = index.children(entry.code)
+        if not children:
+            return f"{entry.display} — {entry.title} has no subcodes; it is a billable code."
+        return _listing(f"Subcodes of {entry.display} — {entry.title}:", children[:MAX_LISTED_CODES], len(children))
+
+    m = _RANGE_ONLY_RE.match(message)
+    if m:
+        start, end = normalize_code(m.group(1)), normalize_code(m.group(2))
+        if start > end:
+            start, end = end, start
+        # list at the granularity the range was written in (Z80-Z87 -> categories)
+        depth = len(start) if len(start) == len(end) else None
+        entries = index.range(start, end, depth=depth)
+        if not entries:
+            return None
+        return _listing(
+            f"ICD-10-CM codes {format_code(start)}–{format_code(end)}:",
+            entries[:MAX_LISTED_CODES],
+            len(entries),
+        )
+    return None
+
+
+def code_context(message: str, index: CodeIndex | None = None) -> str | None:
+    """Verified table data for codes in ``message``, for the LLM prompt."""
+    index = index if index is not None else get_code_index()
+    if not len(index):
+        return None
+    lines, seen = [], set()
+    for entry in index.find_codes(message)[:5]:
+        seen.add(entry.code)
+        lines += _describe(index, entry)
+    for m in RANGE_RE.finditer(message):
+        start, end = sorted((normalize_code(m.group(1)), normalize_code(m.group(2))))
+        for entry in index.range(start, end, limit=20, depth=3):
+            if entry.code not in seen:
+                seen.add(entry.code)
+                lines.append(f"{entry.display} — {entry.title}")
+    if not lines:
+        return None
+    return "Verified ICD-10-CM code table entries (use these exact titles):\n" + "\n".join(lines)
@@ -0,0 +1,171 @@
+"""Build the guideline retrieval index from Docling Markdown output.
+
+    python -m server.index_guidelines "docling files/output_docling.md" "docling files/Output"
+
+Each Markdown file is split on its ``##`` headings into chunks and tokenized
+into a per-source shard. Shards are cached by content hash in the manifest,
+so re-running after re-converting one PDF only re-parses that file; the
+combined BM25 arrays are then re-assembled from the shards.
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+from collections import Counter
+from typing import Dict, List
+
+import numpy as np
+
+from server.retrieval import GUIDELINE_INDEX_DIR, BM25_B, BM25_K1, tokenize
+
+# chunks longer than this are split on paragraph boundaries
+MAX_CHUNK_CHARS = 1500
+
+
+def split_sections(markdown: str) -> List[Dict[str, str]]:
+    """Split Docling Markdown on ``##`` headings; heading-only sections are dropped."""
+    sections, heading, body = [], "", []
+
+    def flush():
+        text = "\n".join(body).strip()
+        if text:
+            sections.append({"heading": heading, "text": text})
+
+    for line in markdown.splitlines():
+        if line.startswith("## "):
+            flush()
+            heading, body = line[3:].strip(), []
+        else:
+            body.append(line)
+    flush()
+
+    out = []
+    for s in sections:
+        if len(s["text"]) <= MAX_CHUNK_CHARS:
+            out.append(s)
+            continue
+        part: List[str] = []
+        size = 0
+        for para in s["text"].split("\n\n"):
+            if part and size + len(para) > MAX_CHUNK_CHARS:
+                out.append({"heading": s["heading"], "text": "\n\n".join(part)})
+                part, size = [], 0
+            part.append(para)
+            size += len(para) + 2
+        if part:
+            out.append({"heading": s["heading"], "text": "\n\n".join(part)})
+    return out
+
+
+def _sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _collect(paths: List[str]) -> List[str]:
+    files = []
+    for p in paths:
+        if os.path.isdir(p):
+            files += sorted(os.path.join(p, n) for n in os.listdir(p) if n.endswith(".md"))
+        else:
+            files.append(p)
+    return [os.path.abspath(f) for f in files]
+
+
+def build_shard(path: str) -> Dict:
+    with open(path, encoding="utf-8") as f:
+        chunks = split_sections(f.read())
+    source = os.path.basename(path)
+    for c in chunks:
+        c["source"] = source
+        c["tf"] = Counter(tokenize(f"{c['heading']} {c['text']}"))
+    return {"source": source, "chunks": chunks}
+
+
+def write_index(out_dir: str, shards: List[Dict]):
+    chunks = [c for s in shards for c in s["chunks"]]
+    doc_len = np.array([sum(c["tf"].values()) for c in chunks], dtype=np.float32)
+    avgdl = float(doc_len.mean()) if len(chunks) else 0.0
+
+    postings: Dict[str, List[tuple]] = {}
+    for doc_id, c in enumerate(chunks):
+        for term, tf in c["tf"].items():
+            postings.setdefault(term, []).append((doc_id, tf))
+
+    vocab = {term: i for i, term in enumerate(sorted(postings))}
+    indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+    docs, weights = [], []
+    n = len(chunks)
+    for term, tid in vocab.items():
+        plist = postings[term]
+        idf = math.log(1 + (n - len(plist) + 0.5) / (len(plist) + 0.5))
+        for doc_id, tf in plist:
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_len[doc_id] / avgdl)
+            docs.append(doc_id)
+            weights.append(idf * tf * (BM25_K1 + 1) / (tf + norm))
+        indptr[tid + 1] = len(docs)
+
+    os.makedirs(out_dir, exist_ok=True)
+    np.save(os.path.join(out_dir, "indptr.npy"), indptr)
+    np.save(os.path.join(out_dir, "docs.npy"), np.array(docs, dtype=np.int32))
+    np.save(os.path.join(out_dir, "weights.npy"), np.array(weights, dtype=np.float32))
+    with open(os.path.join(out_dir, "vocab.json"), "w", encoding="utf-8") as f:
+        json.dump(vocab, f)
+    # chunks.json is what the server checks for, so it is written last
+    with open(os.path.join(out_dir, "chunks.json"), "w", encoding="utf-8") as f:
+        json.dump([{k: c[k] for k in ("source", "heading", "text")} for c in chunks], f, ensure_ascii=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("inputs", nargs="*", help="Markdown files or directories of .md files to add or refresh")
+    parser.add_argument("--out", default=GUIDELINE_INDEX_DIR)
+    parser.add_argument("--remove", nargs="*", default=[], help="sources to drop from the index")
+    args = parser.parse_args()
+
+    shard_dir = os.path.join(args.out, "shards")
+    manifest_path = os.path.join(args.out, "manifest.json")
+    os.makedirs(shard_dir, exist_ok=True)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+
+    for path in _collect(args.remove):
+        entry = manifest.pop(path, None)
+        if entry:
+            os.remove(os.path.join(shard_dir, entry["shard"]))
+            print(f"removed {path}")
+
+    for path in _collect(args.inputs):
+        digest = _sha256(path)
+        entry = manifest.get(path)
+        if entry and entry["sha256"] == digest:
+            print(f"unchanged {path}")
+            continue
+        shard = build_shard(path)
+        name = f"{hashlib.sha1(path.encode()).hexdigest()[:16]}.json"
+        with open(os.path.join(shard_dir, name), "w", encoding="utf-8") as f:
+            json.dump(shard, f, ensure_ascii=False)
+        manifest[path] = {"sha256": digest, "shard": name, "chunks": len(shard["chunks"])}
+        print(f"indexed {path}: {len(shard['chunks'])} chunks")
+
+    shards = []
+    for path in sorted(manifest):
+        with open(os.path.join(shard_dir, manifest[path]["shard"]), encoding="utf-8") as f:
+            shard = json.load(f)
+        for c in shard["chunks"]:
+            c["tf"] = Counter(c["tf"])
+        shards.append(shard)
+    write_index(args.out, shards)
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"{sum(len(s['chunks']) for s in shards)} chunks from {len(shards)} sources -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
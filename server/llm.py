@@ -0,0 +1,357 @@
+"""Admission control for OpenAI completions: rate limits, a bounded wait and
+retries, in one place.
+
+Every completion goes through ``gateway`` (one per process):
+
+* Two token buckets, ``LLM_REQUESTS_PER_MIN`` and ``LLM_TOKENS_PER_MIN``,
+  should be set a little under the account's OpenAI limits. A call takes one
+  request and its estimated tokens (prompt plus ``max_tokens``, or
+  ``LLM_EXPECTED_COMPLETION_TOKENS``). Once the usage is known the estimate
+  is corrected.
+* Interactive calls (answers) reserve their share and wait for it in
+  arrival order. At most ``LLM_QUEUE_SIZE`` wait at once. A call that would
+  wait past its deadline (``LLM_INTERACTIVE_DEADLINE``) is turned away at
+  once with ``LLMBusy``, which the routes answer with 429 and
+  ``Retry-After``.
+* Background calls (digests, summaries) never reserve ahead, so they can't
+  get in front of an answer. They only go when no answer is waiting and
+  ``LLM_BACKGROUND_HEADROOM`` of both buckets would be left. Otherwise they
+  try again a little later, until ``LLM_BACKGROUND_DEADLINE``.
+* Rate-limit, timeout, connection and 5xx errors from OpenAI are retried with
+  jittered exponential backoff (tenacity), within the same deadline. Each
+  attempt is admitted again. A 429 also empties the requests bucket for its
+  ``Retry-After``, so callers after it wait or are turned away here instead
+  of adding to the pile. The OpenAI clients are built with ``max_retries=0``
+  so the two don't multiply.
+"""
+import os
+import time
+import asyncio
+import threading
+from typing import Any, Callable, Dict
+
+from tenacity import (
+    AsyncRetrying, Retrying, retry_if_exception, stop_after_attempt, stop_before_delay, wait_random_exponential,
+)
+
+from server import metrics
+from server.tokens import estimate_message_tokens
+
+LLM_REQUESTS_PER_MIN = float(os.getenv("LLM_REQUESTS_PER_MIN", "500"))
+LLM_TOKENS_PER_MIN = float(os.getenv("LLM_TOKENS_PER_MIN", "200000"))
+# how much of a minute's allowance may go out at once
+LLM_BURST_SECONDS = float(os.getenv("LLM_BURST_SECONDS", "10"))
+LLM_EXPECTED_COMPLETION_TOKENS = int(os.getenv("LLM_EXPECTED_COMPLETION_TOKENS", "500"))
+LLM_QUEUE_SIZE = int(os.getenv("LLM_QUEUE_SIZE", "200"))
+# seconds an answer may wait for admission plus retries before the client gets a 429
+LLM_INTERACTIVE_DEADLINE = float(os.getenv("LLM_INTERACTIVE_DEADLINE", "10"))
+LLM_BACKGROUND_DEADLINE = float(os.getenv("LLM_BACKGROUND_DEADLINE", "300"))
+# share of both buckets background work leaves for answers
+LLM_BACKGROUND_HEADROOM = float(os.getenv("LLM_BACKGROUND_HEADROOM", "0.25"))
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "3"))
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+# how long background work sleeps while answers are waiting
+BACKGROUND_POLL = 0.5
+
+rejected = metrics.Counter("icd_llm_rejected_total", "Completions turned away by the LLM gateway.", ("priority",))
+retries = metrics.Counter("icd_llm_retries_total", "Completions retried after an OpenAI error.", ("priority", "error"))
+
+
+class LLMBusy(Exception):
+    """No capacity within the caller's deadline; try again after ``retry_after`` seconds."""
+
+    def __init__(self, retry_after: float, message: str = "model is busy, try again"):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """``per_min`` units a minute, refilled continuously up to ``capacity``.
+    The level goes negative when callers reserve ahead. Not locked: the
+    gateway's lock guards it."""
+
+    def __init__(self, per_min: float, capacity: float):
+        self.rate = per_min / 60.0
+        self.capacity = capacity
+        self.level = capacity
+        self._updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_for(self, amount: float) -> float:
+        """Seconds until ``amount`` is available (after ``refill``)."""
+        # a call larger than the bucket waits for a full bucket instead of forever
+        missing = min(amount, self.capacity) - self.level
+        return max(missing, 0.0) / self.rate
+
+    def take(self, amount: float):
+        self.level -= amount
+
+    def give(self, amount: float):
+        self.level = min(self.capacity, self.level + amount)
+
+
+def deadline_for(priority: str) -> float:
+    return LLM_INTERACTIVE_DEADLINE if priority == INTERACTIVE else LLM_BACKGROUND_DEADLINE
+
+
+def request_tokens(kwargs: Dict[str, Any]) -> int:
+    """Estimated tokens of a ``chat.completions.create`` call."""
+    completion = kwargs.get("max_tokens") or LLM_EXPECTED_COMPLETION_TOKENS
+    return estimate_message_tokens(kwargs.get("messages") or []) + completion
+
+
+def retryable(e: BaseException) -> bool:
+    import openai
+
+    return isinstance(e, (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError,
+                          openai.InternalServerError))
+
+
+def upstream_retry_after(e: BaseException) -> float:
+    """OpenAI's ``Retry-After`` on a 429, else 1 second."""
+    response = getattr(e, "response", None)
+    try:
+        return max(float(response.headers.get("retry-after")), 1.0)
+    except (AttributeError, TypeError, ValueError):
+        return 1.0
+
+
+class LLMGateway:
+    def __init__(
+        self,
+        requests_per_min: float = LLM_REQUESTS_PER_MIN,
+        tokens_per_min: float = LLM_TOKENS_PER_MIN,
+        burst_seconds: float = LLM_BURST_SECONDS,
+        queue_size: int = LLM_QUEUE_SIZE,
+        headroom: float = LLM_BACKGROUND_HEADROOM,
+        max_retries: int = LLM_RETRIES,
+    ):
+        burst = burst_seconds / 60.0
+        self._requests = TokenBucket(requests_per_min, max(requests_per_min * burst, 1.0))
+        self._tokens = TokenBucket(tokens_per_min, max(tokens_per_min * burst, 1.0))
+        self.queue_size = queue_size
+        self.headroom = headroom
+        self.max_retries = max_retries
+        self._lock = threading.Lock()
+        self._waiting = {INTERACTIVE: 0, BACKGROUND: 0}
+        self.stats = {"admitted": 0, "rejected": 0, "retries": 0}
+
+    # admission
+    def _reserve(self, tokens: int, deadline: float) -> float:
+        """Take an answer's share now; returns how long to wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self._requests.refill(now)
+            self._tokens.refill(now)
+            wait = max(self._requests.wait_for(1), self._tokens.wait_for(tokens))
+            if wait > deadline - now or (wait > 0 and self._waiting[INTERACTIVE] >= self.queue_size):
+                self.stats["rejected"] += 1
+                rejected.inc(INTERACTIVE)
+                raise LLMBusy(max(wait, 1.0))
+            self._requests.take(1)
+            self._tokens.take(tokens)
+            self.stats["admitted"] += 1
+            if wait > 0:
+                self._waiting[INTERACTIVE] += 1
+            return wait
+
+    def _try_background(self, tokens: int) -> float:
+        """0 if background work may go now (its share is taken), else seconds to sleep."""
+        with self._lock:
+            if self._waiting[INTERACTIVE]:
+                return BACKGROUND_POLL
+            now = time.monotonic()
+            self._requests.refill(now)
+            self._tokens.refill(now)
+            wait = max(
+                self._requests.wait_for(1 + self.headroom * self._requests.capacity),
+                self._tokens.wait_for(tokens + self.headroom * self._tokens.capacity),
+            )
+            if wait > 0:
+                return max(wait, 0.05)
+            self._requests.take(1)
+            self._tokens.take(tokens)
+            self.stats["admitted"] += 1
+            return 0.0
+
+    def _waited(self, priority: str, tokens: int | None = None):
+        """A waiter is done waiting; ``tokens`` gives its share back (it gave up)."""
+        with self._lock:
+            self._waiting[priority] -= 1
+            if tokens is not None:
+                self._requests.give(1)
+                self._tokens.give(tokens)
+
+    def _background_busy(self, deadline: float, wait: float):
+        if time.monotonic() + wait > deadline:
+            with self._lock:
+                self.stats["rejected"] += 1
+            rejected.inc(BACKGROUND)
+            raise LLMBusy(wait)
+
+    def admit(self, tokens: int, priority: str, deadline: float):
+        """Block until a call of ``tokens`` may go; raises LLMBusy."""
+        started = time.monotonic()
+        if priority == INTERACTIVE:
+            wait = self._reserve(tokens, deadline)
+            if wait:
+                try:
+                    time.sleep(wait)
+                except BaseException:
+                    self._waited(priority, tokens)
+                    raise
+                self._waited(priority)
+        else:
+            with self._lock:
+                self._waiting[priority] += 1
+            try:
+                while wait := self._try_background(tokens):
+                    self._background_busy(deadline, wait)
+                    time.sleep(wait)
+            finally:
+                self._waited(priority)
+        metrics.observe(f"llm.wait_{priority}", time.monotonic() - started)
+
+    async def admit_async(self, tokens: int, priority: str, deadline: float):
+        started = time.monotonic()
+        if priority == INTERACTIVE:
+            wait = self._reserve(tokens, deadline)
+            if wait:
+                try:
+                    await asyncio.sleep(wait)
+                except BaseException:
+                    # cancelled, e.g. the client went away
+                    self._waited(priority, tokens)
+                    raise
+                self._waited(priority)
+        else:
+            with self._lock:
+                self._waiting[priority] += 1
+            try:
+                while wait := self._try_background(tokens):
+                    self._background_busy(deadline, wait)
+                    await asyncio.sleep(wait)
+            finally:
+                self._waited(priority)
+        metrics.observe(f"llm.wait_{priority}", time.monotonic() - started)
+
+    def back_off(self, e: BaseException):
+        """OpenAI answered 429: admit nothing more until its ``Retry-After`` has passed."""
+        if getattr(e, "status_code", None) != 429:
+            return
+        with self._lock:
+            self._requests.refill(time.monotonic())
+            self._requests.level = min(self._requests.level, -upstream_retry_after(e) * self._requests.rate)
+
+    def settle(self, estimated: int, usage):
+        """Correct the tokens bucket with what a call really used."""
+        if usage is None:
+            return
+        with self._lock:
+            self._tokens.give(estimated - (usage.total_tokens or 0))
+
+    # calls
+    def _retrying(self, cls, priority: str, deadline: float):
+        def count(state):
+            error = type(state.outcome.exception()).__name__
+            with self._lock:
+                self.stats["retries"] += 1
+            retries.inc(priority, error)
+
+        return cls(
+            retry=retry_if_exception(retryable),
+            wait=wait_random_exponential(multiplier=0.5, max=8),
+            stop=stop_after_attempt(self.max_retries + 1) | stop_before_delay(max(deadline - time.monotonic(), 0.0)),
+            before_sleep=count,
+            reraise=True,
+        )
+
+    def complete(self, create: Callable[..., Any], priority: str = INTERACTIVE, **kwargs):
+        """``create(**kwargs)`` (``client.chat.completions.create``) once
+        admitted, retried on transient errors. Raises LLMBusy when there's no
+        capacity in time or OpenAI keeps answering 429."""
+        deadline = time.monotonic() + deadline_for(priority)
+        tokens = request_tokens(kwargs)
+        try:
+            for attempt in self._retrying(Retrying, priority, deadline):
+                with attempt:
+                    self.admit(tokens, priority, deadline)
+                    try:
+                        result = create(**kwargs)
+                    except Exception as e:
+                        self.back_off(e)
+                        raise
+        except LLMBusy:
+            raise
+        except Exception as e:
+            if retryable(e) and getattr(e, "status_code", None) == 429:
+                raise LLMBusy(upstream_retry_after(e)) from e
+            raise
+        if kwargs.get("stream"):
+            return self._settled_stream(result, tokens)
+        self.settle(tokens, getattr(result, "usage", None))
+        return result
+
+    async def complete_async(self, create: Callable[..., Any], priority: str = INTERACTIVE, **kwargs):
+        """``complete`` for ``AsyncOpenAI``."""
+        deadline = time.monotonic() + deadline_for(priority)
+        tokens = request_tokens(kwargs)
+        try:
+            async for attempt in self._retrying(AsyncRetrying, priority, deadline):
+                with attempt:
+                    await self.admit_async(tokens, priority, deadline)
+                    try:
+                        result = await create(**kwargs)
+                    except Exception as e:
+                        self.back_off(e)
+                        raise
+        except LLMBusy:
+            raise
+        except Exception as e:
+            if retryable(e) and getattr(e, "status_code", None) == 429:
+                raise LLMBusy(upstream_retry_after(e)) from e
+            raise
+        if kwargs.get("stream"):
+            return self._settled_stream_async(result, tokens)
+        self.settle(tokens, getattr(result, "usage", None))
+        return result
+
+    def _settled_stream(self, stream, tokens: int):
+        usage = None
+        for chunk in stream:
+            usage = chunk.usage or usage
+            yield chunk
+        self.settle(tokens, usage)
+
+    async def _settled_stream_async(self, stream, tokens: int):
+        usage = None
+        async for chunk in stream:
+            usage = chunk.usage or usage
+            yield chunk
+        self.settle(tokens, usage)
+
+    def queue_depth(self) -> Dict[tuple, int]:
+        with self._lock:
+            return {(p,): n for p, n in self._waiting.items()}
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            self._requests.refill(now)
+            self._tokens.refill(now)
+            return {
+                **self.stats,
+                "waiting": dict(self._waiting),
+                "requests_available": round(self._requests.level, 1),
+                "tokens_available": round(self._tokens.level),
+            }
+
+
+# one per process: the buckets only work if every completion goes through them
+gateway = LLMGateway()
+
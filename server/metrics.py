@@ -0,0 +1,273 @@
+"""In-process metrics and per-request traces, served at ``/metrics``.
+
+Counters and histograms live in dicts behind one lock, so an update costs
+about a microsecond, and are rendered in the Prometheus text format when
+scraped. Gauges (pool connections, queue depths) are read from callbacks at
+scrape time. Values are per process: scrape each worker separately.
+
+Every ``dbx`` query, OpenAI call and other costly step runs in a ``span``
+named like ``db.get_recent_history`` or ``openai.chat``. Spans feed the
+``icd_stage_seconds`` histogram and the trace of the request they run in.
+With ``SLOW_REQUEST_MS`` set, requests slower than that are logged with
+their per-stage breakdown.
+"""
+import os
+import time
+import inspect
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, Dict, Tuple
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+# log requests slower than this many ms with their stage breakdown; 0 = off
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_lock = threading.Lock()
+_registry: Dict[str, "_Metric"] = {}
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+def _labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.values: dict = {}
+        _registry[name] = self
+
+    def header(self) -> list:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        with _lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> list:
+        with _lock:
+            items = list(self.values.items())
+        return self.header() + [f"{self.name}{_labels(self.labelnames, k)} {v:g}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def observe(self, seconds: float, *labels):
+        i = bisect_left(BUCKETS, seconds)
+        with _lock:
+            h = self.values.get(labels)
+            if h is None:
+                # per-bucket counts (the last one is +Inf), then sum and count
+                h = self.values[labels] = [0] * (len(BUCKETS) + 1) + [0.0, 0]
+            h[i] += 1
+            h[-2] += seconds
+            h[-1] += 1
+
+    def render(self) -> list:
+        with _lock:
+            items = [(k, list(h)) for k, h in self.values.items()]
+        lines = self.header()
+        for k, h in items:
+            cumulative = 0
+            for bound, n in zip(BUCKETS + (float("inf"),), h):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                bucket = _labels(self.labelnames, k, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{bucket} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, k)} {h[-2]:.6f}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, k)} {h[-1]}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Read at scrape time: ``read()`` returns a number, or with label names
+    a dict of label-value tuples to numbers."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, read: Callable, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, help, labelnames)
+        self.read = read
+
+    def render(self) -> list:
+        try:
+            value = self.read()
+        except Exception as e:
+            print("Metrics error:", e)
+            return []
+        items = value.items() if self.labelnames else [((), value)]
+        return self.header() + [f"{self.name}{_labels(self.labelnames, k)} {v:g}" for k, v in items]
+
+
+def gauge(name: str, help: str, read: Callable, labelnames: Tuple[str, ...] = ()):
+    Gauge(name, help, read, labelnames)
+
+
+def render() -> str:
+    lines = []
+    for metric in list(_registry.values()):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+requests_total = Counter("icd_http_requests_total", "HTTP requests by route and status.", ("method", "route", "status"))
+request_seconds = Histogram("icd_http_request_seconds", "HTTP request latency; streams until the last byte.", ("method", "route"))
+stage_seconds = Histogram("icd_stage_seconds", "Time spent in one DB query, OpenAI call or other stage.", ("stage",))
+stage_errors = Counter("icd_stage_errors_total", "Stages that raised.", ("stage",))
+openai_tokens = Counter("icd_openai_tokens_total", "Tokens billed by OpenAI, from the completion usage.", ("purpose", "kind"))
+slow_requests = Counter("icd_slow_requests_total", "Requests slower than SLOW_REQUEST_MS.", ("method", "route"))
+
+
+class Trace:
+    """Stage timings of one request."""
+
+    __slots__ = ("method", "route", "start", "stages", "status", "deferred", "finished")
+
+    def __init__(self, method: str, route: str):
+        self.method = method
+        self.route = route
+        self.start = time.perf_counter()
+        self.stages: Dict[str, list] = {}  # stage -> [seconds, calls]
+        self.status = 0
+        self.deferred = False
+        self.finished = False
+
+    def add(self, stage: str, seconds: float):
+        with _lock:
+            s = self.stages.get(stage)
+            if s is None:
+                self.stages[stage] = [seconds, 1]
+            else:
+                s[0] += seconds
+                s[1] += 1
+
+    def finish(self):
+        if self.finished:
+            return
+        self.finished = True
+        elapsed = time.perf_counter() - self.start
+        requests_total.inc(self.method, self.route, self.status)
+        request_seconds.observe(elapsed, self.method, self.route)
+        if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+            slow_requests.inc(self.method, self.route)
+            print("Slow request:", self.describe(elapsed))
+
+    def describe(self, elapsed: float) -> str:
+        with _lock:
+            stages = sorted(self.stages.items(), key=lambda kv: -kv[1][0])
+        parts = [f"{name} {s * 1000:.0f}ms" + (f" x{n}" if n > 1 else "") for name, (s, n) in stages]
+        # concurrent stages (asyncio.gather) can add up to more than the wall time
+        other = elapsed - sum(s for s, _ in self.stages.values())
+        if other >= 0.001:
+            parts.append(f"other {other * 1000:.0f}ms")
+        return f"{self.method} {self.route} {self.status} {elapsed * 1000:.0f}ms [{', '.join(parts)}]"
+
+
+_trace: ContextVar[Trace | None] = ContextVar("trace", default=None)
+# set inside a span, so nested spans don't count twice in the breakdown
+_in_span: ContextVar[bool] = ContextVar("in_span", default=False)
+
+
+def start_request(method: str, route: str):
+    if METRICS_ENABLED:
+        _trace.set(Trace(method, route))
+
+
+def end_request(status: int):
+    """Record the current request unless a streamed response deferred it."""
+    trace = _trace.get()
+    if trace is None:
+        return
+    trace.status = status
+    if not trace.deferred:
+        trace.finish()
+
+
+def defer_request() -> Trace | None:
+    """For streamed responses: the caller finishes the returned trace once
+    the body is sent."""
+    trace = _trace.get()
+    if trace is not None:
+        trace.deferred = True
+    return trace
+
+
+def observe(stage: str, seconds: float):
+    stage_seconds.observe(seconds, stage)
+    trace = _trace.get()
+    if trace is not None and not _in_span.get():
+        trace.add(stage, seconds)
+
+
+@contextmanager
+def _span(stage: str):
+    outer = _in_span.get()
+    token = _in_span.set(True)
+    t0 = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        stage_errors.inc(stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - t0
+        _in_span.reset(token)
+        stage_seconds.observe(elapsed, stage)
+        trace = _trace.get()
+        if trace is not None and not outer:
+            trace.add(stage, elapsed)
+
+
+def span(stage: str):
+    """Time the ``with`` block as ``stage``."""
+    return _span(stage) if METRICS_ENABLED else nullcontext()
+
+
+def timed(prefix: str):
+    """Decorator: run each call in a span named ``<prefix>.<function name>``."""
+    def decorate(fn):
+        if not METRICS_ENABLED:
+            return fn
+        stage = f"{prefix}.{fn.__name__}"
+        if inspect.iscoroutinefunction(fn):
+            @wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with _span(stage):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def count_tokens(purpose: str, usage):
+    """Add an OpenAI ``usage`` object's tokens under ``purpose`` (chat, summary)."""
+    if usage is None or not METRICS_ENABLED:
+        return
+    openai_tokens.inc(purpose, "prompt", amount=usage.prompt_tokens or 0)
+    openai_tokens.inc(purpose, "completion", amount=usage.completion_tokens or 0)
@@ -0,0 +1,25 @@
+"""Create the tables and apply pending migrations, then exit.
+
+    python -m server.migrate
+
+Run it once per deploy, before starting (or scaling out) the servers; they
+don't change the schema themselves and report ``/ready`` 503 until it's done.
+"""
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import server.db.db as dbx
+from server.db.pool import close_pool
+
+
+def main():
+    try:
+        applied = dbx.create_tables()
+    finally:
+        close_pool()
+    print(f"Applied migrations {applied}" if applied else "Schema is up to date")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+import base64
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
+
+SESSIONS_PAGE_SIZE = 20
+MESSAGES_PAGE_SIZE = 25  # chat rows (question + answer) per page
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(ts: datetime, row_id: int) -> str:
+    raw = f"{ts.isoformat()}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str | None) -> Tuple[datetime, int] | None:
+    """Parse an opaque keyset cursor; raises ValueError when malformed."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        ts, row_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(ts), int(row_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError("invalid cursor") from e
+
+
+def parse_limit(value: str | None, default: int) -> int:
+    if value is None:
+        return default
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError("limit must be an integer") from None
+    if limit < 1:
+        raise ValueError("limit must be positive")
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def split_page(rows: List[Dict[str, Any]], limit: int, ts_key: str) -> Tuple[List[Dict[str, Any]], str | None]:
+    """Rows were fetched with ``limit + 1``; trim and build the next cursor."""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(last[ts_key], last["id"])
@@ -0,0 +1,221 @@
+"""Password hashing off the request path, with login throttling.
+
+werkzeug's KDFs are deliberately slow CPU work (~100 ms for scrypt). Run
+inline, a burst of logins would hold the same workers that serve ``/chat``.
+Here they run in a small process pool instead (a thread pool where
+processes can't be forked, e.g. inside hypercorn's workers):
+
+* at most ``PASSWORD_WORKERS`` hashes run at once;
+* at most ``PASSWORD_MAX_PENDING`` may be queued or running; beyond that
+  ``PasswordBusy`` is raised and the route answers 503 right away;
+* a successful login whose stored hash uses other parameters than
+  ``PASSWORD_HASH_METHOD`` gets a fresh hash, which the route saves.
+
+``LoginThrottle`` refuses a username after ``LOGIN_MAX_FAILURES`` failed
+attempts within ``LOGIN_FAILURE_WINDOW`` seconds, before any hashing.
+"""
+import os
+import time
+import asyncio
+import threading
+import multiprocessing
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, BrokenExecutor
+from functools import lru_cache
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from server import metrics
+
+# werkzeug method string, in full so stored hashes can be compared against it
+PASSWORD_HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", str(min(2, os.cpu_count() or 1))))
+PASSWORD_MAX_PENDING = int(os.getenv("PASSWORD_MAX_PENDING", "64"))
+LOGIN_MAX_FAILURES = int(os.getenv("LOGIN_MAX_FAILURES", "5"))
+LOGIN_FAILURE_WINDOW = float(os.getenv("LOGIN_FAILURE_WINDOW", "300"))
+
+
+class PasswordBusy(Exception):
+    pass
+
+
+rejected = metrics.Counter("icd_password_rejected_total", "Password checks refused with PasswordBusy.")
+rehashed = metrics.Counter("icd_password_rehashed_total", "Stored hashes upgraded to PASSWORD_HASH_METHOD at login.")
+throttled = metrics.Counter("icd_login_throttled_total", "Login attempts refused by LoginThrottle.")
+
+
+@lru_cache(maxsize=None)
+def _method_prefix(method: str) -> str:
+    # werkzeug fills in defaults ("scrypt" -> "scrypt:32768:8:1"); hash once to see them
+    return generate_password_hash("", method=method).split("$", 1)[0]
+
+
+# the worker functions return their start time, so the caller can tell queueing from hashing
+def _hash(password: str, method: str):
+    return generate_password_hash(password, method=method), time.time()
+
+
+def _verify(stored: str, password: str, method: str):
+    started = time.time()
+    ok = check_password_hash(stored, password)
+    new_hash = None
+    if ok and stored.split("$", 1)[0] != _method_prefix(method):
+        new_hash = generate_password_hash(password, method=method)
+    return (ok, new_hash), started
+
+
+class PasswordHasher:
+    def __init__(self, workers: int = PASSWORD_WORKERS, max_pending: int = PASSWORD_MAX_PENDING,
+                 method: str = PASSWORD_HASH_METHOD):
+        self.workers = workers
+        self.method = method
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def start(self):
+        """Start the worker processes. Call this early: they are forked from
+        the current process, which should not have started other threads yet."""
+        if self._executor is None:
+            self._executor = self._new_executor()
+            # fork-based pools launch every worker on the first submit
+            self._executor.submit(int).result()
+
+    def _new_executor(self):
+        if "fork" in multiprocessing.get_all_start_methods() and not multiprocessing.current_process().daemon:
+            return ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("fork"))
+        # daemonic processes (hypercorn's workers) can't have children, and spawn
+        # would re-run the server module in every worker. hashlib's KDFs release
+        # the GIL, so dedicated threads still hash in parallel, off the request threads.
+        return ThreadPoolExecutor(self.workers, thread_name_prefix="password")
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def pending(self) -> int:
+        return self._pending
+
+    def _submit(self, fn, *args) -> Future:
+        if not self._slots.acquire(blocking=False):
+            rejected.inc()
+            raise PasswordBusy("too many password checks in progress")
+        with self._lock:
+            self._pending += 1
+        submitted = time.time()
+        self.start()
+        try:
+            executor = self._executor
+            try:
+                inner = executor.submit(fn, *args)
+            except BrokenExecutor:
+                # a worker died; replace the pool rather than failing every login from now on
+                inner = self._replace(executor).submit(fn, *args)
+        except BaseException:
+            self._done()
+            raise
+        outer: Future = Future()
+
+        def unwrap(f: Future):
+            self._done()
+            try:
+                result, started = f.result()
+            except BaseException as e:
+                outer.set_exception(e)
+                return
+            metrics.observe("auth.password_queue", max(started - submitted, 0.0))
+            outer.set_result(result)
+
+        inner.add_done_callback(unwrap)
+        return outer
+
+    def _replace(self, broken):
+        """A working pool in place of ``broken``. Callers that saw the same pool
+        break at once get the one replacement; the broken pool is shut down."""
+        with self._lock:
+            if self._executor is broken:
+                broken.shutdown(wait=False, cancel_futures=True)
+                self._executor = self._new_executor()
+            return self._executor
+
+    def _done(self):
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def _rehashed(self, result):
+        if result[1] is not None:
+            rehashed.inc()
+        return result
+
+    def hash(self, password: str) -> str:
+        with metrics.span("auth.hash_password"):
+            return self._submit(_hash, password, self.method).result()
+
+    def verify(self, stored: str, password: str) -> tuple[bool, str | None]:
+        """``(ok, new_hash)``; ``new_hash`` is set when the stored one should be replaced."""
+        with metrics.span("auth.check_password"):
+            return self._rehashed(self._submit(_verify, stored, password, self.method).result())
+
+    async def hash_async(self, password: str) -> str:
+        with metrics.span("auth.hash_password"):
+            return await asyncio.wrap_future(self._submit(_hash, password, self.method))
+
+    async def verify_async(self, stored: str, password: str) -> tuple[bool, str | None]:
+        with metrics.span("auth.check_password"):
+            return self._rehashed(await asyncio.wrap_future(self._submit(_verify, stored, password, self.method)))
+
+
+class LoginThrottle:
+    """Failed logins per username in a sliding window.
+
+    Attempts still being checked count as failures until they finish, so a
+    flood of parallel guesses is cut off too. Only the ``max_users`` most
+    recently failing usernames are remembered.
+    """
+
+    def __init__(self, max_failures: int = LOGIN_MAX_FAILURES, window: float = LOGIN_FAILURE_WINDOW,
+                 max_users: int = 100_000):
+        self.max_failures = max_failures
+        self.window = window
+        self.max_users = max_users
+        self._failures: OrderedDict[str, deque] = OrderedDict()
+        self._in_flight: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, username: str) -> float:
+        """0 if the attempt may proceed (call ``release`` after it), else
+        seconds until the oldest failure leaves the window."""
+        now = time.monotonic()
+        with self._lock:
+            failures = self._failures.get(username)
+            while failures and failures[0] <= now - self.window:
+                failures.popleft()
+            failed = len(failures) if failures else 0
+            in_flight = self._in_flight.get(username, 0)
+            if failed + in_flight >= self.max_failures:
+                throttled.inc()
+                return failures[0] + self.window - now if failed else 1.0
+            self._in_flight[username] = in_flight + 1
+            return 0.0
+
+    def release(self, username: str, ok: bool | None):
+        """``ok`` is None when the password was never checked (e.g. PasswordBusy)."""
+        with self._lock:
+            in_flight = self._in_flight.pop(username, 1) - 1
+            if in_flight:
+                self._in_flight[username] = in_flight
+            if ok:
+                self._failures.pop(username, None)
+            elif ok is False:
+                self._failures.setdefault(username, deque()).append(time.monotonic())
+                self._failures.move_to_end(username)
+                if len(self._failures) > self.max_users:
+                    self._failures.popitem(last=False)
+
+
+hasher = PasswordHasher()
+login_throttle = LoginThrottle()
+
+metrics.gauge("icd_password_pending", "Password hashes queued or running.", hasher.pending)
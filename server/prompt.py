@@ -0,0 +1,76 @@
+import os
+from typing import Any, Dict, List, Tuple
+
+from server.tokens import estimate_tokens, MESSAGE_OVERHEAD
+
+# total input tokens allowed for one answer prompt (system + summary + history + question)
+CHAT_CONTEXT_TOKENS = int(os.getenv("CHAT_CONTEXT_TOKENS", "6000"))
+# newest chat rows (turns) loaded from the database before budgeting
+CHAT_HISTORY_MAX_TURNS = int(os.getenv("CHAT_HISTORY_MAX_TURNS", "10"))
+
+
+def _cost(content: str | None) -> int:
+    return estimate_tokens(content) + MESSAGE_OVERHEAD
+
+
+def turn_messages(row: Dict[str, Any]) -> List[Dict[str, str]]:
+    out = []
+    if row["user_message"]:
+        out.append({"role": "user", "content": row["user_message"]})
+    if row["ai_response"]:
+        out.append({"role": "assistant", "content": row["ai_response"]})
+    return out
+
+
+def build_messages(
+    system_prompt: str,
+    summary: str | None,
+    recent_rows: List[Dict[str, Any]],
+    user_message: str,
+    budget: int = CHAT_CONTEXT_TOKENS,
+    context_blocks: Dict[str, str | None] | None = None,
+) -> Tuple[List[Dict[str, str]], Dict[str, int]]:
+    """Assemble the answer prompt within ``budget`` tokens.
+
+    ``recent_rows`` are chat rows newest first (``"recent"`` of ``dbx.get_recent_history``).
+    ``context_blocks`` maps a stage name to extra system content (e.g. verified
+    code data); empty blocks are skipped. System prompt, summary, context
+    blocks and the new question are always included; whole turns of history
+    are then added newest to oldest while they fit. Returns the messages plus
+    per-stage token counts.
+    """
+    head = [{"role": "system", "content": system_prompt}]
+    stats = {"budget": budget, "system": _cost(system_prompt), "summary": 0}
+    if summary:
+        content = f"Summary of previous conversation:\n{summary}"
+        head.append({"role": "system", "content": content})
+        stats["summary"] = _cost(content)
+    for stage, content in (context_blocks or {}).items():
+        stats[stage] = 0
+        if content:
+            head.append({"role": "system", "content": content})
+            stats[stage] = _cost(content)
+    question = {"role": "user", "content": user_message}
+    stats["user"] = _cost(user_message)
+
+    remaining = budget - sum(v for k, v in stats.items() if k != "budget")
+    stats.update(history=0, history_turns=0, history_turns_dropped=0)
+
+    kept: List[List[Dict[str, str]]] = []
+    for i, row in enumerate(recent_rows):
+        msgs = turn_messages(row)
+        cost = sum(_cost(m["content"]) for m in msgs)
+        if cost > remaining:
+            stats["history_turns_dropped"] = len(recent_rows) - i
+            break
+        remaining -= cost
+        stats["history"] += cost
+        kept.append(msgs)
+    stats["history_turns"] = len(kept)
+    stats["total"] = budget - remaining
+
+    messages = list(head)
+    for msgs in reversed(kept):
+        messages.extend(msgs)
+    messages.append(question)
+    return messages, stats
@@ -0,0 +1,112 @@
+import json
+import os
+import re
+import threading
+from typing import Dict, List, NamedTuple
+
+import numpy as np
+
+# built by `python -m server.index_guidelines`
+GUIDELINE_INDEX_DIR = os.getenv(
+    "GUIDELINE_INDEX_DIR", os.path.join(os.path.dirname(__file__), "data", "guidelines")
+)
+GUIDELINE_TOP_K = int(os.getenv("GUIDELINE_TOP_K", "3"))
+# BM25 score below which a passage is considered unrelated to the question
+GUIDELINE_MIN_SCORE = float(os.getenv("GUIDELINE_MIN_SCORE", "2.0"))
+
+# BM25 parameters; baked into the stored posting weights at build time
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:\.[a-z0-9]+)?")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have if in into is it its of on or that the their them "
+    "then there these this to was were which will with what how do does i me my you your can".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in _TOKEN_RE.findall(text.lower()) if t not in _STOPWORDS]
+
+
+class Passage(NamedTuple):
+    source: str
+    heading: str
+    text: str
+    score: float
+
+
+class GuidelineIndex:
+    """Read-only BM25 index over guideline chunks.
+
+    Postings are stored CSR-style (``indptr`` per term into ``docs``/``weights``)
+    with the BM25 term weight precomputed, and loaded memory-mapped, so a query
+    is a few array slices plus one scatter-add.
+    """
+
+    def __init__(self, directory: str):
+        with open(os.path.join(directory, "chunks.json"), encoding="utf-8") as f:
+            self.chunks: List[Dict[str, str]] = json.load(f)
+        with open(os.path.join(directory, "vocab.json"), encoding="utf-8") as f:
+            self.vocab: Dict[str, int] = json.load(f)
+        self.indptr = np.load(os.path.join(directory, "indptr.npy"), mmap_mode="r")
+        self.docs = np.load(os.path.join(directory, "docs.npy"), mmap_mode="r")
+        self.weights = np.load(os.path.join(directory, "weights.npy"), mmap_mode="r")
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    def search(self, query: str, k: int = GUIDELINE_TOP_K, min_score: float = 0.0) -> List[Passage]:
+        term_ids = {self.vocab[t] for t in tokenize(query) if t in self.vocab}
+        if not term_ids or not self.chunks:
+            return []
+        scores = np.zeros(len(self.chunks), dtype=np.float32)
+        for tid in term_ids:
+            lo, hi = self.indptr[tid], self.indptr[tid + 1]
+            # a term has at most one posting per chunk, so plain fancy-index add is safe
+            scores[self.docs[lo:hi]] += self.weights[lo:hi]
+        # over-fetch so duplicate chunks (the same PDF converted twice) can be skipped
+        n = min(2 * k, len(scores))
+        top = np.argpartition(-scores, n - 1)[:n]
+        top = top[np.argsort(-scores[top])]
+        out, seen = [], set()
+        for i in top:
+            if scores[i] <= min_score or len(out) >= k:
+                break
+            c = self.chunks[i]
+            if c["text"] in seen:
+                continue
+            seen.add(c["text"])
+            out.append(Passage(c["source"], c["heading"], c["text"], float(scores[i])))
+        return out
+
+
+_index: GuidelineIndex | None = None
+_index_loaded = False
+_index_lock = threading.Lock()
+
+
+def get_guideline_index() -> GuidelineIndex | None:
+    """The on-disk index, or None when it hasn't been built."""
+    global _index, _index_loaded
+    if not _index_loaded:
+        with _index_lock:
+            if not _index_loaded:
+                if os.path.exists(os.path.join(GUIDELINE_INDEX_DIR, "chunks.json")):
+                    _index = GuidelineIndex(GUIDELINE_INDEX_DIR)
+                _index_loaded = True
+    return _index
+
+
+def guideline_context(question: str) -> str | None:
+    """Top guideline passages for ``question`` as a prompt block."""
+    index = get_guideline_index()
+    if index is None:
+        return None
+    passages = index.search(question, GUIDELINE_TOP_K, GUIDELINE_MIN_SCORE)
+    if not passages:
+        return None
+    lines = ["Relevant ICD-10-CM official guideline excerpts (cite when applicable):"]
+    for i, p in enumerate(passages, 1):
+        lines.append(f"[{i}] {p.heading}\n{p.text}")
+    return "\n\n".join(lines)
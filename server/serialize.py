@@ -0,0 +1,20 @@
+import json
+from typing import Any, Dict
+
+
+def session_to_json(r: Dict[str, Any]) -> Dict[str, Any]:
+    title = r.get("first_user_message") or r.get("session_name") or f"Chat {r['id']}"
+    if title and len(title) > 60:
+        title = title[:60] + "…"
+    return {
+        "id": r["id"],
+        "title": title,
+        "session_name": r.get("session_name"),
+        "started_at": r["started_at"],
+        "last_activity": r.get("last_activity")
+    }
+
+
+def sse(data: dict, event: str | None = None) -> str:
+    payload = json.dumps(data, default=str)
+    return f"event: {event}\ndata: {payload}\n\n" if event else f"data: {payload}\n\n"
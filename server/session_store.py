@@ -0,0 +1,221 @@
+"""Server-side login sessions and the per-user context cached with them.
+
+The session cookie carries only a signed random id; ``session`` data lives in
+a store picked with ``SESSION_STORE``:
+
+* ``memory``: a dict in this process. Logins are lost on restart and not
+  shared between worker processes.
+* ``postgres``: the ``auth_sessions`` table, shared by every worker. Each
+  process serves a session from memory for ``SESSION_CACHE_TTL`` seconds, so
+  a logout in one worker can take that long to reach the others.
+
+``UserContextCache`` keeps what the chat hot path used to ask Postgres on
+every turn: which chat sessions a user owns and each session's memory
+(summary and digests, see server/summary.py).
+"""
+import os
+import secrets
+import threading
+from typing import Any, Dict, Iterable
+
+from cachetools import LRUCache, TTLCache
+from flask.sessions import SecureCookieSessionInterface
+
+import server.db.db as dbx
+
+SESSION_STORE = os.getenv("SESSION_STORE", "memory")
+SESSION_TTL = int(os.getenv("SESSION_TTL", str(7 * 24 * 3600)))  # seconds a login lasts
+SESSION_CACHE_TTL = float(os.getenv("SESSION_CACHE_TTL", "30"))
+SESSION_MEMORY_SIZE = int(os.getenv("SESSION_MEMORY_SIZE", "100000"))
+# memory written by another process shows up here after at most this long
+SUMMARY_CACHE_TTL = float(os.getenv("SUMMARY_CACHE_TTL", "60"))
+USER_CONTEXT_SIZE = int(os.getenv("USER_CONTEXT_SIZE", "10000"))
+# delete expired auth_sessions rows after this many logins
+PURGE_EVERY = 500
+
+
+def new_sid() -> str:
+    return secrets.token_urlsafe(32)
+
+
+class MemorySessionStore:
+    def __init__(self, ttl: int = SESSION_TTL, maxsize: int = SESSION_MEMORY_SIZE):
+        self._sessions: TTLCache = TTLCache(maxsize, ttl)
+        self._lock = threading.Lock()
+
+    def cached(self, sid: str) -> Dict[str, Any] | None:
+        with self._lock:
+            return self._sessions.get(sid)
+
+    def load(self, sid: str) -> Dict[str, Any] | None:
+        return self.cached(sid)
+
+    def save(self, sid: str, data: Dict[str, Any]):
+        with self._lock:
+            self._sessions[sid] = data
+
+    def delete(self, sid: str):
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+
+class PostgresSessionStore:
+    def __init__(self, ttl: int = SESSION_TTL, cache_ttl: float = SESSION_CACHE_TTL,
+                 maxsize: int = SESSION_MEMORY_SIZE):
+        self.ttl = ttl
+        self._cache: TTLCache = TTLCache(maxsize, cache_ttl)
+        self._lock = threading.Lock()
+        self._saves = 0
+
+    def cached(self, sid: str) -> Dict[str, Any] | None:
+        """The session if this process loaded it recently; None means ask ``load``."""
+        with self._lock:
+            return self._cache.get(sid)
+
+    def load(self, sid: str) -> Dict[str, Any] | None:
+        data = self.cached(sid)
+        if data is None:
+            data = dbx.get_auth_session(sid)
+            if data is not None:
+                with self._lock:
+                    self._cache[sid] = data
+        return data
+
+    def save(self, sid: str, data: Dict[str, Any]):
+        dbx.put_auth_session(sid, data, self.ttl)
+        with self._lock:
+            self._cache[sid] = data
+            self._saves += 1
+            purge = self._saves % PURGE_EVERY == 0
+        if purge:
+            dbx.purge_auth_sessions()
+
+    def delete(self, sid: str):
+        with self._lock:
+            self._cache.pop(sid, None)
+        dbx.delete_auth_session(sid)
+
+
+def get_session_store():
+    if SESSION_STORE == "memory":
+        return MemorySessionStore()
+    if SESSION_STORE == "postgres":
+        return PostgresSessionStore()
+    raise RuntimeError(f"SESSION_STORE must be 'memory' or 'postgres', not {SESSION_STORE!r}")
+
+
+class ServerSideSessionInterface(SecureCookieSessionInterface):
+    """Flask's signed cookie, carrying ``{"sid": ...}`` instead of the session
+    data; the data is loaded from and saved to ``store``. Saved only when
+    modified (login), deleted when cleared (logout)."""
+
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        cookie = super().open_session(app, request)
+        if cookie is None:
+            return None
+        sid = cookie.get("sid")
+        return session_for(self.session_class, sid, self.store.load(sid) if sid else None)
+
+    def save_session(self, app, session, response):
+        super().save_session(app, persist(self.store, session), response)
+
+
+def session_for(session_class, sid: str | None, data: Dict[str, Any] | None):
+    session = session_class(data or {})
+    # an unknown or expired id gets a fresh one at the next login
+    session.sid = sid if data is not None else None
+    return session
+
+
+def regenerate(session):
+    """Empty ``session`` and give it a new id when it is saved; the old id is
+    deleted from the store. Called at login, so an id the browser already
+    had (possibly one planted by someone else) never becomes a logged-in one."""
+    session.stale_sid = getattr(session, "sid", None)
+    session.sid = None
+    session.clear()
+
+
+def persist(store, session):
+    """Write a modified ``session`` to ``store``; returns the session to put in the cookie."""
+    stale = getattr(session, "stale_sid", None)
+    if stale:
+        store.delete(stale)
+    sid = getattr(session, "sid", None)
+    if not session:
+        if sid and session.modified:
+            store.delete(sid)
+        return session
+    cookie = session.__class__({"sid": sid})
+    cookie.accessed = session.accessed
+    if session.modified:
+        cookie["sid"] = sid or new_sid()
+        store.save(cookie["sid"], dict(session))
+    return cookie
+
+
+class UserContextCache:
+    """Per-process cache of chat session ownership and session memory.
+
+    Owned ids only grow (sessions are never reassigned), so a miss just falls
+    back to Postgres and fills the cache. Memory is replaced by the summary
+    worker of this process and expires after ``SUMMARY_CACHE_TTL`` in case
+    another process updated it. Cached memory dicts are shared; don't modify them.
+    """
+
+    def __init__(self, maxsize: int = USER_CONTEXT_SIZE, memory_ttl: float = SUMMARY_CACHE_TTL):
+        self._owned: LRUCache = LRUCache(maxsize)
+        self._memory: TTLCache = TTLCache(maxsize, memory_ttl)
+        self._lock = threading.Lock()
+        self.stats = {"owner_hits": 0, "owner_misses": 0, "memory_hits": 0, "memory_misses": 0}
+
+    def owns(self, user_id: int, session_id: int) -> bool:
+        """True if ``session_id`` is known to belong to ``user_id``; False means check Postgres."""
+        with self._lock:
+            owned = self._owned.get(user_id)
+            hit = owned is not None and session_id in owned
+            self.stats["owner_hits" if hit else "owner_misses"] += 1
+            return hit
+
+    def add_sessions(self, user_id: int, session_ids: Iterable[int]):
+        with self._lock:
+            owned = self._owned.get(user_id)
+            if owned is None:
+                owned = self._owned[user_id] = set()
+            owned.update(session_ids)
+
+    def add_session(self, user_id: int, session_id: int, memory: Dict[str, Any] | None = None):
+        self.add_sessions(user_id, (session_id,))
+        if memory is not None:
+            self.set_memory(session_id, memory)
+
+    def memory(self, session_id: int) -> Dict[str, Any] | None:
+        with self._lock:
+            memory = self._memory.get(session_id)
+            self.stats["memory_hits" if memory is not None else "memory_misses"] += 1
+            return memory
+
+    def set_memory(self, session_id: int, memory: Dict[str, Any]):
+        with self._lock:
+            self._memory[session_id] = memory
+
+    def drop_memory(self, session_id: int):
+        """Forget a session's memory, e.g. after new facts were stored; the
+        next turn reloads it in its one query. (Updating it in place would
+        restart its TTL and hide changes made by other processes.)"""
+        with self._lock:
+            self._memory.pop(session_id, None)
+
+    def drop_user(self, user_id: int):
+        with self._lock:
+            owned = self._owned.pop(user_id, None) or ()
+            for session_id in owned:
+                self._memory.pop(session_id, None)
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self.stats, "users": len(self._owned), "memories": len(self._memory)}
+
@@ -0,0 +1,229 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Dict, Iterable, Iterator, List, Tuple
+
+# how long a waiter waits for the shared call (or the next streamed chunk)
+LLM_FLIGHT_TIMEOUT = float(os.getenv("LLM_FLIGHT_TIMEOUT", "60"))
+
+
+class FlightTimeout(TimeoutError):
+    pass
+
+
+def prompt_key(model: str, messages: List[Dict[str, str]], **params) -> str:
+    """Key identifying an upstream completion; the final user message is
+    compared case- and whitespace-insensitively."""
+    norm = [dict(m) for m in messages]
+    if norm and norm[-1]["role"] == "user":
+        norm[-1]["content"] = re.sub(r"\s+", " ", norm[-1]["content"]).strip().casefold()
+    raw = json.dumps({"model": model, "messages": norm, "params": params}, sort_keys=True)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class _Flight:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.items: List[Any] = []
+        self.result: Any = None
+        self.error: BaseException | None = None
+        self.done = False
+
+
+class SingleFlight:
+    """Coalesce identical in-flight calls (Go's ``singleflight``).
+
+    ``do`` runs ``fn`` once per key while it is in flight; concurrent callers
+    with the same key block and receive the same result or exception.
+    ``stream`` does the same for iterators: the upstream iterator is consumed
+    by a background thread and every caller replays the shared items as they
+    arrive, so one slow or disconnected client never stalls the others.
+    """
+
+    def __init__(self, timeout: float = LLM_FLIGHT_TIMEOUT):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Flight] = {}
+        self._streams: Dict[str, _Flight] = {}
+        self.stats = {"calls": 0, "shared": 0, "streams": 0, "shared_streams": 0}
+
+    def _join(self, table: Dict[str, _Flight], key: str) -> Tuple[_Flight, bool]:
+        with self._lock:
+            flight = table.get(key)
+            leader = flight is None
+            if leader:
+                flight = table[key] = _Flight()
+            return flight, leader
+
+    def _finish(self, table: Dict[str, _Flight], key: str, flight: _Flight):
+        with self._lock:
+            if table.get(key) is flight:
+                del table[key]
+        with flight.cond:
+            flight.done = True
+            flight.cond.notify_all()
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Returns ``(result, shared)``; ``shared`` is True for followers."""
+        flight, leader = self._join(self._calls, key)
+        with self._lock:
+            self.stats["calls" if leader else "shared"] += 1
+        if leader:
+            try:
+                flight.result = fn()
+            except BaseException as e:
+                flight.error = e
+            finally:
+                self._finish(self._calls, key, flight)
+        else:
+            with flight.cond:
+                if not flight.cond.wait_for(lambda: flight.done, self.timeout):
+                    raise FlightTimeout(f"shared upstream call did not finish within {self.timeout}s")
+        if flight.error is not None:
+            raise flight.error
+        return flight.result, not leader
+
+    def stream(self, key: str, start: Callable[[], Iterable[Any]]) -> Tuple[Iterator[Any], bool]:
+        """Returns ``(items, shared)``; every caller gets the full item sequence."""
+        flight, leader = self._join(self._streams, key)
+        with self._lock:
+            self.stats["streams" if leader else "shared_streams"] += 1
+        if leader:
+            threading.Thread(target=self._pump, args=(key, flight, start), daemon=True).start()
+        return self._replay(flight), not leader
+
+    def _pump(self, key: str, flight: _Flight, start: Callable[[], Iterable[Any]]):
+        try:
+            for item in start():
+                with flight.cond:
+                    flight.items.append(item)
+                    flight.cond.notify_all()
+        except BaseException as e:
+            flight.error = e
+        finally:
+            self._finish(self._streams, key, flight)
+
+    def _replay(self, flight: _Flight) -> Iterator[Any]:
+        i = 0
+        while True:
+            with flight.cond:
+                deadline = time.monotonic() + self.timeout
+                while i >= len(flight.items) and not flight.done:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise FlightTimeout(f"shared upstream stream stalled for {self.timeout}s")
+                    flight.cond.wait(remaining)
+                if i >= len(flight.items):
+                    break
+                batch = flight.items[i:]
+            i += len(batch)
+            yield from batch
+        if flight.error is not None:
+            raise flight.error
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            s = dict(self.stats)
+            s["in_flight"] = len(self._calls) + len(self._streams)
+        return s
+
+
+class _AsyncFlight:
+    def __init__(self):
+        self.items: List[Any] = []
+        self.error: BaseException | None = None
+        self.done = False
+        self.changed = asyncio.Event()
+
+    def notify(self):
+        # wake everyone waiting on the current event and arm a fresh one
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+
+class AsyncSingleFlight:
+    """``SingleFlight`` for coroutines, used by the ASGI app.
+
+    The shared call runs as its own task, so a leader whose client goes away
+    (and whose handler is cancelled) doesn't cancel it for the followers.
+    Everything runs on one event loop, so the tables need no locks.
+    """
+
+    def __init__(self, timeout: float = LLM_FLIGHT_TIMEOUT):
+        self.timeout = timeout
+        self._calls: Dict[str, asyncio.Task] = {}
+        self._streams: Dict[str, _AsyncFlight] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self.stats = {"calls": 0, "shared": 0, "streams": 0, "shared_streams": 0}
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Returns ``(result, shared)``; ``shared`` is True for followers."""
+        task = self._calls.get(key)
+        shared = task is not None
+        self.stats["shared" if shared else "calls"] += 1
+        if not shared:
+            task = self._calls[key] = self._spawn(fn())
+            task.add_done_callback(lambda t: self._calls.pop(key) if self._calls.get(key) is t else None)
+            # mark the exception retrieved even if every caller has gone away
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        try:
+            result = await asyncio.wait_for(asyncio.shield(task), self.timeout if shared else None)
+        except TimeoutError:
+            raise FlightTimeout(f"shared upstream call did not finish within {self.timeout}s") from None
+        return result, shared
+
+    def stream(self, key: str, start: Callable[[], Awaitable[AsyncIterable[Any]]]) -> Tuple[AsyncIterator[Any], bool]:
+        """Returns ``(items, shared)``; every caller gets the full item sequence."""
+        flight = self._streams.get(key)
+        shared = flight is not None
+        self.stats["shared_streams" if shared else "streams"] += 1
+        if not shared:
+            flight = self._streams[key] = _AsyncFlight()
+            self._spawn(self._pump(key, flight, start))
+        return self._replay(flight), shared
+
+    async def _pump(self, key: str, flight: _AsyncFlight, start: Callable[[], Awaitable[AsyncIterable[Any]]]):
+        try:
+            async for item in await start():
+                flight.items.append(item)
+                flight.notify()
+        except BaseException as e:
+            flight.error = e
+        finally:
+            if self._streams.get(key) is flight:
+                del self._streams[key]
+            flight.done = True
+            flight.notify()
+
+    async def _replay(self, flight: _AsyncFlight) -> AsyncIterator[Any]:
+        i = 0
+        while True:
+            if i >= len(flight.items) and not flight.done:
+                try:
+                    await asyncio.wait_for(flight.changed.wait(), self.timeout)
+                except TimeoutError:
+                    raise FlightTimeout(f"shared upstream stream stalled for {self.timeout}s") from None
+                continue
+            if i >= len(flight.items):
+                break
+            batch = flight.items[i:]
+            i += len(batch)
+            for item in batch:
+                yield item
+        if flight.error is not None:
+            raise flight.error
+
+    def snapshot(self) -> Dict[str, int]:
+        s = dict(self.stats)
+        s["in_flight"] = len(self._calls) + len(self._streams)
+        return s
@@ -0,0 +1,298 @@
+"""Conversation memory, kept bounded however long a session gets.
+
+Three layers feed the answer prompt, newest to oldest:
+
+* the newest turns verbatim (``CHAT_HISTORY_MAX_TURNS``, see server/prompt.py);
+* one-line digests of the turns before them, appended to ``chat_digests``
+  a few turns at a time;
+* ``chat_sessions.history_summary``, into which the oldest digests are
+  compacted whenever ``MEMORY_COMPACT_BATCH`` more than ``MEMORY_DIGESTS``
+  are waiting. It is rewritten, not appended to, and capped at
+  ``MEMORY_SUMMARY_TOKENS``.
+
+``memory_text`` renders the summary and digests within ``MEMORY_MAX_TOKENS``,
+so the prompt stays the same size from the 20th turn to the 500th. All model
+calls run on the ``SummaryWorker`` threads, never inside a request, at the
+LLM gateway's background priority (server/llm.py).
+"""
+import os
+import re
+import queue
+import logging
+import threading
+from typing import Callable, Dict, List, Any
+
+import server.db.db as dbx
+from server import metrics
+from server.facts import SESSION_FACTS_MAX
+from server.llm import BACKGROUND, gateway
+from server.tokens import estimate_tokens, truncate_tokens
+
+# digest new turns once this many have piled up ...
+SUMMARY_EVERY_N_TURNS = int(os.getenv("SUMMARY_EVERY_N_TURNS", "3"))
+# ... or once they exceed this many tokens
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "1500"))
+SUMMARY_QUEUE_SIZE = int(os.getenv("SUMMARY_QUEUE_SIZE", "1000"))
+SUMMARY_WORKERS = int(os.getenv("SUMMARY_WORKERS", "1"))
+# newest digests kept beside the summary; the oldest are compacted in batches of MEMORY_COMPACT_BATCH
+MEMORY_DIGESTS = int(os.getenv("MEMORY_DIGESTS", "20"))
+MEMORY_COMPACT_BATCH = int(os.getenv("MEMORY_COMPACT_BATCH", "10"))
+MEMORY_DIGEST_TOKENS = int(os.getenv("MEMORY_DIGEST_TOKENS", "60"))
+MEMORY_SUMMARY_TOKENS = int(os.getenv("MEMORY_SUMMARY_TOKENS", "400"))
+# hard cap on the summary + digests put into one answer prompt
+MEMORY_MAX_TOKENS = int(os.getenv("MEMORY_MAX_TOKENS", "1000"))
+
+# turns per digest call; a long backlog (e.g. sessions from before digests) takes several
+DIGEST_BATCH = 20
+# digests per compaction call
+COMPACT_MAX_DIGESTS = 50
+# every digest not compacted yet fits in this many
+MEMORY_LOAD_DIGESTS = MEMORY_DIGESTS + MEMORY_COMPACT_BATCH
+
+EMPTY_MEMORY: Dict[str, Any] = {"summary": "", "digests": [], "facts": []}
+
+_log = logging.getLogger(__name__)
+
+_STOP = object()
+_NUMBERED = re.compile(r"^\s*(\d+)[.)]\s*(.+?)\s*$")
+
+
+def fallback_digest(turn: Dict[str, Any]) -> str:
+    """Extractive digest for a turn the model didn't digest."""
+    question = truncate_tokens(" ".join((turn["user_message"] or "").split()), MEMORY_DIGEST_TOKENS // 3)
+    answer = truncate_tokens(" ".join((turn["ai_response"] or "").split()), MEMORY_DIGEST_TOKENS * 2 // 3)
+    return f"Asked: {question} Answered: {answer}"
+
+
+def digest_turns(client, model: str, turns: List[Dict[str, Any]]) -> List[str]:
+    """One digest line per turn, from one (blocking) completion."""
+    words = MEMORY_DIGEST_TOKENS * 3 // 4
+    exchanges = "\n\n".join(
+        f"{i}. User: {t['user_message']}\nAssistant: {t['ai_response']}" for i, t in enumerate(turns, 1)
+    )
+    prompt = f"""
+    For each numbered exchange below, write one line of at most {words} words: what the user
+    asked and the facts, ICD codes or conclusions in the answer that a later question could refer to.
+    Reply with exactly {len(turns)} lines, numbered like the exchanges.
+
+    {exchanges}
+    """
+    with metrics.span("openai.digest"):
+        resp = gateway.complete(
+            client.chat.completions.create,
+            priority=BACKGROUND,
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.0,
+        )
+    metrics.count_tokens("digest", resp.usage)
+    lines = {}
+    for line in (resp.choices[0].message.content or "").splitlines():
+        m = _NUMBERED.match(line)
+        if m:
+            lines[int(m.group(1))] = m.group(2)
+    return [
+        truncate_tokens(lines[i], MEMORY_DIGEST_TOKENS) if lines.get(i) else fallback_digest(t)
+        for i, t in enumerate(turns, 1)
+    ]
+
+
+def compact_summary(client, model: str, summary: str, digests: List[str]) -> str:
+    """Rewrite ``summary`` to cover ``digests`` too, within ``MEMORY_SUMMARY_TOKENS``."""
+    words = MEMORY_SUMMARY_TOKENS * 3 // 4
+    earlier = "\n".join(f"- {d}" for d in digests)
+    prompt = f"""
+    Update the running summary of an ICD coding conversation with the older exchanges below.
+    Keep what later questions may refer to: facts the user gave about themselves or their case,
+    codes discussed and conclusions reached. Drop small talk and the order of events.
+    Write at most {words} words.
+
+    Running summary:
+    {summary or "None"}
+
+    Older exchanges:
+    {earlier}
+    """
+    with metrics.span("openai.summary"):
+        resp = gateway.complete(
+            client.chat.completions.create,
+            priority=BACKGROUND,
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.0,
+            max_tokens=MEMORY_SUMMARY_TOKENS,
+        )
+    metrics.count_tokens("summary", resp.usage)
+    return truncate_tokens(resp.choices[0].message.content or "", MEMORY_SUMMARY_TOKENS)
+
+
+def memory_text(memory: Dict[str, Any], recent_rows: List[Dict[str, Any]], max_tokens: int = MEMORY_MAX_TOKENS) -> str:
+    """Summary and digests for the prompt, at most about ``max_tokens``.
+
+    Digests of turns that are in ``recent_rows`` (sent verbatim) are skipped;
+    of the rest the newest are kept while they fit.
+    """
+    summary = truncate_tokens(memory["summary"] or "", min(MEMORY_SUMMARY_TOKENS, max_tokens))
+    remaining = max_tokens - estimate_tokens(summary)
+    oldest_recent = min((r["id"] for r in recent_rows), default=None)
+    lines = []
+    for d in reversed(memory["digests"]):
+        if oldest_recent is not None and d["chat_id"] >= oldest_recent:
+            continue
+        line = f"- {d['digest']}"
+        cost = estimate_tokens(line) + 1
+        if cost > remaining:
+            break
+        remaining -= cost
+        lines.append(line)
+    parts = [summary] if summary else []
+    if lines:
+        parts.append("Earlier exchanges:\n" + "\n".join(reversed(lines)))
+    return "\n\n".join(parts)
+
+
+def summary_due(turns: List[Dict[str, Any]], every_n_turns: int, max_tokens: int) -> bool:
+    if not turns:
+        return False
+    if len(turns) >= every_n_turns:
+        return True
+    tokens = sum(estimate_tokens(t["user_message"]) + estimate_tokens(t["ai_response"]) for t in turns)
+    return tokens >= max_tokens
+
+
+class SummaryWorker:
+    """Background maintenance of a session's digests and summary.
+
+    ``submit(session_id)`` is cheap and never blocks the request: it only
+    queues the session id. Sessions already waiting in the queue are not
+    queued twice, so a burst of turns costs one digest call. A session is
+    updated by one worker at a time; a submit while it is being updated
+    queues it once more for when that update is done. When the queue is
+    full the update is dropped; the undigested turns stay in the database
+    and are picked up by the next submit for that session.
+    """
+
+    def __init__(
+        self,
+        digest: Callable[[List[Dict[str, Any]]], List[str]],
+        compact: Callable[[str, List[str]], str],
+        every_n_turns: int = SUMMARY_EVERY_N_TURNS,
+        max_tokens: int = SUMMARY_MAX_TOKENS,
+        maxsize: int = SUMMARY_QUEUE_SIZE,
+        workers: int = SUMMARY_WORKERS,
+        keep_digests: int = MEMORY_DIGESTS,
+        compact_batch: int = MEMORY_COMPACT_BATCH,
+        on_update: Callable[[int, Dict[str, Any]], None] | None = None,
+    ):
+        self._digest = digest
+        self._compact = compact
+        # told about every memory change, e.g. to refresh a cache
+        self._on_update = on_update
+        self._every_n_turns = every_n_turns
+        self._max_tokens = max_tokens
+        self._keep_digests = keep_digests
+        self._compact_batch = compact_batch
+        self._queue: queue.Queue = queue.Queue(maxsize=maxsize)
+        # sessions in the queue, being updated, and submitted again while being updated
+        self._pending: set[int] = set()
+        self._running: set[int] = set()
+        self._again: set[int] = set()
+        self._lock = threading.Lock()
+        # notified when nothing is queued or being updated
+        self._idle = threading.Condition(self._lock)
+        self._threads = [
+            threading.Thread(target=self._run, name=f"summary-worker-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        self._started = False
+
+    def start(self):
+        if not self._started:
+            self._started = True
+            for t in self._threads:
+                t.start()
+
+    def submit(self, session_id: int) -> bool:
+        with self._lock:
+            if session_id in self._running:
+                self._again.add(session_id)
+                return True
+            return self._enqueue(session_id)
+
+    def _enqueue(self, session_id: int) -> bool:
+        # called with the lock held
+        if session_id in self._pending:
+            return True
+        try:
+            self._queue.put_nowait(session_id)
+        except queue.Full:
+            return False
+        self._pending.add(session_id)
+        return True
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    def shutdown(self, timeout: float | None = 30.0):
+        """Finish every queued update, then stop the workers."""
+        if not self._started:
+            return
+        # updates queue their session again, so wait for them before the stop markers
+        with self._idle:
+            self._idle.wait_for(lambda: not self._pending and not self._running, timeout)
+        for _ in self._threads:
+            self._queue.put(_STOP)
+        for t in self._threads:
+            t.join(timeout)
+
+    def _run(self):
+        while True:
+            session_id = self._queue.get()
+            if session_id is _STOP:
+                return
+            with self._lock:
+                self._pending.discard(session_id)
+                self._running.add(session_id)
+            try:
+                self.process(session_id)
+            except Exception:
+                _log.exception("Summary update of session %s failed", session_id)
+            finally:
+                with self._lock:
+                    self._running.discard(session_id)
+                    if session_id in self._again:
+                        self._again.discard(session_id)
+                        self._enqueue(session_id)
+                    if not self._pending and not self._running:
+                        self._idle.notify_all()
+
+    def process(self, session_id: int):
+        state = dbx.get_memory_state(session_id)
+        if state is None:
+            return
+        changed = False
+        turns = dbx.get_chats_after(session_id, state["digest_chat_id"], DIGEST_BATCH)
+        if summary_due(turns, self._every_n_turns, self._max_tokens):
+            while turns:
+                dbx.add_digests(session_id, list(zip((t["id"] for t in turns), self._digest(turns))))
+                state["digests"] += len(turns)
+                changed = True
+                if len(turns) < DIGEST_BATCH:
+                    break
+                turns = dbx.get_chats_after(session_id, turns[-1]["id"], DIGEST_BATCH)
+
+        summary, through = state["history_summary"] or "", state["summary_chat_id"]
+        while state["digests"] >= self._keep_digests + self._compact_batch:
+            old = dbx.get_digests(session_id, through, min(state["digests"] - self._keep_digests, COMPACT_MAX_DIGESTS))
+            if not old:
+                break
+            summary = self._compact(summary, [d["digest"] for d in old])
+            through = old[-1]["chat_id"]
+            dbx.update_session_summary(session_id, summary, through_chat_id=through)
+            state["digests"] -= len(old)
+            changed = True
+
+        if changed and self._on_update:
+            memory = dbx.get_memory(session_id, self._keep_digests + self._compact_batch, SESSION_FACTS_MAX)
+            if memory is not None:
+                self._on_update(session_id, memory)
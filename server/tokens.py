@@ -0,0 +1,29 @@
+from typing import Dict, Iterable
+
+# Rough OpenAI-style estimate (~4 characters per token for English text).
+# Good enough for budgeting; no tokenizer dependency needed.
+CHARS_PER_TOKEN = 4
+# per-message framing overhead of the chat completions format
+MESSAGE_OVERHEAD = 4
+
+
+def estimate_tokens(text: str | None) -> int:
+    if not text:
+        return 0
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def estimate_message_tokens(messages: Iterable[Dict[str, str]]) -> int:
+    return sum(estimate_tokens(m.get("content")) + MESSAGE_OVERHEAD for m in messages)
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """``text`` cut to about ``max_tokens`` at a word boundary."""
+    limit = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    cut = text[:limit - 1]
+    space = cut.rfind(" ")
+    if space > limit // 2:
+        cut = cut[:space]
+    return cut.rstrip() + "…"
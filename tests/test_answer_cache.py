@@ -0,0 +1,50 @@
+import pytest
+
+from server.answer_cache import disease_phrase, intent_key
+from server.icd import CodeIndex
+
+INDEX = CodeIndex([
+    ("J18", "Pneumonia, unspecified organism"),
+    ("J18.9", "Pneumonia, unspecified organism"),
+    ("E11.9", "Type 2 diabetes mellitus without complications"),
+])
+
+
+@pytest.mark.parametrize("message", [
+    "explain the subcategories",
+    "what is the treatment?",
+    "explain that",
+    "explain the first one",
+    "codes for that",
+    "codes for it",
+    "what are the symptoms?",
+    "describe these",
+    "explain the second one in more detail",
+])
+def test_follow_ups_bypass_the_cache(message):
+    assert intent_key(message, INDEX) is None
+    assert disease_phrase(message) is None
+
+
+@pytest.mark.parametrize("message", ["what is my name?", "what did we discuss earlier?", "explain my diagnosis"])
+def test_personal_questions_bypass_the_cache(message):
+    assert intent_key(message, INDEX) is None
+
+
+@pytest.mark.parametrize("message, key", [
+    ("what is pneumonia?", "disease:pneumonia"),
+    ("ICD code for type 2 diabetes", "disease:type 2 diabetes"),
+    ("what is the treatment of pneumonia?", "disease:treatment of pneumonia"),
+    ("J18.9", "code:J189"),
+    ("explain icd-10 j18.9", "code:J189"),
+])
+def test_named_entities_are_cacheable(message, key):
+    assert intent_key(message, INDEX) == key
+
+
+def test_diseases_missing_from_the_code_table_bypass_the_cache():
+    assert intent_key("what is gout?", INDEX) is None
+    assert disease_phrase("what is gout?") == "gout"
+    # without a code table only code questions are cached
+    assert intent_key("what is pneumonia?", CodeIndex([])) is None
+    assert intent_key("J18.9", CodeIndex([])) == "code:J189"
@@ -0,0 +1,35 @@
+"""Data routes answer 401 without a login."""
+import asyncio
+
+import pytest
+
+PATHS = ["/feedback/stats", "/cache/stats"]
+
+
+@pytest.mark.parametrize("path", PATHS)
+def test_flask_requires_login(path):
+    from flask import Flask
+
+    import server.backend as backend
+
+    app = Flask(__name__)
+    app.secret_key = "test"
+    app.register_blueprint(backend.bp)
+    assert app.test_client().get(path).status_code == 401
+
+
+@pytest.mark.parametrize("path", PATHS)
+def test_asgi_requires_login(path):
+    pytest.importorskip("quart")
+    from quart import Quart
+
+    import server.asgi as asgi
+
+    app = Quart(__name__)
+    app.secret_key = "test"
+    app.register_blueprint(asgi.bp)
+
+    async def status():
+        return (await app.test_client().get(path)).status_code
+
+    assert asyncio.run(status()) == 401
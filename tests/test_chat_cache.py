@@ -0,0 +1,138 @@
+"""Only answers to prompts without session context are stored in the answer cache."""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from server import handlers
+from server.summary import EMPTY_MEMORY
+
+QUESTION = "what is pneumonia?"
+ANSWER = "Pneumonia is an infection of the lungs."
+USAGE = SimpleNamespace(prompt_tokens=20, completion_tokens=8, total_tokens=28)
+
+FRESH = {"memory": EMPTY_MEMORY, "recent": []}
+EARLIER_TURN = {"memory": EMPTY_MEMORY, "recent": [
+    {"id": 3, "user_message": "my patient is 4 years old", "ai_response": "Noted.", "created_at": None},
+]}
+WITH_FACTS = {"memory": {**EMPTY_MEMORY, "facts": [{"kind": "name", "key": "name", "value": "Alex"}]}, "recent": []}
+WITH_SUMMARY = {"memory": {**EMPTY_MEMORY, "summary": "The user codes pediatric cases."}, "recent": []}
+WITH_DIGESTS = {"memory": {**EMPTY_MEMORY, "digests": [{"chat_id": 2, "digest": "Asked about J18.9."}]}, "recent": []}
+
+
+class FakeCache:
+    def __init__(self):
+        self.puts = []
+
+    def key_for(self, message):
+        return "model:v:disease:pneumonia"
+
+    def get(self, key):
+        return None
+
+    def put(self, key, response, usage=None):
+        self.puts.append((key, response))
+
+
+def _completion():
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=ANSWER))], usage=USAGE)
+
+
+def _chunks():
+    yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=ANSWER[:10]))], usage=None)
+    yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=ANSWER[10:]))], usage=None)
+    yield SimpleNamespace(choices=[], usage=USAGE)
+
+
+def _client(create):
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+
+def _patch(monkeypatch, module, context, cache):
+    monkeypatch.setattr(module, "answer_cache", cache)
+    monkeypatch.setattr(module.user_context, "owns", lambda user_id, session_id: True)
+    monkeypatch.setattr(module, "load_chat_context", context)
+    monkeypatch.setattr(module, "chat_context", context)
+    monkeypatch.setattr(module, "finish_chat", lambda user_id, session_id, message, answer: (1, session_id))
+    monkeypatch.setattr(handlers, "code_context", lambda message: None)
+    monkeypatch.setattr(handlers, "guideline_context", lambda message: None)
+    monkeypatch.setattr(module, "direct_answer", lambda message: None)
+
+
+@pytest.fixture
+def flask_client(monkeypatch):
+    from flask import Flask
+
+    import server.backend as backend
+
+    def create(**kwargs):
+        return _chunks() if kwargs.get("stream") else _completion()
+
+    monkeypatch.setattr(backend, "get_client", lambda: _client(create))
+    app = Flask(__name__)
+    app.secret_key = "test"
+    app.register_blueprint(backend.bp)
+    client = app.test_client()
+    with client.session_transaction() as s:
+        s["user_id"], s["username"] = 1, "alice"
+    return backend, client
+
+
+@pytest.mark.parametrize("path", ["/chat", "/chat/stream"])
+@pytest.mark.parametrize("context, cached", [
+    (FRESH, True), (EARLIER_TURN, False), (WITH_FACTS, False), (WITH_SUMMARY, False), (WITH_DIGESTS, False),
+])
+def test_flask_caches_context_free_answers_only(flask_client, monkeypatch, path, context, cached):
+    backend, client = flask_client
+    cache = FakeCache()
+    _patch(monkeypatch, backend, lambda user_id, session_id: context, cache)
+    resp = client.post(path, json={"message": QUESTION, "session_id": 7})
+    assert resp.status_code == 200
+    assert ANSWER[:10] in resp.get_data(as_text=True)
+    assert cache.puts == ([("model:v:disease:pneumonia", ANSWER)] if cached else [])
+
+
+@pytest.mark.parametrize("path", ["/chat", "/chat/stream"])
+@pytest.mark.parametrize("context, cached", [
+    (FRESH, True), (EARLIER_TURN, False), (WITH_FACTS, False), (WITH_SUMMARY, False), (WITH_DIGESTS, False),
+])
+def test_asgi_caches_context_free_answers_only(monkeypatch, path, context, cached):
+    pytest.importorskip("quart")
+    from quart import Quart
+
+    import server.asgi as asgi
+
+    async def create(**kwargs):
+        if not kwargs.get("stream"):
+            return _completion()
+
+        async def chunks():
+            for chunk in _chunks():
+                yield chunk
+        return chunks()
+
+    async def load(user_id, session_id):
+        return context
+
+    async def finish(user_id, session_id, message, answer):
+        return 1, session_id
+
+    cache = FakeCache()
+    _patch(monkeypatch, asgi, load, cache)
+    monkeypatch.setattr(asgi, "finish_chat", finish)
+    monkeypatch.setattr(asgi, "get_aclient", lambda: _client(create))
+    app = Quart(__name__)
+    app.secret_key = "test"
+    app.register_blueprint(asgi.bp)
+
+    async def run():
+        client = app.test_client()
+        async with client.session_transaction() as s:
+            s["user_id"], s["username"] = 1, "alice"
+        resp = await client.post(path, json={"message": QUESTION, "session_id": 7})
+        return resp.status_code, await resp.get_data(as_text=True)
+
+    status, body = asyncio.run(run())
+    assert status == 200
+    assert ANSWER[:10] in body
+    assert cache.puts == ([("model:v:disease:pneumonia", ANSWER)] if cached else [])
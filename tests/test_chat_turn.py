@@ -0,0 +1,169 @@
+"""Statements a chat turn runs before and after the model call."""
+import asyncio
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import pytest
+
+from server.db.db import (
+    INSERT_CHAT_SQL, LOAD_CHAT_TURN_SQL, RECENT_HISTORY_SQL, RESTORE_SESSION_SQL,
+)
+from server.summary import EMPTY_MEMORY
+
+CREATE_SESSION_SQL = "INSERT INTO chat_sessions (user_id, session_name) VALUES (%s, %s) RETURNING id"
+ANSWER = "J18.9 is pneumonia, unspecified organism."
+USAGE = SimpleNamespace(prompt_tokens=20, completion_tokens=8, total_tokens=28)
+
+
+class FakeDB:
+    """Answers the chat path's statements and records them."""
+
+    def __init__(self, archived=False):
+        self.archived = archived
+        self.statements = []
+
+    def run(self, sql):
+        self.statements.append(sql)
+        if sql == CREATE_SESSION_SQL:
+            return {"id": 5}
+        if sql == RECENT_HISTORY_SQL:
+            return {"recent": [], "archived": self.archived}
+        if sql == RESTORE_SESSION_SQL:
+            self.archived = False
+            return {"restored": 1}
+        if sql == LOAD_CHAT_TURN_SQL:
+            recent = [{"id": 3, "user_message": "hi", "ai_response": "Hello."}]
+            return {"memory": EMPTY_MEMORY, "recent": recent, "archived": self.archived}
+        if sql == INSERT_CHAT_SQL:
+            return {"id": 11}
+        raise AssertionError(f"unexpected statement: {sql}")
+
+    def connect(self):
+        db = self
+
+        class Cursor:
+            def __init__(self, cursor_factory=None):
+                self.dicts = cursor_factory is not None
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def execute(self, sql, params=None):
+                self.row = db.run(sql)
+
+            def fetchone(self):
+                return self.row if self.dicts else tuple(self.row.values())
+
+        class Connection:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def cursor(self, cursor_factory=None):
+                return Cursor(cursor_factory)
+
+        @contextmanager
+        def get_connection():
+            yield Connection()
+
+        return get_connection
+
+
+class FakeCache:
+    def key_for(self, message):
+        return None
+
+
+def _completion():
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=ANSWER))], usage=USAGE)
+
+
+def _patch(monkeypatch, module):
+    monkeypatch.setattr(module, "answer_cache", FakeCache())
+    monkeypatch.setattr(module, "summary_worker", SimpleNamespace(submit=lambda session_id: None))
+    monkeypatch.setattr(module, "direct_answer", lambda message: None)
+    monkeypatch.setattr(module.handlers, "code_context", lambda message: None)
+    monkeypatch.setattr(module.handlers, "guideline_context", lambda message: None)
+
+
+# archived since its memory was cached: the turn restores it before the model call
+@pytest.mark.parametrize("archived, reads", [
+    (False, [RECENT_HISTORY_SQL]),
+    (True, [RECENT_HISTORY_SQL, LOAD_CHAT_TURN_SQL, RESTORE_SESSION_SQL, LOAD_CHAT_TURN_SQL]),
+])
+def test_flask_first_turn_of_a_new_session(monkeypatch, archived, reads):
+    from flask import Flask
+
+    import server.backend as backend
+
+    db = FakeDB()
+    seen = []
+
+    def create(**kwargs):
+        seen.extend(db.statements)
+        return _completion()
+
+    _patch(monkeypatch, backend)
+    monkeypatch.setattr(backend.dbx, "get_connection", db.connect())
+    monkeypatch.setattr(backend, "get_client", lambda: SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create))))
+    app = Flask(__name__)
+    app.secret_key = "test"
+    app.register_blueprint(backend.bp)
+    client = app.test_client()
+    with client.session_transaction() as s:
+        s["user_id"], s["username"] = 1, "alice"
+
+    session_id = client.post("/sessions", json={}).get_json()["session_id"]
+    db.statements.clear()
+    db.archived = archived
+    resp = client.post("/chat", json={"message": "what is J18.9 used for?", "session_id": session_id})
+    assert resp.status_code == 200
+    assert seen == reads
+    assert db.statements == reads + [INSERT_CHAT_SQL]
+
+
+@pytest.mark.parametrize("archived, reads", [
+    (False, [RECENT_HISTORY_SQL]),
+    (True, [RECENT_HISTORY_SQL, LOAD_CHAT_TURN_SQL, RESTORE_SESSION_SQL, LOAD_CHAT_TURN_SQL]),
+])
+def test_asgi_first_turn_of_a_new_session(monkeypatch, archived, reads):
+    pytest.importorskip("quart")
+    from quart import Quart
+
+    import server.asgi as asgi
+
+    db = FakeDB()
+    seen = []
+
+    async def fetchone(sql, params):
+        return db.run(sql)
+
+    async def create(**kwargs):
+        seen.extend(db.statements)
+        return _completion()
+
+    _patch(monkeypatch, asgi)
+    monkeypatch.setattr(asgi.adb, "_fetchone", fetchone)
+    monkeypatch.setattr(asgi, "get_aclient", lambda: SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create))))
+    app = Quart(__name__)
+    app.secret_key = "test"
+    app.register_blueprint(asgi.bp)
+
+    async def run():
+        client = app.test_client()
+        async with client.session_transaction() as s:
+            s["user_id"], s["username"] = 1, "alice"
+        session_id = (await (await client.post("/sessions", json={})).get_json())["session_id"]
+        db.statements.clear()
+        db.archived = archived
+        resp = await client.post("/chat", json={"message": "what is J18.9 used for?", "session_id": session_id})
+        return resp.status_code
+
+    assert asyncio.run(run()) == 200
+    assert seen == reads
+    assert db.statements == reads + [INSERT_CHAT_SQL]
@@ -0,0 +1,144 @@
+"""/feedback only queues clicks on the caller's own chats; the buffer writes them in bulk."""
+import asyncio
+import time
+
+import pytest
+
+from server.feedback import FeedbackBuffer
+
+# chat id -> (owner, session)
+CHATS = {10: (1, 7), 20: (2, 8)}
+
+
+def chat_session(chat_id, user_id):
+    owner, session_id = CHATS.get(chat_id, (None, None))
+    return session_id if owner == user_id else None
+
+
+CASES = [
+    ({"chat_id": 10, "feedback": "liked"}, 202, [(10, 7, "liked")]),
+    # the session named by the client is ignored
+    ({"chat_id": 10, "feedback": "disliked", "session_id": 8}, 202, [(10, 7, "disliked")]),
+    ({"chat_id": 20, "feedback": "liked", "session_id": 7}, 404, []),
+    ({"chat_id": 99, "feedback": "liked"}, 404, []),
+    ({"chat_id": True, "feedback": "liked"}, 400, []),
+    ({"chat_id": "10", "feedback": "liked"}, 400, []),
+    ({"chat_id": 10, "feedback": "love"}, 400, []),
+]
+
+
+def _buffer():
+    applied = []
+    return FeedbackBuffer(applied.extend), applied
+
+
+@pytest.mark.parametrize("body, status, applied", CASES)
+def test_flask_feedback(monkeypatch, body, status, applied):
+    from flask import Flask
+
+    import server.backend as backend
+
+    buffer, rows = _buffer()
+    monkeypatch.setattr(backend, "feedback_buffer", buffer)
+    monkeypatch.setattr(backend.dbx, "get_chat_session", chat_session)
+    app = Flask(__name__)
+    app.secret_key = "test"
+    app.register_blueprint(backend.bp)
+    client = app.test_client()
+    with client.session_transaction() as s:
+        s["user_id"], s["username"] = 1, "alice"
+
+    assert client.post("/feedback", json=body).status_code == status
+    buffer.flush()
+    assert rows == applied
+
+
+@pytest.mark.parametrize("body, status, applied", CASES)
+def test_asgi_feedback(monkeypatch, body, status, applied):
+    pytest.importorskip("quart")
+    from quart import Quart
+
+    import server.asgi as asgi
+
+    async def get_chat_session(chat_id, user_id):
+        return chat_session(chat_id, user_id)
+
+    buffer, rows = _buffer()
+    monkeypatch.setattr(asgi, "feedback_buffer", buffer)
+    monkeypatch.setattr(asgi.adb, "get_chat_session", get_chat_session)
+    app = Quart(__name__)
+    app.secret_key = "test"
+    app.register_blueprint(asgi.bp)
+
+    async def post():
+        client = app.test_client()
+        async with client.session_transaction() as s:
+            s["user_id"], s["username"] = 1, "alice"
+        return (await client.post("/feedback", json=body)).status_code
+
+    assert asyncio.run(post()) == status
+    buffer.flush()
+    assert rows == applied
+
+
+def test_buffer_coalesces_clicks_per_chat():
+    buffer, applied = _buffer()
+    assert buffer.add(10, 7, "liked")
+    assert buffer.add(11, 7, "liked")
+    assert buffer.add(10, 7, "disliked")
+    assert buffer.flush() == 2
+    assert sorted(applied) == [(10, 7, "disliked"), (11, 7, "liked")]
+    assert buffer.flush() == 0
+    assert buffer.snapshot() == {"received": 3, "applied": 2, "flushes": 1, "failures": 0, "pending": 0}
+
+
+def test_full_batch_wakes_the_writer():
+    applied = []
+    buffer = FeedbackBuffer(applied.extend, flush_size=2, interval=60)
+    buffer.start()
+    buffer.add(10, 7, "liked")
+    buffer.add(11, 7, "liked")
+    deadline = time.monotonic() + 2
+    while len(applied) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert sorted(applied) == [(10, 7, "liked"), (11, 7, "liked")]
+    buffer.shutdown()
+
+
+def test_failed_flush_keeps_the_batch_and_newer_clicks_win():
+    batches = []
+
+    def apply(rows):
+        if not batches:
+            batches.append(None)
+            # a click arriving while the failing batch is being written
+            buffer.add(10, 7, "disliked")
+            raise RuntimeError("database down")
+        batches.append(sorted(rows))
+
+    buffer = FeedbackBuffer(apply)
+    buffer.add(10, 7, "liked")
+    buffer.add(11, 7, "liked")
+    with pytest.raises(RuntimeError):
+        buffer.flush()
+    assert buffer.pending() == 2
+    assert buffer.flush() == 2
+    assert batches[1] == [(10, 7, "disliked"), (11, 7, "liked")]
+    assert buffer.snapshot()["failures"] == 1
+
+
+def test_full_buffer_refuses_new_chats():
+    buffer = FeedbackBuffer(lambda rows: None, max_pending=1)
+    assert buffer.add(10, 7, "liked")
+    assert not buffer.add(11, 7, "liked")
+    # another click on a buffered chat still fits
+    assert buffer.add(10, 7, "disliked")
+
+
+def test_shutdown_flushes_what_is_left():
+    applied = []
+    buffer = FeedbackBuffer(applied.extend, interval=60)
+    buffer.start()
+    buffer.add(10, 7, "liked")
+    buffer.shutdown()
+    assert applied == [(10, 7, "liked")]
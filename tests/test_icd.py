@@ -0,0 +1,107 @@
+"""Exact, prefix, range and hierarchy lookups in the ICD-10-CM code index."""
+import pytest
+
+from server.icd import CodeIndex, _parse_line, code_context, direct_answer, format_code, normalize_code
+
+CODES = [
+    ("J18", "Pneumonia, unspecified organism"),
+    ("J18.0", "Bronchopneumonia, unspecified organism"),
+    ("J18.9", "Pneumonia, unspecified organism"),
+    ("J20", "Acute bronchitis"),
+    ("J20.9", "Acute bronchitis, unspecified"),
+    ("Z80", "Family history of primary malignant neoplasm"),
+    ("Z87", "Personal history of other diseases and conditions"),
+    ("Z87.8", "Personal history of other specified conditions"),
+    ("Z87.89", "Personal history of other specified conditions"),
+    ("Z87.891", "Personal history of nicotine dependence"),
+]
+
+
+@pytest.fixture
+def index():
+    return CodeIndex(CODES)
+
+
+def test_codes_are_normalized_and_formatted():
+    assert normalize_code(" j18.9 ") == "J189"
+    assert format_code("J189") == "J18.9"
+    assert format_code("J18") == "J18"
+
+
+def test_code_table_lines_are_parsed():
+    assert _parse_line("J18.9\tPneumonia, unspecified organism\n") == ("J189", "Pneumonia, unspecified organism")
+    assert _parse_line("A000    Cholera due to Vibrio cholerae 01, biovar cholerae") == (
+        "A000", "Cholera due to Vibrio cholerae 01, biovar cholerae",
+    )
+    assert _parse_line("   \n") is None
+
+
+def test_exact_and_prefix_lookups(index):
+    assert index.get("j18.9").title == "Pneumonia, unspecified organism"
+    assert index.get("J18.1") is None
+    assert [e.display for e in index.prefix("J18")] == ["J18", "J18.0", "J18.9"]
+    assert [e.display for e in index.prefix("J", limit=2)] == ["J18", "J18.0"]
+
+
+def test_range_includes_the_end_codes_subcodes(index):
+    assert [e.display for e in index.range("Z80", "Z87", depth=3)] == ["Z80", "Z87"]
+    assert index.range("Z80", "Z87")[-1].display == "Z87.891"
+    assert index.range("K00", "K99") == []
+
+
+def test_hierarchy(index):
+    assert [e.display for e in index.parents("Z87.891")] == ["Z87", "Z87.8", "Z87.89"]
+    assert [e.display for e in index.children("J18")] == ["J18.0", "J18.9"]
+    # Z87.8 has only a grandchild under Z87.89
+    assert [e.display for e in index.children("Z87.8")] == ["Z87.89"]
+    assert index.children("J20.9") == []
+
+
+def test_find_title_and_codes(index):
+    assert index.find_title(["acute", "bronchitis"]).display == "J20"
+    assert index.find_title(["bronchitis", "nicotine"]) is None
+    assert [e.display for e in index.find_codes("J18.9 vs j189 vs J18.1 vs Z87.891")] == ["J18.9", "Z87.891"]
+
+
+@pytest.mark.parametrize("message, expected", [
+    ("What is the title of J18.9?", "J18.9 — Pneumonia, unspecified organism\n  ↳ within J18 — Pneumonia, unspecified organism"),
+    ("parent of J20", "J20 — Acute bronchitis is a top-level category."),
+    ("children of J20.9", "J20.9 — Acute bronchitis, unspecified has no subcodes; it is a billable code."),
+    ("list the subcodes of J18", "Subcodes of J18 — Pneumonia, unspecified organism:\n\n"
+                                 "- J18.0 — Bronchopneumonia, unspecified organism\n"
+                                 "- J18.9 — Pneumonia, unspecified organism"),
+    ("Z87-Z80", "ICD-10-CM codes Z80–Z87:\n\n"
+                "- Z80 — Family history of primary malignant neoplasm\n"
+                "- Z87 — Personal history of other diseases and conditions"),
+])
+def test_direct_answer(index, message, expected):
+    assert direct_answer(message, index) == expected
+
+
+@pytest.mark.parametrize("message", [
+    "title of J18.1",  # unknown code
+    "how do I code pneumonia with sepsis?",
+    "what is the title of J18.9 and when is it used?",
+])
+def test_questions_for_the_model_are_not_answered_directly(index, message):
+    assert direct_answer(message, index) is None
+
+
+def test_no_code_table_means_no_direct_answer_or_context():
+    assert direct_answer("title of J18.9", CodeIndex([])) is None
+    assert code_context("J18.9", CodeIndex([])) is None
+
+
+def test_code_context_lists_mentioned_codes_and_ranges(index):
+    context = code_context("Is J18.9 in J18-Z87? X99.9?", index)
+    assert context.splitlines() == [
+        "Verified ICD-10-CM code table entries (use these exact titles):",
+        "J18.9 — Pneumonia, unspecified organism",
+        "  ↳ within J18 — Pneumonia, unspecified organism",
+        "J18 — Pneumonia, unspecified organism",
+        "Z87 — Personal history of other diseases and conditions",
+        # categories inside the range that weren't named
+        "J20 — Acute bronchitis",
+        "Z80 — Family history of primary malignant neoplasm",
+    ]
+    assert code_context("no codes here", index) is None
@@ -0,0 +1,196 @@
+"""Admission by the LLM gateway: token buckets, priorities and LLMBusy → 429."""
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+import server.llm as llm
+from server.llm import BACKGROUND, BACKGROUND_POLL, INTERACTIVE, LLMBusy, LLMGateway, TokenBucket
+
+MESSAGES = [{"role": "user", "content": "what is J18.9?"}]
+
+
+def _rate_limited(retry_after="7"):
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(429, headers={"retry-after": retry_after}, request=request)
+    return openai.RateLimitError("rate limited", response=response, body=None)
+
+
+def _no_wait_retrying(gateway):
+    """``gateway._retrying`` without the backoff sleeps."""
+    original = gateway._retrying
+
+    def retrying(cls, priority, deadline):
+        r = original(cls, priority, deadline)
+        r.wait = lambda retry_state: 0
+        return r
+
+    return retrying
+
+
+def _gateway(**kwargs):
+    # one request a second, at most one at once
+    return LLMGateway(**{"requests_per_min": 60, "tokens_per_min": 600_000, "burst_seconds": 1, **kwargs})
+
+
+def test_token_bucket_refills_up_to_capacity():
+    bucket = TokenBucket(per_min=60, capacity=2)
+    bucket.take(3)
+    assert bucket.level == -1
+    assert bucket.wait_for(1) == pytest.approx(2.0)
+    bucket.refill(bucket._updated + 10)
+    assert bucket.level == 2
+    # a call larger than the bucket waits for a full bucket, not forever
+    assert bucket.wait_for(50) == 0
+
+
+def test_interactive_calls_reserve_in_order_and_are_turned_away_past_the_deadline():
+    gateway = _gateway()
+    now = llm.time.monotonic()
+    assert gateway._reserve(10, now + 10) == 0
+    wait = gateway._reserve(10, now + 10)
+    assert wait == pytest.approx(1.0, abs=0.05)
+    # the next one would have to wait about 2s
+    with pytest.raises(LLMBusy) as busy:
+        gateway._reserve(10, now + 1.5)
+    assert busy.value.retry_after == pytest.approx(2.0, abs=0.05)
+    assert gateway.snapshot()["rejected"] == 1
+
+
+def test_full_queue_turns_waiting_calls_away():
+    gateway = _gateway(queue_size=1)
+    deadline = llm.time.monotonic() + 60
+    gateway._reserve(10, deadline)
+    gateway._reserve(10, deadline)  # waits; the queue is now full
+    with pytest.raises(LLMBusy):
+        gateway._reserve(10, deadline)
+    assert gateway.queue_depth() == {(INTERACTIVE,): 1, (BACKGROUND,): 0}
+
+
+def test_background_work_yields_to_answers_and_leaves_headroom():
+    gateway = LLMGateway(requests_per_min=600, tokens_per_min=6000, burst_seconds=10, headroom=0.25)
+    # 100 requests and 1000 tokens of capacity
+    assert gateway._try_background(100) == 0
+    gateway._waiting[INTERACTIVE] = 1
+    assert gateway._try_background(100) == BACKGROUND_POLL
+    gateway._waiting[INTERACTIVE] = 0
+    # 900 tokens left: taking 700 would leave less than the 250 kept for answers
+    assert gateway._try_background(700) > 0
+    assert gateway._reserve(700, llm.time.monotonic() + 10) == 0
+
+
+def test_usage_corrects_the_estimate():
+    gateway = _gateway()
+    before = gateway.snapshot()["tokens_available"]
+    result = gateway.complete(
+        lambda **kwargs: SimpleNamespace(usage=SimpleNamespace(total_tokens=20)), model="m", messages=MESSAGES,
+    )
+    assert result.usage.total_tokens == 20
+    assert gateway.snapshot()["tokens_available"] == pytest.approx(before - 20, abs=1)
+
+
+def test_transient_errors_are_retried(monkeypatch):
+    gateway = _gateway(requests_per_min=6000, max_retries=2)
+    monkeypatch.setattr(gateway, "_retrying", _no_wait_retrying(gateway))
+    attempts = []
+
+    def create(**kwargs):
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise openai.APIConnectionError(request=httpx.Request("POST", "https://api.openai.com"))
+        return SimpleNamespace(usage=None)
+
+    gateway.complete(create, model="m", messages=MESSAGES)
+    assert len(attempts) == 3
+    assert gateway.snapshot()["retries"] == 2
+
+
+def test_upstream_429_becomes_llm_busy_and_pauses_admission():
+    gateway = _gateway(requests_per_min=6000, max_retries=0)
+
+    def create(**kwargs):
+        raise _rate_limited("30")
+
+    with pytest.raises(LLMBusy) as busy:
+        gateway.complete(create, model="m", messages=MESSAGES)
+    assert busy.value.retry_after == 30
+    # callers after it can't be admitted within their deadline, so they are
+    # turned away here instead of piling onto OpenAI
+    with pytest.raises(LLMBusy):
+        gateway.complete(lambda **kwargs: None, model="m", messages=MESSAGES)
+
+
+def test_async_upstream_429_becomes_llm_busy():
+    gateway = _gateway(requests_per_min=6000, max_retries=0)
+
+    async def create(**kwargs):
+        raise _rate_limited("3")
+
+    async def run():
+        with pytest.raises(LLMBusy) as busy:
+            await gateway.complete_async(create, model="m", messages=MESSAGES)
+        return busy.value.retry_after
+
+    assert asyncio.run(run()) == 3
+
+
+class BusyGateway:
+    def complete(self, create, **kwargs):
+        raise LLMBusy(2.3)
+
+    async def complete_async(self, create, **kwargs):
+        raise LLMBusy(2.3)
+
+
+TURN = {"session_id": 7, "user_message": "q", "messages": MESSAGES, "context_tokens": 5, "cache_key": None}
+
+
+def test_flask_llm_busy_is_429_with_retry_after(monkeypatch):
+    from flask import Flask
+
+    import server.backend as backend
+
+    monkeypatch.setattr(backend, "gateway", BusyGateway())
+    monkeypatch.setattr(backend, "prepare_chat", lambda: (dict(TURN), None))
+    monkeypatch.setattr(backend, "get_client", lambda: SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=None))))
+    app = Flask(__name__)
+    app.secret_key = "test"
+    app.register_blueprint(backend.bp)
+    client = app.test_client()
+    with client.session_transaction() as s:
+        s["user_id"], s["username"] = 1, "alice"
+
+    resp = client.post("/chat", json={"message": "q"})
+    assert resp.status_code == 429
+    assert resp.headers["Retry-After"] == "3"
+    assert resp.get_json()["retry_after"] == 2.3
+    body = client.post("/chat/stream", json={"message": "q"}).get_data(as_text=True)
+    assert 'event: error\ndata: {"error": "model is busy, try again", "retry_after": 2.3}' in body
+
+
+def test_asgi_llm_busy_is_429_with_retry_after(monkeypatch):
+    pytest.importorskip("quart")
+    from quart import Quart
+
+    import server.asgi as asgi
+
+    async def prepare_chat():
+        return dict(TURN), None
+
+    monkeypatch.setattr(asgi, "gateway", BusyGateway())
+    monkeypatch.setattr(asgi, "prepare_chat", prepare_chat)
+    monkeypatch.setattr(asgi, "get_aclient", lambda: SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=None))))
+    app = Quart(__name__)
+    app.secret_key = "test"
+    app.register_blueprint(asgi.bp)
+
+    async def run():
+        client = app.test_client()
+        async with client.session_transaction() as s:
+            s["user_id"], s["username"] = 1, "alice"
+        resp = await client.post("/chat", json={"message": "q"})
+        return resp.status_code, resp.headers["Retry-After"], (await resp.get_json())["retry_after"]
+
+    assert asyncio.run(run()) == (429, "3", 2.3)
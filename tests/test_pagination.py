@@ -0,0 +1,77 @@
+"""Keyset cursors and page limits."""
+import asyncio
+from datetime import datetime
+
+import pytest
+
+from server.pagination import MAX_PAGE_SIZE, decode_cursor, encode_cursor, parse_limit, split_page
+
+TS = datetime(2025, 3, 1, 12, 30, 15, 123456)
+
+
+def test_cursor_round_trip():
+    cursor = encode_cursor(TS, 42)
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == (TS, 42)
+    assert decode_cursor(None) is None
+    assert decode_cursor("") is None
+
+
+@pytest.mark.parametrize("cursor", ["not a cursor", "!!!", encode_cursor(TS, 1)[:-3], "MjAyNS0wMy0wMQ", "/w"])
+def test_malformed_cursor_is_rejected(cursor):
+    with pytest.raises(ValueError, match="invalid cursor"):
+        decode_cursor(cursor)
+
+
+def test_parse_limit():
+    assert parse_limit(None, 20) == 20
+    assert parse_limit("5", 20) == 5
+    assert parse_limit("100000", 20) == MAX_PAGE_SIZE
+    for bad in ("0", "-1", "ten"):
+        with pytest.raises(ValueError):
+            parse_limit(bad, 20)
+
+
+def test_split_page():
+    rows = [{"id": i, "created_at": datetime(2025, 1, i)} for i in (5, 4, 3)]
+    page, cursor = split_page(rows, 2, "created_at")
+    assert [r["id"] for r in page] == [5, 4]
+    assert decode_cursor(cursor) == (datetime(2025, 1, 4), 4)
+    assert split_page(rows, 3, "created_at") == (rows, None)
+
+
+@pytest.mark.parametrize("query", ["before=garbage", "limit=0", "limit=x"])
+def test_flask_bad_page_args_are_400(query):
+    from flask import Flask
+
+    import server.backend as backend
+
+    app = Flask(__name__)
+    app.secret_key = "test"
+    app.register_blueprint(backend.bp)
+    client = app.test_client()
+    with client.session_transaction() as s:
+        s["user_id"], s["username"] = 1, "alice"
+    resp = client.get(f"/sessions?{query}")
+    assert resp.status_code == 400
+    assert resp.get_json()["error"]
+
+
+@pytest.mark.parametrize("query", ["before=garbage", "limit=0"])
+def test_asgi_bad_page_args_are_400(query):
+    pytest.importorskip("quart")
+    from quart import Quart
+
+    import server.asgi as asgi
+
+    app = Quart(__name__)
+    app.secret_key = "test"
+    app.register_blueprint(asgi.bp)
+
+    async def status():
+        client = app.test_client()
+        async with client.session_transaction() as s:
+            s["user_id"], s["username"] = 1, "alice"
+        return (await client.get(f"/sessions?{query}")).status_code
+
+    assert asyncio.run(status()) == 400
@@ -0,0 +1,48 @@
+import threading
+from concurrent.futures import BrokenExecutor, ThreadPoolExecutor
+
+from server.passwords import PasswordHasher
+
+
+class BrokenPool:
+    def __init__(self):
+        self.shutdowns = 0
+
+    def submit(self, fn, *args):
+        raise BrokenExecutor("a worker died")
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self.shutdowns += 1
+
+
+def test_broken_pool_is_replaced_once():
+    hasher = PasswordHasher(workers=1, method="pbkdf2:sha256:1000")
+    broken = BrokenPool()
+    hasher._executor = broken
+    created = []
+
+    def new_executor():
+        pool = ThreadPoolExecutor(1)
+        created.append(pool)
+        return pool
+
+    hasher._new_executor = new_executor
+    barrier = threading.Barrier(8)
+    results = []
+
+    def login():
+        barrier.wait()
+        results.append(hasher.hash("secret"))
+
+    threads = [threading.Thread(target=login) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(results) == 8
+    assert len(created) == 1
+    assert hasher._executor is created[0]
+    assert broken.shutdowns == 1
+    assert hasher.pending() == 0
+    hasher.shutdown()
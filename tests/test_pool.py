@@ -0,0 +1,120 @@
+"""Checkout, waiting and health checks of the psycopg2 connection pool."""
+import threading
+import time
+
+import psycopg2
+import pytest
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INTRANS
+
+from server.db.pool import ConnectionPool, PoolTimeout
+
+
+class FakeConnection:
+    def __init__(self, n):
+        self.n = n
+        self.closed = False
+        self.alive = True
+        self.status = TRANSACTION_STATUS_IDLE
+        self.rollbacks = 0
+
+    def cursor(self):
+        conn = self
+
+        class Cursor:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def execute(self, sql):
+                if not conn.alive:
+                    raise psycopg2.OperationalError("server closed the connection")
+
+        return Cursor()
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.status = TRANSACTION_STATUS_IDLE
+
+    def get_transaction_status(self):
+        return self.status
+
+    def close(self):
+        self.closed = True
+
+
+def _pool(maxconn=2, timeout=1.0, check_idle=30.0):
+    pool = ConnectionPool(minconn=1, maxconn=maxconn, timeout=timeout, check_idle=check_idle)
+    pool.opened = []
+
+    def connect():
+        conn = FakeConnection(len(pool.opened))
+        pool.opened.append(conn)
+        return conn
+
+    pool._connect = connect
+    return pool
+
+
+def test_returned_connections_are_reused():
+    pool = _pool()
+    conn = pool.getconn()
+    pool.putconn(conn)
+    assert pool.getconn() is conn
+    assert len(pool.opened) == 1
+    assert pool.stats() == {"size": 1, "idle": 0, "in_use": 1, "waiting": 0, "max": 2}
+
+
+def test_checkout_beyond_maxconn_times_out():
+    pool = _pool(maxconn=1, timeout=0.05)
+    pool.getconn()
+    started = time.monotonic()
+    with pytest.raises(PoolTimeout):
+        pool.getconn()
+    assert time.monotonic() - started >= 0.05
+    assert pool.stats()["waiting"] == 0
+    assert len(pool.opened) == 1
+
+
+def test_waiter_gets_the_returned_connection():
+    pool = _pool(maxconn=1, timeout=2.0)
+    conn = pool.getconn()
+    got = []
+    waiter = threading.Thread(target=lambda: got.append(pool.getconn()))
+    waiter.start()
+    while pool.stats()["waiting"] == 0:
+        time.sleep(0.01)
+    pool.putconn(conn)
+    waiter.join(2)
+    assert got == [conn]
+
+
+def test_closed_connection_frees_its_slot():
+    pool = _pool(maxconn=1, timeout=0.5)
+    conn = pool.getconn()
+    conn.close()
+    pool.putconn(conn)
+    assert pool.getconn() is pool.opened[1]
+    assert pool.stats()["size"] == 1
+
+
+def test_dead_idle_connection_is_replaced():
+    pool = _pool(check_idle=0.0)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    # e.g. the server restarted while it was idle
+    conn.alive = False
+    fresh = pool.getconn()
+    assert fresh is pool.opened[1]
+    assert conn.closed
+    assert pool.stats()["size"] == 1
+
+
+def test_open_transaction_is_rolled_back_on_return():
+    pool = _pool()
+    conn = pool.getconn()
+    conn.status = TRANSACTION_STATUS_INTRANS
+    pool.putconn(conn)
+    assert conn.rollbacks == 1
+    assert pool.getconn() is conn
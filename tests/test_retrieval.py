@@ -0,0 +1,91 @@
+"""BM25 ranking over guideline chunks built by server.index_guidelines."""
+
+import server.retrieval as retrieval
+from server.index_guidelines import MAX_CHUNK_CHARS, build_shard, split_sections, write_index
+from server.retrieval import GuidelineIndex, guideline_context, tokenize
+
+GUIDELINES = """## Sepsis
+Assign the code for the underlying systemic infection first. Sepsis with
+organ dysfunction is coded as severe sepsis, R65.20.
+
+## Pneumonia
+Code the organism when it is documented; otherwise assign J18.9 for
+pneumonia, unspecified organism.
+
+## Aspiration pneumonia
+Aspiration pneumonia is coded to J69.0 and not to J18.9.
+
+## Diabetes
+Use additional codes to identify insulin use. Diabetes type is assumed to
+be type 2 when not documented.
+
+## Obstetrics
+Pregnancy codes take sequencing priority over codes from other chapters.
+"""
+
+
+def _index(tmp_path, *texts):
+    shards = []
+    for n, text in enumerate(texts):
+        path = tmp_path / f"guide{n}.md"
+        path.write_text(text, encoding="utf-8")
+        shards.append(build_shard(str(path)))
+    out = tmp_path / "index"
+    write_index(str(out), shards)
+    return GuidelineIndex(str(out))
+
+
+def test_tokenize_keeps_dotted_codes_and_drops_stopwords():
+    assert tokenize("What is the code for J18.9 Pneumonia?") == ["code", "j18.9", "pneumonia"]
+
+
+def test_sections_split_on_headings_and_long_ones_on_paragraphs():
+    assert [s["heading"] for s in split_sections(GUIDELINES)] == [
+        "Sepsis", "Pneumonia", "Aspiration pneumonia", "Diabetes", "Obstetrics",
+    ]
+    para = "x" * (MAX_CHUNK_CHARS // 3)
+    long = split_sections(f"## Long\n{para}\n\n{para}\n\n{para}")
+    assert [s["heading"] for s in long] == ["Long", "Long"]
+    assert all(len(s["text"]) <= MAX_CHUNK_CHARS for s in long)
+
+
+def test_best_matching_chunk_ranks_first(tmp_path):
+    index = _index(tmp_path, GUIDELINES)
+    assert len(index) == 5
+    hits = index.search("aspiration pneumonia", k=3)
+    assert [p.heading for p in hits] == ["Aspiration pneumonia", "Pneumonia"]
+    assert hits[0].score > hits[1].score > 0
+    assert hits[0].source == "guide0.md"
+    assert [p.heading for p in index.search("severe sepsis organ dysfunction", k=1)] == ["Sepsis"]
+
+
+def test_rare_terms_outweigh_common_ones(tmp_path):
+    index = _index(tmp_path, GUIDELINES)
+    # "codes" appears in several chunks, "insulin" in one
+    assert index.search("insulin codes", k=1)[0].heading == "Diabetes"
+
+
+def test_unknown_terms_and_min_score_return_nothing(tmp_path):
+    index = _index(tmp_path, GUIDELINES)
+    assert index.search("fracture of the femur") == []
+    assert index.search("the of and") == []
+    top = index.search("pregnancy", k=1)[0]
+    assert index.search("pregnancy", k=1, min_score=top.score) == []
+
+
+def test_duplicate_chunks_from_a_reconverted_pdf_are_skipped(tmp_path):
+    index = _index(tmp_path, GUIDELINES, GUIDELINES)
+    hits = index.search("pneumonia organism", k=3)
+    assert len({p.text for p in hits}) == len(hits)
+    assert len(hits) == 2
+
+
+def test_guideline_context_formats_the_passages(tmp_path, monkeypatch):
+    index = _index(tmp_path, GUIDELINES)
+    monkeypatch.setattr(retrieval, "get_guideline_index", lambda: index)
+    monkeypatch.setattr(retrieval, "GUIDELINE_MIN_SCORE", 0.0)
+    context = guideline_context("sequencing of pregnancy codes")
+    assert context.startswith("Relevant ICD-10-CM official guideline excerpts (cite when applicable):\n\n[1] Obstetrics\n")
+    assert guideline_context("femur fracture") is None
+    monkeypatch.setattr(retrieval, "get_guideline_index", lambda: None)
+    assert guideline_context("pregnancy") is None
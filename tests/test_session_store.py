@@ -0,0 +1,90 @@
+"""A login gets a new session id; the one the browser sent stops working."""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from server.session_store import MemorySessionStore
+
+USERS = {
+    "alice": {"id": 1, "username": "alice", "password_hash": "x"},
+    "bob": {"id": 2, "username": "bob", "password_hash": "x"},
+}
+
+
+def _hasher():
+    async def verify_async(stored, password):
+        return True, None
+
+    return SimpleNamespace(verify=lambda stored, password: (True, None), verify_async=verify_async)
+
+
+def test_flask_login_issues_a_new_session_id(monkeypatch):
+    from flask import Flask
+
+    import server.backend as backend
+    import server.db.db as dbx
+    from server.session_store import ServerSideSessionInterface
+
+    monkeypatch.setattr(dbx, "get_user_by_username", USERS.get)
+    monkeypatch.setattr(backend, "hasher", _hasher())
+    monkeypatch.setattr(backend, "sessions_page", lambda user_id, limit: ([], None))
+    store = MemorySessionStore()
+    app = Flask(__name__)
+    app.secret_key = "test"
+    app.session_interface = ServerSideSessionInterface(store)
+    app.register_blueprint(backend.bp)
+
+    attacker = app.test_client()
+    assert attacker.post("/login", json={"username": "alice", "password": "pw"}).status_code == 200
+    planted = attacker.get_cookie("session").value
+
+    victim = app.test_client()
+    victim.set_cookie("session", planted)
+    assert victim.post("/login", json={"username": "bob", "password": "pw"}).status_code == 200
+    assert victim.get_cookie("session").value != planted
+    assert victim.get("/me").get_json()["id"] == 2
+    # the planted id was deleted rather than logged in as bob
+    assert attacker.get("/me").status_code == 401
+    assert len(store._sessions) == 1
+
+
+def test_asgi_login_issues_a_new_session_id(monkeypatch):
+    pytest.importorskip("quart")
+    from quart import Quart
+
+    import server.asgi as asgi
+    import server.db.async_db as adb
+
+    async def get_user_by_username(username):
+        return USERS.get(username)
+
+    async def sessions_page(user_id, limit):
+        return [], None
+
+    monkeypatch.setattr(adb, "get_user_by_username", get_user_by_username)
+    monkeypatch.setattr(asgi, "hasher", _hasher())
+    monkeypatch.setattr(asgi, "sessions_page", sessions_page)
+    store = MemorySessionStore()
+    app = Quart(__name__)
+    app.secret_key = "test"
+    app.session_interface = asgi.ServerSideSessionInterface(store)
+    app.register_blueprint(asgi.bp)
+
+    def cookie(client):
+        return next(c.value for c in client.cookie_jar if c.name == "session")
+
+    async def run():
+        attacker = app.test_client()
+        assert (await attacker.post("/login", json={"username": "alice", "password": "pw"})).status_code == 200
+        planted = cookie(attacker)
+
+        victim = app.test_client()
+        victim.set_cookie("localhost", "session", planted)
+        assert (await victim.post("/login", json={"username": "bob", "password": "pw"})).status_code == 200
+        assert cookie(victim) != planted
+        assert (await (await victim.get("/me")).get_json())["id"] == 2
+        assert (await attacker.get("/me")).status_code == 401
+
+    asyncio.run(run())
+    assert len(store._sessions) == 1
@@ -0,0 +1,191 @@
+"""Identical in-flight calls share one upstream call, its result and its exception."""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from server.singleflight import AsyncSingleFlight, FlightTimeout, SingleFlight, prompt_key
+
+CALLERS = 5
+
+
+def _wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def _concurrently(call):
+    """Start ``call`` in CALLERS threads; returns ``(outcomes, threads)``."""
+    outcomes = []
+
+    def run():
+        try:
+            outcomes.append(("ok", call()))
+        except Exception as e:
+            outcomes.append(("error", e))
+
+    threads = [threading.Thread(target=run) for _ in range(CALLERS)]
+    for t in threads:
+        t.start()
+    return outcomes, threads
+
+
+def test_prompt_key_ignores_case_and_spacing_of_the_question():
+    system = {"role": "system", "content": "You code ICD-10."}
+    a = prompt_key("m", [system, {"role": "user", "content": "What is  J18.9?"}], temperature=0.3)
+    b = prompt_key("m", [system, {"role": "user", "content": "what is j18.9? "}], temperature=0.3)
+    assert a == b
+    assert a != prompt_key("m", [system, {"role": "user", "content": "what is j18.9?"}], temperature=0.0)
+
+
+def test_concurrent_calls_share_one_result():
+    flights = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def upstream():
+        calls.append(1)
+        release.wait(2)
+        return "answer"
+
+    outcomes, threads = _concurrently(lambda: flights.do("k", upstream))
+    _wait_for(lambda: flights.snapshot()["shared"] == CALLERS - 1)
+    release.set()
+    for t in threads:
+        t.join(2)
+
+    assert len(calls) == 1
+    assert sorted(outcomes, key=lambda o: o[1][1]) == [("ok", ("answer", False))] + [("ok", ("answer", True))] * (CALLERS - 1)
+    assert flights.snapshot()["in_flight"] == 0
+
+
+def test_exception_reaches_every_waiter():
+    flights = SingleFlight()
+    release = threading.Event()
+    boom = RuntimeError("upstream failed")
+
+    def upstream():
+        release.wait(2)
+        raise boom
+
+    outcomes, threads = _concurrently(lambda: flights.do("k", upstream))
+    _wait_for(lambda: flights.snapshot()["shared"] == CALLERS - 1)
+    release.set()
+    for t in threads:
+        t.join(2)
+
+    assert outcomes == [("error", boom)] * CALLERS
+    # the failed flight is gone; the next call goes upstream again
+    assert flights.do("k", lambda: "retry") == ("retry", False)
+
+
+def test_follower_gives_up_after_the_timeout():
+    flights = SingleFlight(timeout=0.05)
+    release = threading.Event()
+    leader = threading.Thread(target=lambda: flights.do("k", lambda: release.wait(2)))
+    leader.start()
+    _wait_for(lambda: flights.snapshot()["in_flight"] == 1)
+    with pytest.raises(FlightTimeout):
+        flights.do("k", lambda: "never called")
+    release.set()
+    leader.join(2)
+
+
+def test_stream_is_replayed_to_every_caller():
+    flights = SingleFlight()
+    release = threading.Event()
+
+    def upstream():
+        yield "a"
+        release.wait(2)
+        yield "b"
+        raise RuntimeError("cut off")
+
+    results = []
+
+    def consume():
+        items, shared = flights.stream("k", upstream)
+        got = []
+        try:
+            for item in items:
+                got.append(item)
+        except RuntimeError as e:
+            got.append(str(e))
+        results.append((got, shared))
+
+    threads = [threading.Thread(target=consume) for _ in range(3)]
+    for t in threads:
+        t.start()
+    _wait_for(lambda: flights.snapshot()["shared_streams"] == 2)
+    release.set()
+    for t in threads:
+        t.join(2)
+
+    assert sorted(results, key=lambda r: r[1]) == [(["a", "b", "cut off"], False)] + [(["a", "b", "cut off"], True)] * 2
+
+
+def test_async_calls_share_one_result_and_exception():
+    async def run():
+        flights = AsyncSingleFlight()
+        calls = []
+
+        async def upstream():
+            calls.append(1)
+            await asyncio.sleep(0.02)
+            return "answer"
+
+        results = await asyncio.gather(*(flights.do("k", upstream) for _ in range(CALLERS)))
+        assert len(calls) == 1
+        assert sorted(results, key=lambda r: r[1]) == [("answer", False)] + [("answer", True)] * (CALLERS - 1)
+
+        async def failing():
+            await asyncio.sleep(0.02)
+            raise RuntimeError("upstream failed")
+
+        outcomes = await asyncio.gather(*(flights.do("f", failing) for _ in range(CALLERS)), return_exceptions=True)
+        assert all(isinstance(o, RuntimeError) and str(o) == "upstream failed" for o in outcomes)
+        assert flights.snapshot()["in_flight"] == 0
+
+    asyncio.run(run())
+
+
+def test_async_leader_cancelled_does_not_cancel_followers():
+    async def run():
+        flights = AsyncSingleFlight()
+
+        async def upstream():
+            await asyncio.sleep(0.05)
+            return "answer"
+
+        leader = asyncio.ensure_future(flights.do("k", upstream))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flights.do("k", upstream))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        assert await follower == ("answer", True)
+
+    asyncio.run(run())
+
+
+def test_async_stream_is_replayed_to_every_caller():
+    async def run():
+        flights = AsyncSingleFlight()
+
+        async def start():
+            async def items():
+                for item in ("a", "b", "c"):
+                    await asyncio.sleep(0.005)
+                    yield item
+            return items()
+
+        async def consume():
+            items, shared = flights.stream("k", start)
+            return [item async for item in items], shared
+
+        results = await asyncio.gather(*(consume() for _ in range(3)))
+        assert sorted(results, key=lambda r: r[1]) == [(["a", "b", "c"], False)] + [(["a", "b", "c"], True)] * 2
+
+    asyncio.run(run())
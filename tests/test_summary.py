@@ -0,0 +1,54 @@
+"""A session's memory is updated by one summary worker at a time."""
+import logging
+import threading
+
+from server.summary import SummaryWorker
+
+
+def _worker(process):
+    worker = SummaryWorker(digest=None, compact=None, workers=2)
+    worker.process = process
+    return worker
+
+
+def test_submit_during_an_update_runs_it_again_afterwards():
+    started, release = threading.Event(), threading.Event()
+    running, overlaps, calls = set(), [], []
+    lock = threading.Lock()
+
+    def process(session_id):
+        with lock:
+            overlaps.append(session_id in running)
+            running.add(session_id)
+            calls.append(session_id)
+        started.set()
+        release.wait(5)
+        with lock:
+            running.discard(session_id)
+
+    worker = _worker(process)
+    worker.start()
+    worker.submit(7)
+    assert started.wait(5)
+    # the idle second worker must not pick these up while 7 is being updated
+    for _ in range(3):
+        worker.submit(7)
+    assert worker.qsize() == 0
+    release.set()
+    worker.shutdown(5)
+
+    assert calls == [7, 7]
+    assert overlaps == [False, False]
+
+
+def test_failed_update_is_logged(caplog):
+    def process(session_id):
+        raise RuntimeError("model down")
+
+    worker = _worker(process)
+    worker.start()
+    with caplog.at_level(logging.ERROR, logger="server.summary"):
+        worker.submit(3)
+        worker.shutdown(5)
+    assert "session 3" in caplog.text
+    assert "model down" in caplog.text
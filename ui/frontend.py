@@ -1,7 +1,10 @@
+import json
 import streamlit as st
 import requests
 
 API = "http://127.0.0.1:5000"
+RENDER_WINDOW = 20  # messages drawn per rerun; older ones sit behind "Show earlier messages"
+HTTP_CACHE_SIZE = 50  # GET responses kept for If-None-Match revalidation
 
 st.set_page_config(page_title="ICD Chatbot", page_icon="🩺", layout="wide")
 
@@ -18,6 +21,14 @@ if "active_session" not in st.session_state:
     st.session_state.active_session = None
 if "sessions_cache" not in st.session_state:
     st.session_state.sessions_cache = []  # list of {id,title,...}
+if "sessions_cursor" not in st.session_state:
+    st.session_state.sessions_cursor = None  # cursor for the next (older) sessions page
+if "messages_cursor" not in st.session_state:
+    st.session_state.messages_cursor = None  # cursor for earlier messages of the active session
+if "visible" not in st.session_state:
+    st.session_state.visible = RENDER_WINDOW  # how many of the newest messages are drawn
+if "http_cache" not in st.session_state:
+    st.session_state.http_cache = {}  # (path, params) -> (etag, json)
 
 # API helpers
 def api_register(u, p):
@@ -31,11 +42,30 @@ def api_login(u, p):
 def api_logout():
     st.session_state.http.get(f"{API}/logout")
 
-def api_list_sessions():
-    r = st.session_state.http.get(f"{API}/sessions")
-    if r.status_code == 200:
-        return r.json().get("sessions", [])
-    return []
+def cached_get(path: str, params: dict):
+    """GET with the ETag of the last 200 for the same URL; a 304 reuses that body.
+    Returns ``(json, status)``."""
+    cache = st.session_state.http_cache
+    key = (path, tuple(sorted(params.items())))
+    cached = cache.get(key)
+    headers = {"If-None-Match": cached[0]} if cached else {}
+    r = st.session_state.http.get(f"{API}{path}", params=params, headers=headers)
+    if r.status_code == 304 and cached:
+        return cached[1], 200
+    data = r.json()
+    if r.status_code == 200 and r.headers.get("ETag"):
+        cache.pop(key, None)
+        cache[key] = (r.headers["ETag"], data)
+        if len(cache) > HTTP_CACHE_SIZE:
+            cache.pop(next(iter(cache)))
+    return data, r.status_code
+
+def api_list_sessions(before: str | None = None):
+    params = {"before": before} if before else {}
+    data, code = cached_get("/sessions", params)
+    if code == 200:
+        return data.get("sessions", []), data.get("next_cursor")
+    return [], None
 
 def api_create_session(name="New Chat"):
     r = st.session_state.http.post(f"{API}/sessions", json={"name": name})
@@ -43,21 +73,86 @@ def api_create_session(name="New Chat"):
         return r.json().get("session_id")
     return None
 
-def api_get_session_messages(session_id: int):
-    r = st.session_state.http.get(f"{API}/sessions/{session_id}/messages")
-    if r.status_code == 200:
-        return r.json().get("messages", [])
-    return []
+def api_get_session_messages(session_id: int, before: str | None = None):
+    params = {"before": before} if before else {}
+    data, code = cached_get(f"/sessions/{session_id}/messages", params)
+    if code == 200:
+        return data.get("messages", []), data.get("next_cursor")
+    return [], None
+
+def refresh_sessions():
+    st.session_state.sessions_cache, st.session_state.sessions_cursor = api_list_sessions()
+
+def title_for(message: str) -> str:
+    # same as server/serialize.session_to_json
+    return message[:60] + "…" if len(message) > 60 else message
 
-def api_send_chat(msg: str, session_id: int | None):
+def touch_session(session_id: int, first_message: str | None = None):
+    """Move a chat to the top of the sidebar after a turn, as /sessions would
+    list it, instead of fetching the list again. ``first_message`` titles a
+    chat that had no turns yet."""
+    sessions = st.session_state.sessions_cache
+    entry = next((s for s in sessions if s.get("id") == session_id), None)
+    if entry is None:
+        entry = {"id": session_id, "title": "New Chat"}
+    else:
+        sessions.remove(entry)
+    if first_message:
+        entry = {**entry, "title": title_for(first_message)}
+    sessions.insert(0, entry)
+
+def open_session(session_id: int | None, messages=(), cursor: str | None = None):
+    st.session_state.active_session = session_id
+    st.session_state.messages = to_tuples(messages)
+    st.session_state.messages_cursor = cursor
+    st.session_state.visible = RENDER_WINDOW
+
+def to_tuples(msgs):
+    return [(m["role"], m["content"], m.get("chat_id")) for m in msgs]
+
+def api_stream_chat(msg: str, session_id: int | None, result: dict):
+    """Yield answer deltas from /chat/stream; final ids or error land in ``result``."""
     payload = {"message": msg}
     if session_id:
         payload["session_id"] = session_id
-    r = st.session_state.http.post(f"{API}/chat", json=payload, timeout=60)
-    return r.json(), r.status_code
+    with st.session_state.http.post(f"{API}/chat/stream", json=payload, stream=True, timeout=(10, 60)) as r:
+        if r.status_code != 200:
+            result["error"] = r.json().get("error", "Error")
+            return
+        event = None
+        for line in r.iter_lines(decode_unicode=True):
+            if not line:
+                event = None
+            elif line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                data = json.loads(line[len("data: "):])
+                if event is None:
+                    yield data["delta"]
+                else:
+                    result.update(data)
 
 def api_feedback(chat_id, fb):
-    st.session_state.http.post(f"{API}/feedback", json={"chat_id": chat_id, "feedback": fb})
+    r = st.session_state.http.post(f"{API}/feedback", json={"chat_id": chat_id, "feedback": fb})
+    return r.status_code
+
+def feedback_toast(status: int, icon: str):
+    # 202: queued, written within a few seconds
+    if status == 202:
+        st.toast(f"Feedback saved: {icon}")
+    else:
+        st.toast("Feedback could not be saved, try again")
+
+@st.fragment
+def feedback_buttons(chat_id: int):
+    """Like / dislike for one answer; a click reruns only this fragment, not the page."""
+    c1, c2 = st.columns(2)
+    with c1:
+        if st.button("👍 Like", key=f"like_{chat_id}"):
+            feedback_toast(api_feedback(chat_id, "liked"), "👍")
+    with c2:
+        if st.button("👎 Dislike", key=f"dislike_{chat_id}"):
+            feedback_toast(api_feedback(chat_id, "disliked"), "👎")
 
 # UI
 st.title("🩺 ICD Chatbot")
@@ -75,8 +170,10 @@ if not st.session_state.logged_in:
                 st.session_state.logged_in = True
                 st.session_state.username = res.get("username", u)
                 st.session_state.sessions_cache = res.get("sessions", [])
-                st.session_state.active_session = res.get("latest_session_id")
-                st.session_state.messages = [(m["role"], m["content"], m.get("chat_id")) for m in res.get("latest_messages", [])]
+                st.session_state.sessions_cursor = res.get("sessions_next_cursor")
+                open_session(
+                    res.get("latest_session_id"), res.get("latest_messages", []), res.get("latest_messages_next_cursor")
+                )
                 st.success("Logged in!")
                 st.rerun()
             else:
@@ -100,22 +197,29 @@ else:
         if st.button("➕ New Chat", use_container_width=True):
             sid = api_create_session("New Chat")
             if sid:
-                st.session_state.sessions_cache = api_list_sessions()
-                st.session_state.active_session = sid
-                st.session_state.messages = []
+                touch_session(sid)
+                open_session(sid)
                 st.rerun()
 
 
         st.markdown("---")
-        st.caption("Your chats")
+        c1, c2 = st.columns([4, 1])
+        c1.caption("Your chats")
+        # picks up chats made elsewhere; a 304 when nothing changed
+        if c2.button("↻", key="refresh_sessions", help="Refresh"):
+            refresh_sessions()
+            st.rerun()
         # defensive get
         for ses in st.session_state.sessions_cache:
             sid = ses.get("id")
             label = ses.get("title", f"Chat {sid}")
             if st.button(label, key=f"ses_{sid}", use_container_width=True):
-                st.session_state.active_session = sid
-                msgs = api_get_session_messages(sid)
-                st.session_state.messages = [(m["role"], m["content"], m.get("chat_id")) for m in msgs]
+                open_session(sid, *api_get_session_messages(sid))
+                st.rerun()
+        if st.session_state.sessions_cursor:
+            if st.button("Load older chats", use_container_width=True):
+                older, st.session_state.sessions_cursor = api_list_sessions(st.session_state.sessions_cursor)
+                st.session_state.sessions_cache = st.session_state.sessions_cache + older
                 st.rerun()
 
         st.markdown("---")
@@ -123,64 +227,56 @@ else:
             api_logout()
             st.session_state.logged_in = False
             st.session_state.username = ""
-            st.session_state.messages = []
-            st.session_state.active_session = None
+            open_session(None)
             st.session_state.sessions_cache = []
+            st.session_state.sessions_cursor = None
+            st.session_state.http_cache = {}
             st.rerun()
 
     # Main chat area
     chat_container = st.container()
 
     with chat_container:
-        for role, content, chat_id in st.session_state.messages:
+        # only the newest messages are drawn; earlier ones are shown (and fetched) on demand
+        hidden = len(st.session_state.messages) > st.session_state.visible
+        if hidden or (st.session_state.messages_cursor and st.session_state.active_session):
+            if st.button("Show earlier messages"):
+                st.session_state.visible += RENDER_WINDOW
+                if st.session_state.visible > len(st.session_state.messages) and st.session_state.messages_cursor:
+                    older, st.session_state.messages_cursor = api_get_session_messages(
+                        st.session_state.active_session, st.session_state.messages_cursor
+                    )
+                    st.session_state.messages = to_tuples(older) + st.session_state.messages
+                st.rerun()
+        for role, content, chat_id in st.session_state.messages[-st.session_state.visible:]:
             with st.chat_message("user" if role == "user" else "assistant"):
                 st.write(content)
                 if role == "assistant" and chat_id:
-                    c1, c2 = st.columns(2)
-                    with c1:
-                        if st.button("👍 Like", key=f"like_{chat_id}"):
-                            api_feedback(chat_id, "liked")
-                            st.toast("Feedback saved: 👍")
-                    with c2:
-                        if st.button("👎 Dislike", key=f"dislike_{chat_id}"):
-                            api_feedback(chat_id, "disliked")
-                            st.toast("Feedback saved: 👎")
+                    feedback_buttons(chat_id)
 
     prompt = st.chat_input("Ask about an ICD code or title…")
     if prompt:
-        if not st.session_state.active_session:
-            sid = api_create_session("New Chat")
-            if sid:
-                st.session_state.active_session = sid
-                st.session_state.sessions_cache = api_list_sessions()
-
+        # the sidebar shows a chat's first question as its title
+        first_turn = not st.session_state.messages and not st.session_state.messages_cursor
         st.session_state.messages.append(("user", prompt, None))
         with st.chat_message("user"):
             st.write(prompt)
 
         with st.chat_message("assistant"):
-            with st.spinner("Thinking…"):
-                data, code = api_send_chat(prompt, st.session_state.active_session)
-                if code == 200 and "response" in data:
-                    chat_id = data.get("chat_id")
-                    response_text = data["response"]
-                    st.session_state.messages.append(("assistant", response_text, chat_id))
-                    st.write(response_text)
-
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        if st.button("👍", key=f"like_inline_{chat_id}"):
-                            api_feedback(chat_id, "liked")
-                            st.success("You liked the response.")
-                    with col2:
-                        if st.button("👎", key=f"dislike_inline_{chat_id}"):
-                            api_feedback(chat_id, "disliked")
-                            st.error("You disliked the response.")
-
-                    st.session_state.sessions_cache = api_list_sessions()
-                else:
-                    err = data.get("error", "Error")
-                    st.session_state.messages.append(("assistant", err, None))
-                    st.write(err)
+            result = {}
+            try:
+                response_text = st.write_stream(api_stream_chat(prompt, st.session_state.active_session, result))
+            except requests.RequestException as e:
+                response_text, result["error"] = "", str(e)
+            if "session_id" in result:
+                # /chat/stream creates the session when there is none yet
+                st.session_state.active_session = result["session_id"]
+                touch_session(result["session_id"], prompt if first_turn and "chat_id" in result else None)
+            if "chat_id" in result:
+                st.session_state.messages.append(("assistant", response_text, result["chat_id"]))
+            else:
+                err = result.get("error", "Error")
+                st.session_state.messages.append(("assistant", err, None))
+                st.write(err)
 
         st.rerun()